@@ -6,6 +6,11 @@ usage:
     1. install dependencies: pip install mcp numpy scipy scikit-learn
     2. run server: python chart_tools_mcp_server.py
     3. or use npm tool: npx @modelcontextprotocol/inspector python chart_tools_mcp_server.py
+
+stateful mode:
+    register_spec(vega_spec) -> spec_id, then call_tool_by_spec_id(tool_name, spec_id, arguments)
+    returns the tool result with a new spec_id and a small spec_delta instead of the full spec;
+    get_spec(spec_id) fetches the full spec only when the client needs to render it.
 """
 
 from typing import Dict, List, Any, Tuple, Optional, Union
@@ -116,10 +121,13 @@ def highlight_trend(vega_spec: Dict, trend_type: str = "increasing") -> Dict[str
 
 
 @mcp.tool()
-def detect_anomalies(vega_spec: Dict, threshold: float = 2.0) -> Dict[str, Any]:
-    """Detect and highlight anomalies in the view (threshold in standard deviations)"""
+def detect_anomalies(vega_spec: Dict, threshold: Optional[float] = None, method: str = "zscore",
+                     window: int = 7, line_field: Optional[str] = None) -> Dict[str, Any]:
+    """Detect and highlight anomalies per series (method: zscore, rolling, mad; default threshold 2.0 / 2.0 / 3.5)"""
     from tools import line_chart_tools
-    return line_chart_tools.detect_anomalies(vega_spec, threshold=threshold)
+    return line_chart_tools.detect_anomalies(
+        vega_spec, threshold=threshold, method=method, window=window, line_field=line_field
+    )
 
 
 @mcp.tool()
@@ -139,10 +147,13 @@ def filter_lines(vega_spec: Dict, lines_to_remove: List[str], line_field: str =
 
 
 @mcp.tool()
-def show_moving_average(vega_spec: Dict, window_size: int = 3) -> Dict[str, Any]:
-    """Add moving average line"""
+def show_moving_average(vega_spec: Dict, window_size: int = 3, method: str = "mean",
+                        line_field: Optional[str] = None) -> Dict[str, Any]:
+    """Add a per-series moving average line (method: mean, median, ewma) and return the smoothed series"""
     from tools import line_chart_tools
-    return line_chart_tools.show_moving_average(vega_spec, window_size=window_size)
+    return line_chart_tools.show_moving_average(
+        vega_spec, window_size=window_size, method=method, line_field=line_field
+    )
 
 
 @mcp.tool()
@@ -160,6 +171,14 @@ def focus_lines(
     )
 
 
+@mcp.tool()
+def focus_top_series(vega_spec: Dict, top_k: int = 10, score: str = "variance",
+                     line_field: Optional[str] = None) -> Dict[str, Any]:
+    """Keep the top K lines (score: variance, total, mean, latest, max) and fold the rest into an Others band"""
+    from tools import line_chart_tools
+    return line_chart_tools.focus_top_series(vega_spec, top_k=top_k, score=score, line_field=line_field)
+
+
 @mcp.tool()
 def resample_time(
     vega_spec: Dict,
@@ -190,17 +209,28 @@ def select_region(vega_spec: Dict, x_range: Tuple[float, float], y_range: Tuple[
 
 
 @mcp.tool()
-def identify_clusters(vega_spec: Dict, n_clusters: int = 3, method: str = "kmeans") -> Dict[str, Any]:
-    """Identify data clusters"""
+def identify_clusters(vega_spec: Dict, n_clusters: int = 3, method: str = "kmeans",
+                      k_range: Optional[List[int]] = None) -> Dict[str, Any]:
+    """Identify data clusters. Optional k_range (e.g. [2,3,4,5,6]) sweeps k and colors by the best silhouette."""
     from tools import scatter_plot_tools
-    return scatter_plot_tools.identify_clusters(vega_spec, n_clusters=n_clusters, method=method)
+    return scatter_plot_tools.identify_clusters(vega_spec, n_clusters=n_clusters, method=method, k_range=k_range)
 
 
 @mcp.tool()
-def calculate_correlation(vega_spec: Dict, method: str = "pearson") -> Dict[str, Any]:
-    """Calculate correlation coefficient"""
+def calculate_correlation(vega_spec: Dict, method: str = "pearson", use_full_data: bool = False) -> Dict[str, Any]:
+    """Calculate correlation coefficient (use_full_data=True computes exactly over the session's full dataset)"""
     from tools import scatter_plot_tools
-    return scatter_plot_tools.calculate_correlation(vega_spec, method=method)
+    return scatter_plot_tools.calculate_correlation(vega_spec, method=method, use_full_data=use_full_data)
+
+
+@mcp.tool()
+def find_dense_regions(vega_spec: Dict, top_k: int = 3, grid_size: int = 20, window: int = 2,
+                       use_full_data: bool = True) -> Dict[str, Any]:
+    """Find the top-k densest rectangles (x_range/y_range + counts) to zoom or select directly"""
+    from tools import scatter_plot_tools
+    return scatter_plot_tools.find_dense_regions(
+        vega_spec, top_k=top_k, grid_size=grid_size, window=window, use_full_data=use_full_data
+    )
 
 
 @mcp.tool()
@@ -227,10 +257,21 @@ def brush_region(vega_spec: Dict, x_range: Tuple[float, float], y_range: Tuple[f
 
 
 @mcp.tool()
-def show_regression(vega_spec: Dict, method: str = "linear") -> Dict[str, Any]:
-    """Add regression line (linear, log, exp, poly, quad)"""
+def show_regression(vega_spec: Dict, method: str = "linear", use_full_data: bool = False) -> Dict[str, Any]:
+    """Add a precomputed regression line (linear, log, exp, poly, quad, loess); returns coefficients and R²"""
     from tools import scatter_plot_tools
-    return scatter_plot_tools.show_regression(vega_spec, method=method)
+    return scatter_plot_tools.show_regression(vega_spec, method=method, use_full_data=use_full_data)
+
+
+@mcp.tool()
+def aggregate_density(vega_spec: Dict, mode: str = "auto", cell_size: int = 10,
+                      density_threshold: int = 5000, use_full_data: bool = True) -> Dict[str, Any]:
+    """Aggregate a dense scatter into a 2-D histogram rect layer (mode: auto, bins, points)"""
+    from tools import scatter_plot_tools
+    return scatter_plot_tools.aggregate_density(
+        vega_spec, mode=mode, cell_size=cell_size,
+        density_threshold=density_threshold, use_full_data=use_full_data
+    )
 
 
 # ==================== Heatmap Tools ====================
@@ -293,12 +334,14 @@ def filter_cells_by_region(
 
 
 @mcp.tool()
-def cluster_rows_cols(vega_spec: Dict, cluster_rows: bool = True,
-                     cluster_cols: bool = True, method: str = "sum") -> Dict[str, Any]:
-    """Reorder heatmap rows/cols by aggregate (sum/mean/max) of color field"""
+def cluster_rows_cols(vega_spec: Dict, cluster_rows: bool = True, cluster_cols: bool = True,
+                      method: str = "average", metric: str = "euclidean",
+                      n_clusters: Optional[int] = None) -> Dict[str, Any]:
+    """Hierarchically cluster heatmap rows/cols (method: average, complete, single, ward; metric: euclidean, correlation, cosine) and reorder by leaf order"""
     from tools import heatmap_tools
     return heatmap_tools.cluster_rows_cols(
-        vega_spec, cluster_rows=cluster_rows, cluster_cols=cluster_cols, method=method
+        vega_spec, cluster_rows=cluster_rows, cluster_cols=cluster_cols, method=method,
+        metric=metric, n_clusters=n_clusters
     )
 
 
@@ -507,6 +550,81 @@ def reset_hidden_dimensions(vega_spec: Dict) -> Dict[str, Any]:
 
 
 # ============================================================
+# stateful mode: refer to specs by spec_id
+# ============================================================
+# register_spec once, then call_tool_by_spec_id with the id instead of
+# shipping the full vega_spec on every call. Results carry a new spec_id plus
+# a JSON-Patch style spec_delta; get_spec fetches the full spec for rendering.
+
+@mcp.tool()
+def register_spec(vega_spec: Dict) -> Dict[str, Any]:
+    """Register a vega_spec on the server and return its spec_id"""
+    from tools.spec_store import get_spec_store
+    spec_id = get_spec_store().register(vega_spec)
+    return {'success': True, 'spec_id': spec_id}
+
+
+@mcp.tool()
+def get_spec(spec_id: str) -> Dict[str, Any]:
+    """Fetch the full vega_spec stored under spec_id (e.g. for rendering)"""
+    from tools.spec_store import get_spec_store
+    spec = get_spec_store().get(spec_id)
+    if spec is None:
+        return {'success': False, 'error': f'Unknown spec_id: {spec_id}'}
+    return {'success': True, 'spec_id': spec_id, 'vega_spec': spec}
+
+
+@mcp.tool()
+def release_spec(spec_id: str) -> Dict[str, Any]:
+    """Drop a stored spec that the client no longer needs"""
+    from tools.spec_store import get_spec_store
+    released = get_spec_store().release(spec_id)
+    return {'success': released, 'spec_id': spec_id}
+
+
+@mcp.tool()
+def call_tool_by_spec_id(tool_name: str, spec_id: str, arguments: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Run a chart tool against a stored spec. Returns the tool result with a new spec_id and spec_delta instead of the full vega_spec."""
+    from tools.spec_store import get_spec_store, compute_spec_delta
+    store = get_spec_store()
+    spec = store.get(spec_id)
+    if spec is None:
+        return {'success': False, 'error': f'Unknown spec_id: {spec_id}'}
+    tool_fn = _SPEC_TOOLS.get(tool_name)
+    if tool_fn is None:
+        return {'success': False, 'error': f'Tool "{tool_name}" not found'}
+
+    args = {k: v for k, v in (arguments or {}).items() if k != 'vega_spec'}
+    try:
+        result = tool_fn(vega_spec=spec, **args)
+    except TypeError as e:
+        return {'success': False, 'error': f'Invalid arguments for {tool_name}: {e}'}
+
+    result = dict(result)
+    new_spec = result.pop('vega_spec', None)
+    if result.get('success') and new_spec is not None:
+        result['spec_delta'] = compute_spec_delta(spec, new_spec)
+        result['spec_id'] = store.register(new_spec, parent_id=spec_id) if result['spec_delta'] else spec_id
+    else:
+        result['spec_id'] = spec_id
+    result['parent_spec_id'] = spec_id
+    return result
+
+
+def _collect_spec_tools() -> Dict[str, Any]:
+    """All tool wrappers above that take a vega_spec argument"""
+    import inspect
+    return {
+        name: fn for name, fn in globals().items()
+        if inspect.isfunction(fn) and not name.startswith('_')
+        and 'vega_spec' in inspect.signature(fn).parameters
+        and name != 'register_spec'
+    }
+
+
+_SPEC_TOOLS = _collect_spec_tools()
+
+
 # ============================================================
 # run server
 # ============================================================
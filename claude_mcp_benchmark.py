@@ -30,6 +30,8 @@ from mcp.client.stdio import stdio_client
 sys.path.insert(0, str(Path(__file__).parent))
 
 from core.vega_service import get_vega_service
+from tools.spec_client import SpecClient
+from tools.vlm_adapter import vlm_adapter
 
 
 # =============================================================================
@@ -49,89 +51,6 @@ CLAUDE_CONFIG = {
 MCP_SERVER_PATH = Path(__file__).parent / 'chart_tools_mcp_server.py'
 
 
-# =============================================================================
-# MCP Client Helper Functions
-# =============================================================================
-
-def _fix_schema_types(schema: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Fix common incomplete definitions in JSON Schema to pass OpenAI/Qwen/Gemini validation.
-    """
-    if not isinstance(schema, dict):
-        return schema
-    
-    schema.pop("$ref", None)
-    schema.pop("nullable", None)
-    
-    schema_type = schema.get("type")
-    
-    if schema_type == "object":
-        props = schema.get("properties", {})
-        for prop_name, prop_def in props.items():
-            props[prop_name] = _fix_schema_types_with_name(prop_def, prop_name)
-        schema["properties"] = props
-        if "additionalProperties" not in schema:
-            schema["additionalProperties"] = True
-    
-    if schema_type == "array":
-        if "items" not in schema:
-            schema["items"] = {"type": "string"}
-        else:
-            schema["items"] = _fix_schema_types(schema["items"])
-    
-    return schema
-
-
-def _fix_schema_types_with_name(prop_def: Any, prop_name: str) -> Any:
-    """Infer reasonable default items type for arrays based on property name."""
-    if not isinstance(prop_def, dict):
-        return prop_def
-    
-    prop_type = prop_def.get("type")
-    
-    if prop_type == "array" and "items" not in prop_def:
-        name_lower = prop_name.lower()
-        if any(k in name_lower for k in ["range", "position", "coord", "point", "area", "bbox"]):
-            prop_def["items"] = {"type": "number"}
-        elif any(k in name_lower for k in ["id", "name", "label", "category", "field"]):
-            prop_def["items"] = {"type": "string"}
-        else:
-            prop_def["items"] = {"type": "string"}
-    
-    return _fix_schema_types(prop_def)
-
-
-def convert_mcp_tools_to_openai_format(mcp_tools) -> List[Dict[str, Any]]:
-    """Convert MCP tool definitions to OpenAI Function Calling format."""
-    openai_tools = []
-    
-    for tool in mcp_tools:
-        parameters = tool.inputSchema if tool.inputSchema else {
-            "type": "object",
-            "properties": {},
-            "required": []
-        }
-        
-        params = _fix_schema_types(parameters)
-        if "properties" in params and "vega_spec" in params["properties"]:
-            del params["properties"]["vega_spec"]
-        if "required" in params and "vega_spec" in params["required"]:
-            params["required"].remove("vega_spec")
-        
-        openai_tool = {
-            "type": "function",
-            "function": {
-                "name": tool.name,
-                "description": tool.description or "",
-                "parameters": params
-            }
-        }
-        
-        openai_tools.append(openai_tool)
-    
-    return openai_tools
-
-
 # =============================================================================
 # System Prompts
 # =============================================================================
@@ -347,6 +266,8 @@ async def run_single_question_with_mcp(
     
     current_image = render_result['image_base64']
     current_spec = copy.deepcopy(vega_spec)
+    spec_client = SpecClient(mcp_session, current_spec)
+    await spec_client.register()
     
     # Initialize conversation
     system_prompt = get_system_prompt(chart_type)
@@ -405,22 +326,8 @@ async def run_single_question_with_mcp(
                 
                 print(f"      Tool: {tool_name}")
                 
-                # MCP tool call
-                mcp_args = {**tool_args, 'vega_spec': current_spec}
-                mcp_result = await mcp_session.call_tool(
-                    name=tool_name,
-                    arguments=mcp_args
-                )
-                
-                # Parse result
-                tool_result = {}
-                if mcp_result.content:
-                    for content_item in mcp_result.content:
-                        if content_item.type == 'text':
-                            try:
-                                tool_result = json.loads(content_item.text)
-                            except json.JSONDecodeError:
-                                tool_result = {'success': False, 'message': content_item.text}
+                # MCP tool call by spec_id (the full spec is only sent once, at register time)
+                tool_result = await spec_client.call_tool(tool_name, tool_args)
                 
                 all_tool_calls.append({
                     'name': tool_name,
@@ -491,6 +398,8 @@ async def run_single_question_with_mcp(
             print(f"    [{qid}] Done, {i + 1} rounds")
             break
     
+    await spec_client.release()
+    
     # If no explicit answer, merge all insights
     if not final_answer:
         all_insights = []
@@ -582,7 +491,7 @@ async def run_benchmark_async(task_path: str) -> dict:
             # Get tool list
             mcp_tools_response = await mcp_session.list_tools()
             mcp_tools = mcp_tools_response.tools
-            openai_tools = convert_mcp_tools_to_openai_format(mcp_tools)
+            openai_tools = vlm_adapter.mcp_tools_for_run(mcp_tools, chart_type)
             print(f"Retrieved {len(openai_tools)} tools")
             print()
             
@@ -156,6 +156,10 @@ def get_candidate_chart_types(vega_spec: Dict[str, Any]) -> List[ChartType]:
     """
     candidates = []
     
+    # 系列精简后的折线图（原折线在 layer[0]，其后为 Others 带图层）
+    if vega_spec.get('_series_focus'):
+        return [ChartType.LINE_CHART]
+    
     # 获取 mark 类型
     mark = vega_spec.get('mark')
     if isinstance(mark, dict):
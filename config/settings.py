@@ -26,6 +26,10 @@ class Settings:
     
     # ==================== 会话配置 ====================
     SESSION_TIMEOUT: int = int(os.getenv('SESSION_TIMEOUT', '3600'))
+    # 折线图序列数超过上限时自动只保留前 K 条，其余折叠为 Others 带（0 表示关闭）
+    LINE_AUTO_FOCUS_MAX_SERIES: int = int(os.getenv('LINE_AUTO_FOCUS_MAX_SERIES', '20'))
+    LINE_AUTO_FOCUS_TOP_K: int = int(os.getenv('LINE_AUTO_FOCUS_TOP_K', '10'))
+    LINE_AUTO_FOCUS_SCORE: str = os.getenv('LINE_AUTO_FOCUS_SCORE', 'variance')  # variance | total | mean | latest | max
     
     # ==================== Vega 配置 ====================
     VEGA_RENDERER: str = os.getenv('VEGA_RENDERER', 'canvas')
@@ -40,10 +44,34 @@ class Settings:
     VLM_TEMPERATURE: float = 0
     VLM_MAX_TOKENS: int = 2000
     VLM_TOP_P: float = 0.9
+    # 发给模型的工具列表：默认为全部工具的完整描述（与历史基准运行可比）；
+    # 开启后只保留当前图表类型的工具并使用精简描述，减少每轮请求的提示词 token
+    VLM_COMPACT_TOOLS: bool = os.getenv('VLM_COMPACT_TOOLS', 'false').lower() in ('true', '1', 'yes')
     
     # ==================== 工具执行配置 ====================
     TOOL_EXECUTION_TIMEOUT: int = 30  # 秒
     MAX_TOOL_RETRIES: int = 3
+    TOOL_DEFAULT_EXECUTION_POLICY: str = os.getenv('TOOL_DEFAULT_EXECUTION_POLICY', 'thread')  # inline | thread | process
+    TOOL_THREAD_WORKERS: int = int(os.getenv('TOOL_THREAD_WORKERS', '8'))
+    TOOL_PROCESS_WORKERS: int = int(os.getenv('TOOL_PROCESS_WORKERS', '2'))  # process 策略同时运行的单进程 worker 数
+    TOOL_BATCH_MAX_WORKERS: int = int(os.getenv('TOOL_BATCH_MAX_WORKERS', '4'))  # 批量执行只读工具的并发线程数
+    
+    # ==================== 工具执行指标配置 ====================
+    TOOL_HISTORY_SIZE: int = int(os.getenv('TOOL_HISTORY_SIZE', '100'))
+    TOOL_METRICS_SAMPLE_SIZE: int = int(os.getenv('TOOL_METRICS_SAMPLE_SIZE', '1024'))  # 每个工具保留的最近延迟样本数（用于分位数）
+    # 统计 spec 输入/输出字节数需要把完整 spec 序列化为 JSON，开销与数据量成正比，默认关闭（spec_bytes_* 为 0）
+    TOOL_METRICS_MEASURE_PAYLOAD: bool = os.getenv('TOOL_METRICS_MEASURE_PAYLOAD', 'false').lower() in ('true', '1', 'yes')
+    
+    # ==================== 工具结果缓存配置 ====================
+    TOOL_CACHE_ENABLED: bool = os.getenv('TOOL_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+    TOOL_CACHE_MAX_ENTRIES: int = int(os.getenv('TOOL_CACHE_MAX_ENTRIES', '256'))
+    # 磁盘二级缓存（pickle 文件）默认关闭；开启后按总字节数上限淘汰最久未用的文件
+    TOOL_CACHE_DISK_ENABLED: bool = os.getenv('TOOL_CACHE_DISK_ENABLED', 'false').lower() in ('true', '1', 'yes')
+    TOOL_CACHE_DISK_MAX_BYTES: int = int(os.getenv('TOOL_CACHE_DISK_MAX_BYTES', str(256 * 1024 * 1024)))
+    TOOL_CACHE_DIR: Path = Path(os.getenv('TOOL_CACHE_DIR', str(Path(__file__).parent.parent / 'cache' / 'tool_results')))
+    
+    # ==================== MCP 有状态模式配置 ====================
+    SPEC_STORE_MAX_ENTRIES: int = int(os.getenv('SPEC_STORE_MAX_ENTRIES', '256'))
     
     # ==================== 日志配置 ====================
     LOG_FORMAT: str = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -63,6 +91,12 @@ class Settings:
     # ==================== Vega 渲染配置 ====================
     VEGA_REQUIRE_CLI: bool = os.getenv('VEGA_REQUIRE_CLI', 'false').lower() in ('true', '1', 'yes')
     # 如果设置为 True，将只使用 vega-cli，不使用 mock 渲染
+    # 折线图渲染前按视图宽度降采样：lttb | m4 | none
+    VEGA_LINE_DOWNSAMPLE: str = os.getenv('VEGA_LINE_DOWNSAMPLE', 'lttb').lower()
+    VEGA_LINE_DOWNSAMPLE_POINTS_PER_PX: float = float(os.getenv('VEGA_LINE_DOWNSAMPLE_POINTS_PER_PX', '1.0'))
+    # 热力图渲染前按视图分辨率合并单元格（块内聚合）：auto（与 color 聚合一致）| mean | sum | min | max | count | median | none
+    VEGA_HEATMAP_LOD: str = os.getenv('VEGA_HEATMAP_LOD', 'auto').lower()
+    VEGA_HEATMAP_LOD_MIN_CELL_PX: float = float(os.getenv('VEGA_HEATMAP_LOD_MIN_CELL_PX', '2.0'))
     
     @classmethod
     def validate(cls) -> bool:
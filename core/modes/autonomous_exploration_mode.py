@@ -8,6 +8,7 @@ from tools import get_tool_executor
 from prompts import get_prompt_manager
 from config.settings import Settings
 from core.utils import app_logger, get_spec_data_count
+from tools.heatmap_lod import lod_message
 
 
 class AutonomousExplorationMode:
@@ -34,10 +35,13 @@ class AutonomousExplorationMode:
         
         # 首次调用：初始化第一条user消息
         if len(messages) == 0:
+            # 初始视图渲染时热力图按分辨率合并过，告知 agent
+            initial_lod = context.get('heatmap_lod') if context else None
+            initial_note = f"\n（{lod_message(initial_lod)}）" if initial_lod else ""
             messages.append({
                 "role": "user",
                 "content": [
-                    {"text": f"请自主探索这个视图，探索方向：{user_query}"},
+                    {"text": f"请自主探索这个视图，探索方向：{user_query}{initial_note}"},
                     {"image": f"data:image/png;base64,{image_base64}"}
                 ]
             })
@@ -142,6 +146,8 @@ class AutonomousExplorationMode:
                             iteration_record["images"].append(current_image)
                             
                             success_msg = tool_result.get("message", "操作完成")
+                            if render_result.get("heatmap_lod"):
+                                success_msg += f"\n（{lod_message(render_result['heatmap_lod'])}）"
                             messages.append({
                                 "role": "user",
                                 "content": [
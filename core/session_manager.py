@@ -12,13 +12,13 @@ import time
 
 from config.chart_types import ChartType, get_candidate_chart_types
 from config.intent_types import IntentType
+from config.settings import Settings
 from core.data_manager import LargeDatasetManager
 from core.vlm_service import get_vlm_service
 from core.vega_service import get_vega_service
 from core.modes import ChitchatMode, GoalOrientedMode, AutonomousExplorationMode
 from prompts import get_prompt_manager
 from core.utils import app_logger, get_spec_data_count, get_spec_data_values, is_vega_full_spec
-from tools import sankey_tools
 
 
 class SessionManager:
@@ -56,6 +56,9 @@ class SessionManager:
         if data_manager:
             initial_values = data_manager.init_sample()
             working_spec.setdefault("data", {})["values"] = initial_values
+            # let use_full_data tools reach the full values held by the manager (not only full_data_path)
+            from tools.data_cache import register_full_values
+            working_spec.setdefault("_metadata", {})["full_data_key"] = register_full_values(data_manager.full_values)
             app_logger.info(
                 f"large dataset detected: {original_count} points -> "
                 f"sampled to {len(initial_values)} points (view_limit={data_manager.view_limit})"
@@ -66,6 +69,12 @@ class SessionManager:
         # Sankey diagram auto collapse: if it is a Vega format and the number of nodes is too many
         working_spec = self._maybe_auto_collapse_sankey(working_spec)
         
+        # the session's reset target keeps every series; the focused view below carries its own way back
+        original_spec = working_spec
+        
+        # line chart with too many series: keep the top K series, fold the rest into an Others band
+        working_spec = self._maybe_focus_top_series(working_spec)
+        
         # render the initial view
         render_result = self.vega.render(working_spec)
         
@@ -83,8 +92,9 @@ class SessionManager:
         self.sessions[session_id] = {
             "session_id": session_id,
             "vega_spec": working_spec,
-            "original_spec": working_spec,  # 保存原始规范
+            "original_spec": original_spec,  # 保存原始规范
             "current_image": render_result["image_base64"],
+            "heatmap_lod": render_result.get("heatmap_lod"),
             "chart_type": chart_type,
             "conversation_history": [],
             "created_at": time.time(),
@@ -189,6 +199,7 @@ class SessionManager:
             return vega_spec
         
         # call auto collapse
+        from tools import sankey_tools
         result = sankey_tools.auto_collapse_by_rank(vega_spec, top_n=nodes_per_layer)
         
         if result.get("success"):
@@ -203,6 +214,49 @@ class SessionManager:
             app_logger.warning(f"Sankey auto-collapse failed: {result.get('error')}")
             return vega_spec
     
+    def _maybe_focus_top_series(self, vega_spec: Dict) -> Dict:
+        """
+        Line chart auto series reduction: if the number of color/detail series exceeds
+        Settings.LINE_AUTO_FOCUS_MAX_SERIES, keep the top K series and fold the rest into an "Others" band
+        
+        similar to the Sankey auto collapse; the focused spec keeps a compact copy of the full view (_original_view)
+        and the session's original_spec is saved before focusing, so reset_view restores all series
+        
+        Args:
+            vega_spec: Vega-Lite specification
+        
+        Returns:
+            the vega_spec that may have been reduced
+        """
+        max_series = Settings.LINE_AUTO_FOCUS_MAX_SERIES
+        if max_series <= 0 or is_vega_full_spec(vega_spec) or 'layer' in vega_spec:
+            return vega_spec
+        
+        mark = vega_spec.get("mark")
+        mark_type = mark.get("type") if isinstance(mark, dict) else mark
+        encoding = vega_spec.get("encoding", {})
+        series_field = (encoding.get("color") or {}).get("field") or (encoding.get("detail") or {}).get("field")
+        values = get_spec_data_values(vega_spec) or []
+        if mark_type != "line" or not series_field or not values:
+            return vega_spec
+        
+        series_count = len({json.dumps(row.get(series_field), default=str) for row in values if isinstance(row, dict)})
+        if series_count <= max_series:
+            return vega_spec
+        
+        from tools import line_chart_tools
+        result = line_chart_tools.focus_top_series(
+            vega_spec, top_k=Settings.LINE_AUTO_FOCUS_TOP_K, score=Settings.LINE_AUTO_FOCUS_SCORE
+        )
+        if result.get("success"):
+            app_logger.info(
+                f"line chart auto-focused: {series_count} series -> kept top {Settings.LINE_AUTO_FOCUS_TOP_K} "
+                f"by {Settings.LINE_AUTO_FOCUS_SCORE}, {result.get('folded_count', 0)} folded into Others"
+            )
+            return result["vega_spec"]
+        app_logger.warning(f"line series auto-focus failed: {result.get('error')}")
+        return vega_spec
+    
     def _identify_chart_type(self, vega_spec: Dict, image_base64: str) -> ChartType:
         """identify the chart type"""
         # 首先从Vega规范推测
@@ -413,6 +467,7 @@ class SessionManager:
         render_result = self.vega.render(session["vega_spec"])
         if render_result.get("success"):
             session["current_image"] = render_result["image_base64"]
+            session["heatmap_lod"] = render_result.get("heatmap_lod")
         
         return {"success": True, "message": "View reset to original state"}
 
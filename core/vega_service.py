@@ -146,6 +146,10 @@ class VegaService:
         Rendering strategy:
         - Always use vega-cli (vl2png for Vega-Lite, vg2png for Vega)
         - If CLI not available, use mock rendering
+        - Tool-derived row columns (e.g. cluster labels, see tools.row_columns) are joined onto the rows first,
+          and packed tool snapshots are left out of the rendered spec
+        - Long line series are first downsampled to the view width (Settings.VEGA_LINE_DOWNSAMPLE)
+        - Heatmaps with sub-pixel cells are binned to the view resolution (Settings.VEGA_HEATMAP_LOD)
         
         Args:
             vega_spec: Vega-Lite or Vega JSON specification
@@ -160,6 +164,100 @@ class VegaService:
                 "error": str
             }
         """
+        render_spec = self._prepare_tool_state_for_render(vega_spec)
+        render_spec, downsampling = self._downsample_for_render(render_spec)
+        render_spec, heatmap_lod = self._heatmap_lod_for_render(render_spec)
+        result = self._render_spec(render_spec, output_format)
+        if downsampling.get('applied') and isinstance(result, dict):
+            result['downsampling'] = downsampling
+        if heatmap_lod.get('applied') and isinstance(result, dict):
+            result['heatmap_lod'] = heatmap_lod
+        return result
+    
+    # tool state that only the tools read back; it is not sent to the renderer
+    _RENDER_DROPPED_STATE = ('_avs_density', '_original_view')
+    
+    def _prepare_tool_state_for_render(self, vega_spec: Dict) -> Dict:
+        """
+        Join the compact row columns stored in `_avs_columns` onto data.values (see tools.row_columns)
+        and leave out the packed snapshots kept for the tools (density points, the pre-focus view).
+
+        Returns the spec to render; the caller's spec is left unchanged.
+        """
+        if not isinstance(vega_spec, dict):
+            return vega_spec
+        if any(key in vega_spec for key in self._RENDER_DROPPED_STATE):
+            vega_spec = {k: v for k, v in vega_spec.items() if k not in self._RENDER_DROPPED_STATE}
+        if '_avs_columns' not in vega_spec:
+            return vega_spec
+        try:
+            from tools.row_columns import join_row_columns
+            return join_row_columns(vega_spec)
+        except Exception as e:  # noqa: BLE001
+            app_logger.warning(f"Row column join skipped: {e}")
+            return vega_spec
+    
+    def _downsample_for_render(self, vega_spec: Dict):
+        """
+        Downsample long line series to the view width (LTTB/M4, see tools.downsampling) before rendering.
+
+        Returns (spec to render, downsampling info); the caller's spec is left unchanged.
+        """
+        method = Settings.VEGA_LINE_DOWNSAMPLE
+        if method == 'none' or not isinstance(vega_spec, dict) or self._is_full_vega_spec(vega_spec):
+            return vega_spec, {'applied': False}
+        try:
+            from tools.downsampling import downsample_line_spec
+            width = vega_spec.get('width')
+            if not isinstance(width, (int, float)):
+                width = self.default_width
+            render_spec, info = downsample_line_spec(
+                vega_spec, width=width, method=method,
+                points_per_px=Settings.VEGA_LINE_DOWNSAMPLE_POINTS_PER_PX
+            )
+            if info.get('applied'):
+                app_logger.info(
+                    f"Line downsampling ({method}): {info['original_points']} -> {info['rendered_points']} points"
+                )
+            return render_spec, info
+        except Exception as e:  # noqa: BLE001
+            app_logger.warning(f"Line downsampling skipped: {e}")
+            return vega_spec, {'applied': False}
+    
+    def _heatmap_lod_for_render(self, vega_spec: Dict):
+        """
+        Bin heatmap cells to the view resolution before rendering (see tools.heatmap_lod).
+
+        Rows / columns narrower than VEGA_HEATMAP_LOD_MIN_CELL_PX pixels are merged into blocks, so the
+        renderer only receives one row per non-empty block. Returns (spec to render, LOD info); the
+        caller's spec is left unchanged.
+        """
+        aggregate = Settings.VEGA_HEATMAP_LOD
+        if aggregate == 'none' or not isinstance(vega_spec, dict) or self._is_full_vega_spec(vega_spec):
+            return vega_spec, {'applied': False}
+        try:
+            from tools.heatmap_lod import lod_heatmap_spec
+            width = vega_spec.get('width')
+            height = vega_spec.get('height')
+            render_spec, info = lod_heatmap_spec(
+                vega_spec,
+                width=width if isinstance(width, (int, float)) else self.default_width,
+                height=height if isinstance(height, (int, float)) else self.default_height,
+                aggregate=aggregate,
+                min_cell_px=Settings.VEGA_HEATMAP_LOD_MIN_CELL_PX
+            )
+            if info.get('applied'):
+                app_logger.info(
+                    f"Heatmap LOD ({info['aggregate']}): {info['cells'][0]}x{info['cells'][1]} cells -> "
+                    f"{info['bins'][0]}x{info['bins'][1]} bins"
+                )
+            return render_spec, info
+        except Exception as e:  # noqa: BLE001
+            app_logger.warning(f"Heatmap LOD skipped: {e}")
+            return vega_spec, {'applied': False}
+    
+    def _render_spec(self, vega_spec: Dict, output_format: str = "png") -> Dict[str, Any]:
+        """render the (already prepared) specification"""
         try:
             # Always use CLI rendering (no altair)
             if self.require_cli:
@@ -21,6 +21,8 @@ from mcp.client.stdio import stdio_client
 sys.path.insert(0, str(Path(__file__).parent))
 
 from core.vega_service import get_vega_service
+from tools.spec_client import SpecClient
+from tools.vlm_adapter import vlm_adapter
 
 
 # =============================================================================
@@ -41,92 +43,6 @@ GROK_CONFIG = {
 MCP_SERVER_PATH = Path(__file__).parent / 'chart_tools_mcp_server.py'
 
 
-# =============================================================================
-# MCP 工具 Schema 标准化
-# =============================================================================
-
-def _fix_schema_types(schema: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    修复 JSON Schema 常见不完整定义，适配 OpenAI/Grok 校验：
-    - array: 必须包含 items
-    - object: 建议添加 additionalProperties
-    - 去除 $ref / nullable
-    """
-    if not isinstance(schema, dict):
-        return schema
-    
-    schema.pop("$ref", None)
-    schema.pop("nullable", None)
-    
-    schema_type = schema.get("type")
-    
-    if schema_type == "object":
-        props = schema.get("properties", {})
-        for prop_name, prop_def in props.items():
-            props[prop_name] = _fix_schema_types_with_name(prop_def, prop_name)
-        schema["properties"] = props
-        if "additionalProperties" not in schema:
-            schema["additionalProperties"] = True
-    
-    if schema_type == "array":
-        if "items" not in schema:
-            schema["items"] = {"type": "string"}
-        else:
-            schema["items"] = _fix_schema_types(schema["items"])
-    
-    return schema
-
-
-def _fix_schema_types_with_name(prop_def: Any, prop_name: str) -> Any:
-    """根据字段名对 array 的 items 做合理默认推断。"""
-    if not isinstance(prop_def, dict):
-        return prop_def
-    
-    prop_type = prop_def.get("type")
-    if prop_type == "array" and "items" not in prop_def:
-        name_lower = prop_name.lower()
-        if any(k in name_lower for k in ["range", "position", "coord", "point", "area", "bbox"]):
-            prop_def["items"] = {"type": "number"}
-        elif any(k in name_lower for k in ["id", "name", "label", "category", "field"]):
-            prop_def["items"] = {"type": "string"}
-        else:
-            prop_def["items"] = {"type": "string"}
-    return _fix_schema_types(prop_def)
-
-
-def convert_mcp_tools_to_openai_format(mcp_tools) -> List[Dict[str, Any]]:
-    """
-    将 MCP 工具定义转换为 OpenAI Function Calling 格式，并做 Schema 标准化。
-    """
-    openai_tools = []
-    
-    for tool in mcp_tools:
-        parameters = tool.inputSchema if tool.inputSchema else {
-            "type": "object",
-            "properties": {},
-            "required": []
-        }
-        
-        params = _fix_schema_types(parameters)
-        if "properties" in params and "vega_spec" in params["properties"]:
-            del params["properties"]["vega_spec"]
-        if "required" in params and "vega_spec" in params["required"]:
-            params["required"].remove("vega_spec")
-        
-        openai_tool = {
-            "type": "function",
-            "function": {
-                "name": tool.name,
-                "description": tool.description or "",
-                "parameters": params
-            }
-        }
-        
-        openai_tools.append(openai_tool)
-    
-    return openai_tools
-
-
 # =============================================================================
 # 提示词（含防重复/早结束指引）
 # =============================================================================
@@ -346,7 +262,11 @@ async def run_benchmark_async(task_path: str) -> dict:
             mcp_tools = mcp_tools_response.tools
             print(f"🔧 从 MCP 获取到 {len(mcp_tools)} 个工具")
             
-            openai_tools = convert_mcp_tools_to_openai_format(mcp_tools)
+            openai_tools = vlm_adapter.mcp_tools_for_run(mcp_tools, chart_type)
+            
+            # 有状态 MCP 模式：spec 只注册一次，之后按 spec_id 调用工具
+            spec_client = SpecClient(mcp_session, current_spec)
+            await spec_client.register()
             
             # 7. 初始化对话
             system_prompt = get_system_prompt(chart_type)
@@ -417,23 +337,9 @@ async def run_benchmark_async(task_path: str) -> dict:
                         print(f"\n 通过 MCP 调用工具: {tool_name}")
                         print(f"   参数: {json.dumps(tool_args, ensure_ascii=False)}")
                         
-                        mcp_args = {**tool_args, 'vega_spec': current_spec}
-                        
-                        mcp_result = await mcp_session.call_tool(
-                            name=tool_name,
-                            arguments=mcp_args
-                        )
-                        
-                        print(f"   ↩️ MCP 原始返回: {mcp_result.content}")
-                        
-                        tool_result = {}
-                        if mcp_result.content:
-                            for content_item in mcp_result.content:
-                                if content_item.type == 'text':
-                                    try:
-                                        tool_result = json.loads(content_item.text)
-                                    except json.JSONDecodeError:
-                                        tool_result = {'success': False, 'message': content_item.text}
+                        # 按 spec_id 调用 MCP 工具（完整 spec 只在注册时发送一次）
+                        tool_result = await spec_client.call_tool(tool_name, tool_args)
+                        print(f"   ↩️ MCP 返回: {tool_result.get('message') or tool_result.get('error', '')}")
                         
                         all_tools_called.append(tool_name)
                         
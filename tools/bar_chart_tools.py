@@ -19,13 +19,14 @@ def _datum_ref(field: str) -> str:
 
 import json
 import copy
-import pandas as pd
 
 def sort_bars(vega_spec: dict, order: str = "descending", by_subcategory: str = None) -> dict:
     """
     针对带有聚合（如mean）和颜色分组的条形图进行排序的增强版函数。
     统一使用 Pandas 预计算 + 显式数组排序，兼容所有渲染环境。
     """
+    import pandas as pd
+
     new_spec = copy.deepcopy(vega_spec)
     enc = new_spec.get('encoding', {})
 
@@ -136,6 +137,8 @@ def filter_categories(vega_spec: Dict, categories: List[str]) -> Dict[str, Any]:
 def highlight_top_n(vega_spec: Dict, n: int = 5, order: str = "descending") -> Dict[str, Any]:
     """Highlight top N bars by aggregated value (supports stacked/grouped charts)"""
     from collections import defaultdict
+    from .predicates import membership_test
+
     new_spec = copy.deepcopy(vega_spec)
     
     data = new_spec.get('data', {}).get('values', [])
@@ -167,10 +170,8 @@ def highlight_top_n(vega_spec: Dict, n: int = 5, order: str = "descending") -> D
         return {'success': False, 'error': 'No categories found'}
     
     # Build condition using x_field (category) instead of y_field (value)
-    # Use bracket notation for field names (handles spaces and special chars)
-    def quote(v):
-        return f"'{v}'" if isinstance(v, str) else str(v)
-    test_expr = ' || '.join([f"datum['{x_field}'] == {quote(c)}" for c in top_categories])
+    # Large n uses an indexof list / lookup table instead of one clause per category
+    test_expr, _ = membership_test(new_spec, 'top_n', _datum_ref(x_field), top_categories)
     
     if 'encoding' not in new_spec:
         new_spec['encoding'] = {}
@@ -528,6 +529,8 @@ def add_bars(vega_spec: Dict, values: List[Any], x_field: Optional[str] = None)
     Add whole bars (x categories). Works for stacked or grouped bars.
     If the requested category isn't present in current data, tries to load from _metadata.full_data_path.
     """
+    from .predicates import membership_test
+
     new_spec = copy.deepcopy(vega_spec)
     field, channel = _detect_x_category_field(new_spec, x_field=x_field)
     if not field or not channel:
@@ -565,8 +568,9 @@ def add_bars(vega_spec: Dict, values: List[Any], x_field: Optional[str] = None)
 
     # Update filter
     filt = _find_or_create_visibility_filter_transform(new_spec)
-    category_str = ",".join([json.dumps(v, ensure_ascii=False) for v in sorted(visible, key=lambda x: str(x))])
-    filt["filter"] = f"indexof([{category_str}], {_datum_ref(field)}) >= 0"
+    filt["filter"], _ = membership_test(
+        new_spec, "bar_visibility", _datum_ref(field), sorted(visible, key=lambda x: str(x))
+    )
 
     new_spec["_bar_visibility_state"] = {
         "mode": "x",
@@ -586,6 +590,8 @@ def add_bars(vega_spec: Dict, values: List[Any], x_field: Optional[str] = None)
 
 def remove_bars(vega_spec: Dict, values: List[Any], x_field: Optional[str] = None) -> Dict[str, Any]:
     """Remove whole bars (x categories) by hiding them via a single managed transform filter."""
+    from .predicates import membership_test
+
     new_spec = copy.deepcopy(vega_spec)
     field, channel = _detect_x_category_field(new_spec, x_field=x_field)
     if not field or not channel:
@@ -605,8 +611,9 @@ def remove_bars(vega_spec: Dict, values: List[Any], x_field: Optional[str] = Non
             actually_removed.append(v)
 
     filt = _find_or_create_visibility_filter_transform(new_spec)
-    category_str = ",".join([json.dumps(v, ensure_ascii=False) for v in sorted(visible, key=lambda x: str(x))])
-    filt["filter"] = f"indexof([{category_str}], {_datum_ref(field)}) >= 0"
+    filt["filter"], _ = membership_test(
+        new_spec, "bar_visibility", _datum_ref(field), sorted(visible, key=lambda x: str(x))
+    )
 
     new_spec["_bar_visibility_state"] = {
         "mode": "x",
@@ -633,6 +640,8 @@ def add_bar_items(
     Add individual bar items by (x, sub) pair. Works for stacked (color) and grouped (xOffset) bars.
     items: [{"x": <x_value>, "sub": <sub_value>}, ...]
     """
+    from .predicates import membership_test
+
     new_spec = copy.deepcopy(vega_spec)
     x_f, _ = _detect_x_category_field(new_spec, x_field=x_field)
     sub_f = _detect_sub_field(new_spec, sub_field=sub_field)
@@ -680,12 +689,11 @@ def add_bar_items(
         else:
             still_missing.append(p)
 
-    xr, sr = _datum_ref(x_f), _datum_ref(sub_f)
     filt = _find_or_create_visibility_filter_transform(new_spec)
-    parts = []
-    for xv, sv in sorted(visible_pairs, key=lambda t: (str(t[0]), str(t[1]))):
-        parts.append(f"({xr} == {json.dumps(xv, ensure_ascii=False)} && {sr} == {json.dumps(sv, ensure_ascii=False)})")
-    filt["filter"] = " || ".join(parts) if parts else "false"
+    filt["filter"], _ = membership_test(
+        new_spec, "bar_visibility", [_datum_ref(x_f), _datum_ref(sub_f)],
+        sorted(visible_pairs, key=lambda t: (str(t[0]), str(t[1])))
+    )
 
     new_spec["_bar_visibility_state"] = {
         "mode": "item",
@@ -711,6 +719,8 @@ def remove_bar_items(
     sub_field: Optional[str] = None,
 ) -> Dict[str, Any]:
     """Remove individual bar items by (x, sub) pair by updating the managed filter."""
+    from .predicates import membership_test
+
     new_spec = copy.deepcopy(vega_spec)
     x_f, _ = _detect_x_category_field(new_spec, x_field=x_field)
     sub_f = _detect_sub_field(new_spec, sub_field=sub_field)
@@ -742,12 +752,11 @@ def remove_bar_items(
             visible_pairs.remove(p)
             actually_removed.append(p)
 
-    xr, sr = _datum_ref(x_f), _datum_ref(sub_f)
     filt = _find_or_create_visibility_filter_transform(new_spec)
-    parts = []
-    for xv, sv in sorted(visible_pairs, key=lambda t: (str(t[0]), str(t[1]))):
-        parts.append(f"({xr} == {json.dumps(xv, ensure_ascii=False)} && {sr} == {json.dumps(sv, ensure_ascii=False)})")
-    filt["filter"] = " || ".join(parts) if parts else "false"
+    filt["filter"], _ = membership_test(
+        new_spec, "bar_visibility", [_datum_ref(x_f), _datum_ref(sub_f)],
+        sorted(visible_pairs, key=lambda t: (str(t[0]), str(t[1])))
+    )
 
     new_spec["_bar_visibility_state"] = {
         "mode": "item",
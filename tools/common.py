@@ -21,126 +21,6 @@ def _datum_ref(field: str) -> str:
 
 # ==================== 感知类 API (Perception APIs) ====================
 
-def _get_primary_encoding(vega_spec: Dict[str, Any]) -> Dict[str, Any]:
-    """Prefer layer[0].encoding when present (common for line/scatter)."""
-    if isinstance(vega_spec.get('layer'), list) and len(vega_spec['layer']) > 0:
-        enc = vega_spec['layer'][0].get('encoding', {})
-        return enc if isinstance(enc, dict) else {}
-    enc = vega_spec.get('encoding', {})
-    return enc if isinstance(enc, dict) else {}
-
-
-def _coerce_comparable(v: Any) -> Any:
-    """Coerce values for range comparisons (numbers, ISO dates)."""
-    if v is None:
-        return None
-    if isinstance(v, (int, float)):
-        return v
-    if isinstance(v, str):
-        s = v.strip()
-        # number-like
-        try:
-            return float(s)
-        except Exception:
-            pass
-        # ISO-ish datetime
-        try:
-            return datetime.fromisoformat(s.replace("Z", "+00:00"))
-        except Exception:
-            return s
-    return v
-
-
-def _apply_selected_region(data: List[Dict[str, Any]], vega_spec: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """Apply _selected_region (from scatter tools) if present."""
-    region = vega_spec.get('_selected_region')
-    if not isinstance(region, dict):
-        return data
-    x_field = region.get('x_field')
-    y_field = region.get('y_field')
-    x_range = region.get('x_range')
-    y_range = region.get('y_range')
-    if not x_field or not y_field or not isinstance(x_range, list) or not isinstance(y_range, list):
-        return data
-    if len(x_range) != 2 or len(y_range) != 2:
-        return data
-
-    xl, xu = _coerce_comparable(x_range[0]), _coerce_comparable(x_range[1])
-    yl, yu = _coerce_comparable(y_range[0]), _coerce_comparable(y_range[1])
-
-    out: List[Dict[str, Any]] = []
-    for r in data:
-        if not isinstance(r, dict):
-            continue
-        xv = _coerce_comparable(r.get(x_field))
-        yv = _coerce_comparable(r.get(y_field))
-        if xv is None or yv is None:
-            continue
-        try:
-            if xl <= xv <= xu and yl <= yv <= yu:
-                out.append(r)
-        except Exception:
-            # if comparison fails, do not filter it out aggressively
-            out.append(r)
-    return out
-
-
-def get_view_spec(vega_spec: Dict) -> Dict[str, Any]:
-    """
-    返回当前视图的结构化状态信息
-    
-    Args:
-        vega_spec: Vega-Lite/Vega 规范
-        
-    Returns:
-        视图状态的结构化描述
-    """
-    # 计算 spec hash
-    spec_str = json.dumps(vega_spec, sort_keys=True, default=str)
-    spec_hash = hashlib.sha256(spec_str.encode()).hexdigest()[:16]
-    
-    # 检测图表类型
-    chart_type = _detect_chart_type(vega_spec)
-    
-    # 提取数据信息
-    data = _get_spec_data(vega_spec)
-    data_count = len(data) if data else 0
-    
-    # 提取 encoding（支持 layer）
-    encoding = _get_primary_encoding(vega_spec)
-    
-    # 提取 mark
-    mark = vega_spec.get('mark', {})
-    if isinstance(mark, str):
-        mark = {'type': mark}
-    
-    # 提取可见域（从 scale 或 encoding 中，支持 layer）
-    visible_domain = _extract_visible_domain(vega_spec, data)
-    
-    # 提取 transforms
-    transforms = vega_spec.get('transform', [])
-    # 过滤掉内部标记的 transform
-    transforms = [t for t in transforms if not t.get('_avs_tag')]
-    
-    # 提取 selections（从我们的内部状态中）
-    selections = vega_spec.get('_avs_selections', [])
-    
-    return {
-        'success': True,
-        'spec_hash': f'sha256:{spec_hash}',
-        'payload': {
-            'chart_type': chart_type,
-            'title': vega_spec.get('title', ''),
-            'data_count': data_count,
-            'mark': mark,
-            'encoding': _simplify_encoding(encoding),
-            'visible_domain': visible_domain,
-            'transforms': transforms,
-            'selections': selections
-        }
-    }
-
-
 def get_data(vega_spec: Dict, scope: str = 'all') -> Dict[str, Any]:
     """
     返回原始数据
@@ -164,10 +44,13 @@ def get_data(vega_spec: Dict, scope: str = 'all') -> Dict[str, Any]:
             'error': 'No data available in spec'
         }
     
+    transforms = vega_spec.get('transform', [])
+    # 以紧凑列挂载的派生字段（如聚类标签，见 row_columns）也作为数据字段返回
+    from .row_columns import row_columns, join_rows
+    data = join_rows(data, row_columns(vega_spec))
+    
     total_count = len(data)
     fields = list(data[0].keys()) if data else []
-    
-    transforms = vega_spec.get('transform', [])
 
     if scope == 'all':
         result_data = data
@@ -357,7 +240,8 @@ def reset_view(vega_spec: Dict, original_spec: Optional[Dict] = None) -> Dict[st
     """
     Reset view to original state.
     
-    Reads original_spec from vega_spec._original_spec metadata field.
+    Reads original_spec from the vega_spec._original_spec metadata field, or unpacks the
+    compact vega_spec._original_view snapshot (see row_columns.pack_view).
     If original_spec parameter is provided (for backward compatibility), it takes precedence.
     
     Args:
@@ -370,6 +254,9 @@ def reset_view(vega_spec: Dict, original_spec: Optional[Dict] = None) -> Dict[st
     # Try parameter first (backward compatibility), then metadata
     if original_spec is None:
         original_spec = vega_spec.get('_original_spec')
+    if original_spec is None and vega_spec.get('_original_view'):
+        from .row_columns import unpack_view
+        original_spec = unpack_view(vega_spec['_original_view'])
     
     if original_spec is None:
         return {
@@ -428,13 +315,26 @@ def render_chart(vega_spec: Dict) -> Dict[str, Any]:
         render_result = vega_service.render(vega_spec)
         
         if render_result.get("success"):
-            return {
+            result = {
                 'success': True,
                 'operation': 'render',
                 'image_base64': render_result["image_base64"],
                 'renderer': render_result.get("renderer"),
                 'message': f'Rendered using {render_result.get("renderer")}'
             }
+            downsampling = render_result.get("downsampling")
+            if downsampling:
+                result['downsampling'] = downsampling
+                result['message'] += (
+                    f' (line downsampling {downsampling["method"]}: dropped {downsampling["dropped_points"]} '
+                    f'of {downsampling["original_points"]} points)'
+                )
+            heatmap_lod = render_result.get("heatmap_lod")
+            if heatmap_lod:
+                from .heatmap_lod import lod_message
+                result['heatmap_lod'] = heatmap_lod
+                result['message'] += f' ({lod_message(heatmap_lod)})'
+            return result
         else:
             return {
                 'success': False,
@@ -514,6 +414,14 @@ def _detect_chart_type(vega_spec: Dict) -> str:
                 return 'sankey_diagram'
         return 'vega_custom'
     
+    # 密度聚合后的散点图（rect 图层，原始点视图保存在 _avs_density）
+    if vega_spec.get('_avs_density'):
+        return 'scatter_plot'
+    
+    # 系列精简后的折线图（原折线在 layer[0]，其后为 Others 带图层）
+    if vega_spec.get('_series_focus'):
+        return 'line_chart'
+    
     # Vega-Lite: 从 mark 推断
     mark = vega_spec.get('mark', {})
     if isinstance(mark, str):
@@ -626,6 +534,33 @@ def _eval_filter_expr(data: List[Dict], expr: str) -> List[Dict]:
     return result
 
 
+def _filter_by_time_window(data: List[Dict], field: str, channel_encoding: Dict, domain: List) -> Optional[List[Dict]]:
+    """
+    时间轴按可见域过滤：使用按数据缓存的排序时间索引二分定位窗口（时间戳只解析一次）。
+    非时间轴或 domain 无法解析为时间时返回 None（由调用方按通用方式比较）。
+    """
+    from .data_cache import parse_time, time_window, time_column, column_fingerprint
+    
+    is_temporal = channel_encoding.get('type') == 'temporal' or all(
+        isinstance(v, str) and isinstance(_coerce_comparable(v), datetime) for v in domain
+    )
+    if not is_temporal:
+        return None
+    lb, ub = parse_time(domain[0]), parse_time(domain[1])
+    if lb is None or ub is None:
+        return None
+    
+    key = column_fingerprint(data, field)
+    rows = time_window(data, field, lb, ub, key=key)
+    # 与通用比较保持一致：有值但无法解析为时间的行保留
+    times = time_column(data, field, key)
+    unparsed = [i for i in np.flatnonzero(np.isnan(times)).tolist()
+                if isinstance(data[i], dict) and data[i].get(field) is not None]
+    if unparsed:
+        rows = np.union1d(rows, unparsed)
+    return [data[i] for i in rows.tolist() if isinstance(data[i], dict)]
+
+
 def _filter_by_domain(data: List[Dict], vega_spec: Dict) -> List[Dict]:
     """根据可见域过滤数据"""
     encoding = _get_primary_encoding(vega_spec)
@@ -638,6 +573,10 @@ def _filter_by_domain(data: List[Dict], vega_spec: Dict) -> List[Dict]:
             domain = scale.get('domain')
             
             if field and domain and isinstance(domain, list) and len(domain) == 2:
+                windowed = _filter_by_time_window(result, field, encoding[channel], domain)
+                if windowed is not None:
+                    result = windowed
+                    continue
                 lb = _coerce_comparable(domain[0])
                 ub = _coerce_comparable(domain[1])
                 filtered = []
@@ -0,0 +1,406 @@
+"""
+数据缓存（供分析类工具复用的列式数据与派生结果）
+
+- 全量数据：spec._metadata.full_data_path 指向的完整数据集（大数据集会话中 spec 只含采样点），
+  按 (路径, 修改时间, 大小) 缓存；没有文件时为会话登记的全量数据（spec._metadata.full_data_key，见 register_full_values）
+- 数据键：数据行的内容哈希，用作派生结果（聚类模型、直方图、回归拟合等）的缓存键
+- 数值列：按 (数据键, 字段) 缓存的 float64 NumPy 列，缺失/非数值为 NaN
+"""
+
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import json
+import pickle
+import threading
+
+import numpy as np
+
+
+class _LRUCache:
+    """线程安全的有界 LRU 缓存"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key: Any, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_full_values_cache = _LRUCache(8)
+_column_cache = _LRUCache(128)
+_derived_cache = _LRUCache(256)
+_registered_full_values = _LRUCache(32)
+
+_REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _resolve_full_data_path(vega_spec: Dict) -> Optional[Path]:
+    if not isinstance(vega_spec, dict):
+        return None
+    meta = vega_spec.get('_metadata') or {}
+    full_path = meta.get('full_data_path')
+    if not full_path:
+        return None
+    path = Path(full_path)
+    if not path.is_absolute():
+        path = (_REPO_ROOT / full_path).resolve()
+    return path if path.exists() else None
+
+
+def load_full_values(vega_spec: Dict) -> Optional[Tuple[List[Dict[str, Any]], str]]:
+    """
+    读取 _metadata.full_data_path 指向的全量数据
+
+    Returns:
+        (数据行, 数据键)；没有全量数据时返回 None
+    """
+    path = _resolve_full_data_path(vega_spec)
+    if path is None:
+        return None
+    stat = path.stat()
+    cache_key = (str(path), stat.st_mtime_ns, stat.st_size)
+    cached = _full_values_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        data = json.loads(path.read_text(encoding='utf-8'))
+    except Exception:  # noqa: BLE001
+        return None
+    values = None
+    if isinstance(data, dict) and isinstance(data.get('values'), list):
+        values = data['values']
+    elif isinstance(data, dict) and isinstance((data.get('data') or {}).get('values'), list):
+        values = data['data']['values']
+    elif isinstance(data, list):
+        values = data
+    if values is None:
+        return None
+
+    key = 'file:' + hashlib.sha256(repr(cache_key).encode('utf-8')).hexdigest()
+    result = (values, key)
+    _full_values_cache.set(cache_key, result)
+    return result
+
+
+def register_full_values(values: List[Dict[str, Any]]) -> str:
+    """
+    登记会话持有的全量数据（如 LargeDatasetManager.full_values，按引用保存），返回数据键
+
+    会话把该键写入 spec._metadata.full_data_key，use_full_data 的工具据此取回全量数据
+    """
+    key = 'full:' + content_digest(values)
+    _registered_full_values.set(key, values)
+    return key
+
+
+def has_full_data(vega_spec: Dict) -> bool:
+    """spec 是否声明了全量数据（full_data_path 或 full_data_key）"""
+    meta = vega_spec.get('_metadata') if isinstance(vega_spec, dict) else None
+    return isinstance(meta, dict) and bool(meta.get('full_data_path') or meta.get('full_data_key'))
+
+
+def _registered_values(vega_spec: Dict) -> Optional[Tuple[List[Dict[str, Any]], str]]:
+    meta = vega_spec.get('_metadata') if isinstance(vega_spec, dict) else None
+    key = meta.get('full_data_key') if isinstance(meta, dict) else None
+    values = _registered_full_values.get(key) if isinstance(key, str) else None
+    return (values, key) if values is not None else None
+
+
+def spec_values(vega_spec: Dict) -> List[Dict[str, Any]]:
+    """spec 内联数据行（Vega-Lite data.values，或 Vega 第一个含 values 的数据源）"""
+    data = vega_spec.get('data', {}) if isinstance(vega_spec, dict) else {}
+    if isinstance(data, list):
+        for source in data:
+            if isinstance(source, dict) and source.get('values'):
+                return source['values']
+        return []
+    return data.get('values', []) if isinstance(data, dict) else []
+
+
+def data_key(values: List[Dict[str, Any]]) -> str:
+    """数据行的内容哈希"""
+    raw = json.dumps(values, sort_keys=True, default=str, ensure_ascii=False)
+    return 'rows:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def get_dataset(vega_spec: Dict, use_full_data: bool = False) -> Tuple[List[Dict[str, Any]], str, bool]:
+    """
+    获取工具要分析的数据集
+
+    Args:
+        vega_spec: spec
+        use_full_data: 是否优先使用全量数据（_metadata.full_data_path 的文件，其次会话登记的 full_data_key）
+
+    Returns:
+        (数据行, 数据键, 是否为全量数据)；全量数据无法取得时退回视图数据（是否为全量数据为 False）
+    """
+    if use_full_data:
+        full = load_full_values(vega_spec) or _registered_values(vega_spec)
+        if full is not None:
+            return full[0], full[1], True
+    values = spec_values(vega_spec)
+    return values, data_key(values), False
+
+
+def _to_float(value: Any) -> float:
+    if value is None or isinstance(value, bool):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def numeric_column(values: List[Dict[str, Any]], field: str, key: Optional[str] = None) -> np.ndarray:
+    """
+    数据行中某个字段的 float64 列（缺失或非数值为 NaN）
+
+    Args:
+        values: 数据行
+        field: 字段名
+        key: 数据键（提供时按 (key, field) 缓存）
+    """
+    cache_key = (key, field) if key else None
+    if cache_key is not None:
+        cached = _column_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    column = np.fromiter(
+        (_to_float(row.get(field)) if isinstance(row, dict) else np.nan for row in values),
+        dtype=np.float64,
+        count=len(values)
+    )
+    column.setflags(write=False)
+    if cache_key is not None:
+        _column_cache.set(cache_key, column)
+    return column
+
+
+def time_column(values: List[Dict[str, Any]], field: str, key: Optional[str] = None) -> np.ndarray:
+    """
+    时间字段的 float64 列（Unix 毫秒；数值原样保留，无法解析为 NaN），按 (key, field) 缓存
+
+    日期字符串使用 pandas 解析（延迟导入）。
+    """
+    cache_key = (key, field, 'time') if key else None
+    if cache_key is not None:
+        cached = _column_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    raw = [row.get(field) if isinstance(row, dict) else None for row in values]
+    if all(v is None or (isinstance(v, (int, float)) and not isinstance(v, bool)) for v in raw):
+        column = np.array([np.nan if v is None else float(v) for v in raw], dtype=np.float64)
+    else:
+        import pandas as pd
+        parsed = pd.to_datetime(pd.Series([None if v is None else str(v) for v in raw], dtype=object),
+                                errors='coerce', format='mixed', utc=True).dt.tz_convert(None)
+        column = parsed.astype('datetime64[ms]').to_numpy().astype(np.int64).astype(np.float64)
+        column[parsed.isna().to_numpy()] = np.nan
+    column.setflags(write=False)
+    if cache_key is not None:
+        _column_cache.set(cache_key, column)
+    return column
+
+
+class _DigestWriter:
+    """把 pickle 输出直接送入摘要的文件对象"""
+
+    def __init__(self, digest):
+        self.write = digest.update
+
+
+def content_digest(obj: Any) -> str:
+    """
+    值的内容摘要（对 pickle 字节做 blake2b，无法 pickle 时退回 repr）
+
+    序列化保留类型（1 / 1.0 / True / '1' 各不相同），不像 Python hash() 那样会碰撞（如 hash(-1) == hash(-2)），
+    可安全用作缓存键；比 data_key 的排序 JSON 序列化快得多
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        # fast 模式不建 memo（行数据没有循环引用），重复的字符串逐个写出，大列上快数倍
+        pickler = pickle.Pickler(_DigestWriter(digest), protocol=pickle.HIGHEST_PROTOCOL)
+        pickler.fast = True
+        pickler.dump(obj)
+    except Exception:  # noqa: BLE001
+        digest = hashlib.blake2b(repr(obj).encode('utf-8', 'surrogatepass'), digest_size=16)
+    return digest.hexdigest()
+
+
+def column_fingerprint(values: List[Dict[str, Any]], field: str) -> str:
+    """
+    单列的内容指纹（只摘要该字段的值，远快于 data_key），用作单列索引的缓存键
+    """
+    column = [row.get(field) if isinstance(row, dict) else None for row in values]
+    return f'col:{field}:{len(values)}:{content_digest(column)}'
+
+
+def parse_time(value: Any) -> Optional[float]:
+    """将单个时间值（ISO 字符串或数值）转换为与 time_column 相同的 Unix 毫秒；无法解析时返回 None"""
+    parsed = time_column([{'v': value}], 'v')[0]
+    return float(parsed) if np.isfinite(parsed) else None
+
+
+def time_index(values: List[Dict[str, Any]], field: str, key: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    时间字段的排序索引：时间戳只解析一次（int64 毫秒），按数据键缓存；无法解析的行不在索引中
+
+    Returns:
+        (按时间排序的行号, 排序后的 int64 毫秒)
+    """
+    key = key or column_fingerprint(values, field)
+
+    def build():
+        column = time_column(values, field, key)
+        valid = np.flatnonzero(np.isfinite(column))
+        order = valid[np.argsort(column[valid], kind='stable')]
+        epochs = column[order].astype(np.int64)
+        order.setflags(write=False)
+        epochs.setflags(write=False)
+        return order, epochs
+
+    return get_or_compute('time_index', (key, field), build)
+
+
+def time_window(values: List[Dict[str, Any]], field: str, start: float, end: float,
+                key: Optional[str] = None, margin: int = 0) -> np.ndarray:
+    """
+    时间窗口 [start, end]（Unix 毫秒，闭区间）内的行号（原始顺序），二分查找 O(log n) 定位
+
+    Args:
+        margin: 窗口两侧额外保留的行数（按时间顺序）
+    """
+    order, epochs = time_index(values, field, key)
+    lo = int(np.searchsorted(epochs, start, side='left'))
+    hi = int(np.searchsorted(epochs, end, side='right'))
+    lo = max(0, lo - margin)
+    hi = min(len(order), hi + margin)
+    return np.sort(order[lo:hi])
+
+
+def category_codes(values: List[Dict[str, Any]], field: Optional[str], key: Optional[str] = None) -> Tuple[np.ndarray, List[Any]]:
+    """
+    分类字段编码（按首次出现顺序），按 (key, field) 缓存
+
+    Returns:
+        (每行的类别编号 int64 数组, 类别值列表)；field 为空时所有行属于同一类别 None
+    """
+    if not field:
+        return np.zeros(len(values), dtype=np.int64), [None]
+
+    def build():
+        index: Dict[Any, int] = {}
+        labels: List[Any] = []
+        codes = np.empty(len(values), dtype=np.int64)
+        for i, row in enumerate(values):
+            value = row.get(field) if isinstance(row, dict) else None
+            hashable = value if isinstance(value, (str, int, float, bool, type(None))) else json.dumps(value, sort_keys=True, default=str)
+            code = index.get(hashable)
+            if code is None:
+                code = index[hashable] = len(labels)
+                labels.append(value)
+            codes[i] = code
+        codes.setflags(write=False)
+        return codes, labels
+
+    if not key:
+        return build()
+    return get_or_compute('category_codes', (key, field), build)
+
+
+def sorted_index(values: List[Dict[str, Any]], field: str, key: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    字段的排序索引（NaN 排在末尾），按 (key, field) 缓存
+
+    Returns:
+        (行号排列, 排序后的值)
+    """
+    def build():
+        column = numeric_column(values, field, key)
+        order = np.argsort(column, kind='stable')
+        ordered = column[order]
+        order.setflags(write=False)
+        ordered.setflags(write=False)
+        return order, ordered
+
+    if not key:
+        return build()
+    return get_or_compute('sorted_index', (key, field), build)
+
+
+def region_mask(values: List[Dict[str, Any]], key: Optional[str], x_field: str, x_range: Tuple[float, float],
+                y_field: str, y_range: Tuple[float, float]) -> np.ndarray:
+    """
+    矩形区域内的行掩码（闭区间）
+
+    先用 x 的排序索引二分定位候选行，再对候选行向量化检查 y。
+    """
+    order, ordered = sorted_index(values, x_field, key)
+    lo = np.searchsorted(ordered, x_range[0], side='left')
+    hi = np.searchsorted(ordered, x_range[1], side='right')
+    candidates = order[lo:hi]
+    ys = numeric_column(values, y_field, key)[candidates]
+    mask = np.zeros(len(values), dtype=bool)
+    mask[candidates[(ys >= y_range[0]) & (ys <= y_range[1])]] = True
+    return mask
+
+
+def get_or_compute(namespace: str, key: Any, builder: Callable[[], Any]) -> Any:
+    """派生结果缓存：按 (namespace, key) 查找，未命中时调用 builder 计算并缓存"""
+    cache_key = (namespace, key)
+    cached = _derived_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    value = builder()
+    _derived_cache.set(cache_key, value)
+    return value
+
+
+def clear_caches():
+    """清空所有数据缓存"""
+    _full_values_cache.clear()
+    _column_cache.clear()
+    _derived_cache.clear()
+    _registered_full_values.clear()
+
+
+__all__ = [
+    'load_full_values',
+    'register_full_values',
+    'has_full_data',
+    'spec_values',
+    'data_key',
+    'get_dataset',
+    'numeric_column',
+    'time_column',
+    'content_digest',
+    'column_fingerprint',
+    'parse_time',
+    'time_index',
+    'time_window',
+    'category_codes',
+    'sorted_index',
+    'region_mask',
+    'get_or_compute',
+    'clear_caches',
+]
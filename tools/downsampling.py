@@ -0,0 +1,213 @@
+"""
+折线图降采样（渲染前按视图宽度保形降采样）
+
+- LTTB (Largest-Triangle-Three-Buckets)：每个桶保留与相邻桶构成最大三角形面积的点
+- M4：每个像素桶保留首/尾/最小/最大 4 个点（像素级无损）
+
+只在安全的情况下降采样：单一折线视图、数据行与标记一一对应（没有 aggregate / window /
+timeUnit / fold 等会改变行集合的 transform，也没有 encoding 聚合），且 x 为时间或数值。
+x 轴设置了 scale.domain（zoom_time_range）时只发送窗口内的行及两侧各一个点；
+下钻或缩放到小范围后每条序列的可见点数不超过目标点数，不再抽稀。
+"""
+
+from typing import Dict, Any, Optional, Tuple
+import copy
+
+import numpy as np
+
+
+DOWNSAMPLE_METHODS = ('lttb', 'm4')
+
+# 行级 transform：降采样后结果仍与逐行计算一致
+_ROW_WISE_TRANSFORMS = ('filter', 'calculate')
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    LTTB 降采样（x 已升序），返回保留点的下标（含首尾）
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # 中间 n-2 个点分成 n_out-2 个桶
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    prev = 0
+    for b in range(n_out - 2):
+        start, end = edges[b], max(edges[b + 1], edges[b] + 1)
+        if b + 2 < len(edges):
+            next_start, next_end = edges[b + 1], max(edges[b + 2], edges[b + 1] + 1)
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        bx = x[start:end]
+        by = y[start:end]
+        area = np.abs((x[prev] - avg_x) * (by - y[prev]) - (x[prev] - bx) * (avg_y - y[prev]))
+        prev = start + int(np.argmax(area))
+        selected[b + 1] = prev
+    return selected
+
+
+def m4_indices(x: np.ndarray, y: np.ndarray, n_buckets: int) -> np.ndarray:
+    """
+    M4 降采样（x 已升序）：按 x 等宽分 n_buckets 个桶，每桶保留首/尾/最小/最大点
+    """
+    n = len(x)
+    if n <= 4 * n_buckets or n_buckets < 1:
+        return np.arange(n)
+
+    span = x[-1] - x[0]
+    if span <= 0:
+        return np.array([0, n - 1]) if n > 1 else np.arange(n)
+    bucket = np.minimum(((x - x[0]) / span * n_buckets).astype(np.int64), n_buckets - 1)
+    starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+    ends = np.concatenate((starts[1:], [n])) - 1
+
+    order = np.lexsort((y, bucket))
+    bucket_sorted = bucket[order]
+    first_in_sorted = np.searchsorted(bucket_sorted, bucket[starts], side='left')
+    last_in_sorted = np.searchsorted(bucket_sorted, bucket[starts], side='right') - 1
+
+    keep = np.concatenate((starts, ends, order[first_in_sorted], order[last_in_sorted]))
+    return np.unique(keep)
+
+
+def _line_encoding(vega_spec: Dict) -> Optional[Dict]:
+    """可安全降采样的单一折线视图的 encoding，否则返回 None"""
+    if 'layer' in vega_spec or not isinstance(vega_spec.get('encoding'), dict):
+        return None
+    mark = vega_spec.get('mark')
+    mark_type = mark.get('type') if isinstance(mark, dict) else mark
+    if mark_type not in ('line', 'trail'):
+        return None
+    if vega_spec.get('_avs_density'):
+        return None
+    for t in vega_spec.get('transform', []) or []:
+        if not isinstance(t, dict) or not any(op in t for op in _ROW_WISE_TRANSFORMS):
+            return None
+    encoding = vega_spec['encoding']
+    for channel in ('x', 'y'):
+        enc = encoding.get(channel) or {}
+        if not enc.get('field') or enc.get('aggregate') or enc.get('timeUnit') or enc.get('bin'):
+            return None
+    if encoding['x'].get('type') not in ('temporal', 'quantitative'):
+        return None
+    return encoding
+
+
+def _domain_bounds(x_enc: Dict) -> Optional[Tuple[float, float]]:
+    """x 轴 scale.domain（缩放后的可见范围），转换为与 time_column 相同的数值尺度"""
+    from .data_cache import time_column
+    domain = (x_enc.get('scale') or {}).get('domain')
+    if not isinstance(domain, (list, tuple)) or len(domain) != 2:
+        return None
+    bounds = time_column([{'v': domain[0]}, {'v': domain[1]}], 'v')
+    if not np.all(np.isfinite(bounds)):
+        return None
+    return float(min(bounds)), float(max(bounds))
+
+
+def downsample_line_spec(vega_spec: Dict, width: Optional[int] = None, method: str = 'lttb',
+                         points_per_px: float = 1.0) -> Tuple[Dict, Dict[str, Any]]:
+    """
+    按视图宽度对折线图的每条序列降采样（用于渲染前）
+
+    Args:
+        vega_spec: Vega-Lite 规范
+        width: 视图宽度（像素），默认取 spec.width
+        method: lttb | m4
+        points_per_px: LTTB 每像素保留的点数（M4 固定每像素 4 个点）
+
+    Returns:
+        (降采样后的 spec（未降采样时为原 spec）, 统计信息)
+    """
+    from .data_cache import time_column, numeric_column, category_codes, column_fingerprint
+
+    info: Dict[str, Any] = {'applied': False, 'method': method}
+    if method not in DOWNSAMPLE_METHODS:
+        info['reason'] = f'unsupported method: {method}'
+        return vega_spec, info
+    encoding = _line_encoding(vega_spec)
+    data = vega_spec.get('data')
+    values = data.get('values') if isinstance(data, dict) else None
+    if encoding is None or not isinstance(values, list):
+        info['reason'] = 'not a row-level line chart'
+        return vega_spec, info
+
+    width = width or vega_spec.get('width')
+    if not isinstance(width, (int, float)) or width <= 0:
+        info['reason'] = 'unknown view width'
+        return vega_spec, info
+    target = max(3, int(width * points_per_px))
+    bounds = _domain_bounds(encoding['x'])
+    if len(values) <= target and bounds is None:
+        info['reason'] = 'below target point count'
+        return vega_spec, info
+    # 带数据点标记的折线只做时间窗口裁剪，不抽稀（每个点都可见）
+    mark = vega_spec.get('mark')
+    thin = not (isinstance(mark, dict) and mark.get('point'))
+
+    # 各列按列指纹缓存：时间戳等只在数据变化时解析一次
+    x_field = encoding['x']['field']
+    y_field = encoding['y']['field']
+    x_key = column_fingerprint(values, x_field)
+    if encoding['x'].get('type') == 'temporal':
+        xs = time_column(values, x_field, x_key)
+    else:
+        xs = numeric_column(values, x_field, x_key)
+    ys = numeric_column(values, y_field, column_fingerprint(values, y_field))
+    series_field = (encoding.get('color') or {}).get('field') or (encoding.get('detail') or {}).get('field')
+    codes, labels = category_codes(values, series_field, column_fingerprint(values, series_field) if series_field else None)
+
+    valid = np.isfinite(xs) & np.isfinite(ys)
+
+    keep = [np.flatnonzero(~valid)]  # 无法定位的行原样保留（缺失值断线等行为不变）
+    for code in range(len(labels)):
+        rows = np.flatnonzero(valid & (codes == code))
+        if len(rows) == 0:
+            continue
+        rows = rows[np.argsort(xs[rows], kind='stable')]
+        if bounds is not None:
+            # 只保留可见范围及两侧各一个点（mark 已 clip），保证线段延伸到边界
+            lo = max(0, int(np.searchsorted(xs[rows], bounds[0], side='left')) - 1)
+            hi = min(len(rows), int(np.searchsorted(xs[rows], bounds[1], side='right')) + 1)
+            rows = rows[lo:hi]
+        if not thin:
+            picked = np.arange(len(rows))
+        elif method == 'm4':
+            picked = m4_indices(xs[rows], ys[rows], int(width))
+        else:
+            picked = lttb_indices(xs[rows], ys[rows], target)
+        keep.append(rows[picked])
+
+    kept = np.sort(np.concatenate(keep)) if keep else np.arange(0)
+    dropped = len(values) - len(kept)
+    if dropped <= 0:
+        info['reason'] = 'no series exceeds the target point count'
+        return vega_spec, info
+
+    new_spec = {k: v for k, v in vega_spec.items() if k != 'data'}
+    new_spec = copy.deepcopy(new_spec)
+    new_spec['data'] = {k: v for k, v in data.items() if k != 'values'}
+    new_spec['data']['values'] = [values[i] for i in kept.tolist()]
+    info.update({
+        'applied': True,
+        'width': int(width),
+        'series': len(labels),
+        'original_points': len(values),
+        'rendered_points': int(len(kept)),
+        'dropped_points': int(dropped)
+    })
+    return new_spec, info
+
+
+__all__ = [
+    'DOWNSAMPLE_METHODS',
+    'lttb_indices',
+    'm4_indices',
+    'downsample_line_spec',
+]
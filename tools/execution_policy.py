@@ -0,0 +1,156 @@
+"""
+工具执行策略
+
+每个工具可在注册表中声明 'execution': 'inline' | 'thread' | 'process'（默认见
+Settings.TOOL_DEFAULT_EXECUTION_POLICY）以及可选的 'timeout'（秒）：
+
+- inline:  在调用线程中直接执行，不做超时控制（适合极轻量、需要访问会话 context 的工具）
+- thread:  在共享线程池中执行并限时；超时后调用方立即返回（线程无法被强制终止），
+           共享线程池换成新的，失控线程留在退役的旧池中，不再占用其他调用的线程槽位
+- process: 每个任务独占一个单进程 worker 并限时（最多 TOOL_PROCESS_WORKERS 个并发，空闲 worker 复用）；
+           超时后只终止该任务的 worker，真正取消失控的计算，不影响其他调用方的任务
+"""
+
+from typing import Dict, Any, Callable, List, Optional
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import threading
+import time
+
+from config.settings import Settings
+
+
+POLICIES = ('inline', 'thread', 'process')
+
+# 可重试的瞬时错误：工作进程崩溃、连接/中断类系统错误
+TRANSIENT_ERRORS = (BrokenProcessPool, ConnectionError, InterruptedError)
+
+
+class ToolTimeoutError(Exception):
+    """工具执行超时"""
+
+
+class _WorkerPools:
+    """共享线程池（超时后换新）与单进程 worker（惰性创建，空闲时复用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._idle_workers: List[ProcessPoolExecutor] = []
+        self._process_slots = threading.BoundedSemaphore(max(1, Settings.TOOL_PROCESS_WORKERS))
+
+    def thread_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(
+                    max_workers=Settings.TOOL_THREAD_WORKERS, thread_name_prefix='tool-exec'
+                )
+            return self._thread_pool
+
+    def retire_thread_pool(self, pool: ThreadPoolExecutor):
+        """失控线程无法终止：之后的任务改用新线程池，旧池跑完已提交的任务后自行退出"""
+        with self._lock:
+            if self._thread_pool is pool:
+                self._thread_pool = None
+        pool.shutdown(wait=False)
+
+    def acquire_worker(self, timeout: float) -> Optional[ProcessPoolExecutor]:
+        """取得一个单进程 worker（空闲的优先）；timeout 秒内没有空位时返回 None"""
+        if not self._process_slots.acquire(timeout=timeout):
+            return None
+        with self._lock:
+            if self._idle_workers:
+                return self._idle_workers.pop()
+        return ProcessPoolExecutor(max_workers=1)
+
+    def release_worker(self, worker: ProcessPoolExecutor, healthy: bool = True):
+        """归还 worker；任务超时或 worker 崩溃时终止它（只影响这一个任务）"""
+        if healthy:
+            with self._lock:
+                self._idle_workers.append(worker)
+        else:
+            for process in list((getattr(worker, '_processes', None) or {}).values()):
+                try:
+                    process.terminate()
+                except Exception:  # noqa: BLE001
+                    pass
+            worker.shutdown(wait=False, cancel_futures=True)
+        self._process_slots.release()
+
+
+_pools = _WorkerPools()
+
+
+def _run_once(func: Callable, params: Dict[str, Any], policy: str, timeout: float) -> Any:
+    if policy == 'inline':
+        return func(**params)
+
+    if policy == 'process':
+        start = time.monotonic()
+        worker = _pools.acquire_worker(timeout)
+        if worker is None:
+            raise ToolTimeoutError(f'timed out after {timeout}s waiting for a worker process')
+        healthy = False
+        try:
+            future = worker.submit(func, **params)
+            result = future.result(timeout=max(0.0, timeout - (time.monotonic() - start)))
+            healthy = True
+            return result
+        except FutureTimeoutError:
+            raise ToolTimeoutError(f'timed out after {timeout}s (worker process terminated)')
+        except BrokenProcessPool:
+            # worker 崩溃：丢弃该 worker，由 run_with_policy 重试
+            raise
+        except Exception:
+            # 工具自身抛出的异常：worker 仍可复用
+            healthy = True
+            raise
+        finally:
+            _pools.release_worker(worker, healthy)
+
+    pool = _pools.thread_pool()
+    future = pool.submit(func, **params)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        if not future.cancel():
+            _pools.retire_thread_pool(pool)
+        raise ToolTimeoutError(f'timed out after {timeout}s')
+
+
+def run_with_policy(func: Callable, params: Dict[str, Any], policy: str = 'inline',
+                    timeout: Optional[float] = None, retries: Optional[int] = None) -> Any:
+    """
+    按执行策略运行工具函数
+
+    Args:
+        func: 工具函数
+        params: 参数字典
+        policy: inline | thread | process
+        timeout: 超时秒数（默认 Settings.TOOL_EXECUTION_TIMEOUT，inline 策略忽略）
+        retries: 瞬时错误的最大重试次数（默认 Settings.MAX_TOOL_RETRIES）
+
+    Raises:
+        ToolTimeoutError: 执行超时（超时不会重试）
+        其他异常: 工具自身抛出的异常，或重试耗尽后的最后一次瞬时错误
+    """
+    if policy not in POLICIES:
+        raise ValueError(f'Unknown execution policy: {policy}')
+    timeout = timeout or Settings.TOOL_EXECUTION_TIMEOUT
+    retries = Settings.MAX_TOOL_RETRIES if retries is None else retries
+
+    attempt = 0
+    while True:
+        try:
+            return _run_once(func, params, policy, timeout)
+        except TRANSIENT_ERRORS:
+            attempt += 1
+            if attempt > retries:
+                raise
+
+
+__all__ = [
+    'POLICIES',
+    'ToolTimeoutError',
+    'run_with_policy',
+]
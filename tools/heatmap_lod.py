@@ -0,0 +1,435 @@
+"""
+热力图分辨率自适应渲染（LOD：渲染前把单元格合并到视图分辨率）
+
+单元格小于 min_cell_px 像素时，按显示顺序把相邻的行 / 列合并成块（bin），
+块内全部原始行按 aggregate（默认与 color 的聚合方式一致）聚合，渲染器只收到块级的小 data.values。
+select_submatrix 选出子矩阵或缩放（x / y 的 scale.domain 为标签列表）后，
+视图内的单元格足够大时不再合并，以全分辨率显示。
+
+只在安全的情况下合并：单一 rect 视图（或 add_marginal_bars 的组合视图）、内联数据、
+按字段编码的通道只有 x / y / color / tooltip、轴顺序可确定（默认升序、descending 或显式 sort 数组），
+transform 只有 select_submatrix 的过滤。
+
+条件通道（find_extremes 的 stroke、highlight_region / threshold_mask 等的 opacity）按工具记录的
+_heatmap_highlight 换算到块上：按单元格的条件在块内任一单元格满足时成立，按值的条件对块的聚合值判断；
+无法换算的条件通道在合并后的视图中去掉，并在统计信息的 dropped_channels 中报告。
+边际条形图随主图的块重新聚合，与合并后的轴对齐。
+"""
+
+from typing import Dict, Any, List, Optional, Tuple
+import copy
+import math
+
+import numpy as np
+
+from .heatmap_pivot import PIVOT_AGGREGATES
+
+
+HEATMAP_LOD_AGGREGATES = PIVOT_AGGREGATES
+
+_LOD_CHANNELS = ('x', 'y', 'color', 'tooltip')
+_VALUE_CHANNEL_KEYS = ('condition', 'value')
+_MONTH_LABELS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+_DAY_LABELS = ('Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat')
+
+
+def _heatmap_encoding(vega_spec: Dict) -> Optional[Dict]:
+    """可合并的单一热力图视图的 encoding，否则返回 None"""
+    if any(k in vega_spec for k in ('layer', 'concat', 'hconcat', 'vconcat', 'facet', 'repeat')):
+        return None
+    mark = vega_spec.get('mark')
+    mark_type = mark.get('type') if isinstance(mark, dict) else mark
+    encoding = vega_spec.get('encoding')
+    if mark_type != 'rect' or not isinstance(encoding, dict):
+        return None
+    for channel, enc in encoding.items():
+        if channel not in _LOD_CHANNELS and not _is_value_channel(enc):
+            return None
+    for channel in ('x', 'y'):
+        enc = encoding.get(channel) or {}
+        if not enc.get('field') or enc.get('aggregate') or enc.get('bin'):
+            return None
+    return encoding
+
+
+def _is_value_channel(enc: Any) -> bool:
+    """只含常量值 / 条件值（不按字段编码）的通道，如 {'condition': {'test', 'value'}, 'value'}"""
+    if not isinstance(enc, dict) or any(k not in _VALUE_CHANNEL_KEYS for k in enc):
+        return False
+    condition = enc.get('condition')
+    return condition is None or (isinstance(condition, dict) and 'field' not in condition)
+
+
+def _marginal_layout(vega_spec: Dict) -> Optional[Tuple[Dict, Optional[Dict], Optional[Dict]]]:
+    """add_marginal_bars 组合视图的 (主热力图, 顶部边际, 右侧边际)；不是该结构时返回 None"""
+    state = vega_spec.get('_marginal_bars_state') or {}
+    vconcat = vega_spec.get('vconcat')
+    if not state.get('enabled') or not isinstance(vconcat, list) or not 1 <= len(vconcat) <= 2:
+        return None
+    row = vconcat[-1] if isinstance(vconcat[-1], dict) else {}
+    hconcat = row.get('hconcat')
+    if not isinstance(hconcat, list) or not 1 <= len(hconcat) <= 2:
+        return None
+    top = vconcat[0] if len(vconcat) == 2 else None
+    right = hconcat[1] if len(hconcat) == 2 else None
+    return hconcat[0], top, right
+
+
+def _submatrix_labels(vega_spec: Dict) -> Optional[Dict[str, Any]]:
+    """
+    select_submatrix 的选择（{'x': 标签或 None, 'y': 标签或 None}）；
+    无 transform 时为空选择，transform 不全由 select_submatrix 生成时返回 None
+    """
+    transforms = vega_spec.get('transform') or []
+    if not transforms:
+        return {'x': None, 'y': None}
+    state = vega_spec.get('_heatmap_submatrix') or {}
+    if state.get('transforms') != len(transforms):
+        return None
+    return state
+
+
+def _display_order(pivot, axis: str, enc: Dict, selected: Optional[List[Any]]) -> Optional[np.ndarray]:
+    """
+    轴的显示顺序（透视下标数组，只含可见标签）；顺序无法确定时返回 None
+
+    scale.domain 为标签列表（缩放）时按 domain 显示；否则按 sort（默认升序）
+    """
+    from .heatmap_pivot import normalize_labels
+
+    n = pivot.shape[1] if axis == 'x' else pivot.shape[0]
+    domain = (enc.get('scale') or {}).get('domain')
+    sort = enc.get('sort')
+    if domain is not None:
+        if not isinstance(domain, list):
+            return None
+        order, _ = pivot.label_positions(axis, normalize_labels(enc, domain))
+    elif sort is None or sort == 'ascending':
+        order = np.arange(n)
+    elif sort == 'descending':
+        order = np.arange(n)[::-1]
+    elif isinstance(sort, list):
+        # 显式 sort：列出的标签在前，其余按升序排在后面（与 Vega 一致）
+        listed, _ = pivot.label_positions(axis, normalize_labels(enc, sort))
+        listed = listed[np.sort(np.unique(listed, return_index=True)[1])]
+        rest = np.setdiff1d(np.arange(n), listed)
+        order = np.concatenate((listed, rest)).astype(np.int64)
+    else:
+        return None
+    if selected is not None:
+        keep, _ = pivot.label_positions(axis, normalize_labels(enc, selected))
+        order = order[np.isin(order, keep)]
+    return order
+
+
+def _label_text(label: Any, unit: Optional[str]) -> str:
+    if unit == 'month' and isinstance(label, int) and 1 <= label <= 12:
+        return _MONTH_LABELS[label - 1]
+    if unit == 'day' and isinstance(label, int) and 0 <= label <= 6:
+        return _DAY_LABELS[label]
+    return str(label)
+
+
+def _axis_bins(pivot, axis: str, order: np.ndarray, factor: int, unit: Optional[str]) -> Tuple[np.ndarray, List[Any]]:
+    """
+    每个透视下标所属的块号（不可见为 -1）及各块的显示标签
+
+    不合并（factor == 1）且无 timeUnit 时标签为原始值，编码的 sort 等设置保持有效
+    """
+    labels = pivot.x_labels if axis == 'x' else pivot.y_labels
+    bins = np.full(len(labels), -1, dtype=np.int64)
+    bins[order] = np.arange(len(order)) // factor
+    names: List[Any] = []
+    for start in range(0, len(order), factor):
+        first = labels[order[start]]
+        last = labels[order[min(start + factor, len(order)) - 1]]
+        if factor == 1:
+            names.append(first if not unit else _label_text(first, unit))
+        else:
+            names.append(f'{_label_text(first, unit)} – {_label_text(last, unit)}')
+    return bins, names
+
+
+def _binned_axis_encoding(enc: Dict, field: str, names: List[Any], binned: bool, unit: Optional[str]) -> Dict:
+    """块数据上的 x / y 编码"""
+    if not binned and not unit:
+        return {**copy.deepcopy(enc), 'field': field}
+    out = {k: copy.deepcopy(v) for k, v in enc.items()
+           if k not in ('field', 'type', 'timeUnit', 'sort', 'scale', 'axis', 'title')}
+    axis = enc.get('axis')
+    if isinstance(axis, dict):
+        axis = {k: copy.deepcopy(v) for k, v in axis.items() if k not in ('format', 'formatType', 'values')}
+        if binned:
+            axis['labelOverlap'] = True
+    out.update({
+        'field': field,
+        'type': 'ordinal',
+        'sort': names,
+        'title': enc.get('title', enc.get('field')),
+    })
+    if axis is not None:
+        out['axis'] = axis
+    elif binned:
+        out['axis'] = {'labelOverlap': True}
+    return out
+
+
+def _bin_ids(flat: np.ndarray, n_x: int, x_bins: np.ndarray, y_bins: np.ndarray, n_bx: int) -> np.ndarray:
+    """透视扁平下标 -> 块号（不可见为 -1）"""
+    bx, by = x_bins[flat % n_x], y_bins[flat // n_x]
+    return np.where((bx >= 0) & (by >= 0), by * n_bx + bx, -1)
+
+
+def _highlight_flags(pivot, op: str, highlight: Dict[str, Any], bins: np.ndarray, agg: np.ndarray,
+                     x_bins: np.ndarray, y_bins: np.ndarray, n_bx: int) -> np.ndarray:
+    """
+    条件在各非空块上是否成立
+
+    按值（min / max）：对块的聚合值判断；按单元格（cells 坐标列表，或 x / y 标签集合）：块内任一非空单元格命中即成立
+    """
+    if 'min' in highlight or 'max' in highlight:
+        flags = np.ones(len(agg), dtype=bool)
+        if highlight.get('min') is not None:
+            flags &= agg >= float(highlight['min'])
+        if highlight.get('max') is not None:
+            flags &= agg <= float(highlight['max'])
+        return flags
+
+    n_y, n_x = pivot.shape
+    cells, _ = pivot.cells(op)
+    if 'cells' in highlight:
+        hit = np.zeros(n_y * n_x, dtype=bool)
+        for x_label, y_label in highlight['cells']:
+            xi, _ = pivot.label_positions('x', [x_label])
+            yi, _ = pivot.label_positions('y', [y_label])
+            if len(xi) and len(yi):
+                hit[int(yi[0]) * n_x + int(xi[0])] = True
+        cells = cells[hit[cells]]
+    else:
+        hit = np.ones(len(cells), dtype=bool)
+        for axis, size, coord in (('x', n_x, cells % n_x), ('y', n_y, cells // n_x)):
+            if highlight.get(axis) is None:
+                continue
+            keep = np.zeros(size, dtype=bool)
+            keep[pivot.label_positions(axis, highlight[axis])[0]] = True
+            hit &= keep[coord]
+        cells = cells[hit]
+    hit_bins = _bin_ids(cells, n_x, x_bins, y_bins, n_bx)
+    return np.isin(bins, hit_bins[hit_bins >= 0])
+
+
+def _lod_view(vega_spec: Dict, width: Any, height: Any, aggregate: str,
+              min_cell_px: float) -> Tuple[Dict, Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    合并单一热力图视图
+
+    Returns:
+        (合并后的视图（未合并时为原视图）, 统计信息, 合并所用的块划分（供边际条形图对齐；未合并时为 None）)
+    """
+    from .heatmap_pivot import pivot_for_spec, _timeunit
+    from .data_cache import spec_values
+
+    info: Dict[str, Any] = {'applied': False}
+    encoding = _heatmap_encoding(vega_spec) if isinstance(vega_spec, dict) else None
+    if encoding is None:
+        info['reason'] = 'not a single-view heatmap'
+        return vega_spec, info, None
+    if not isinstance(width, (int, float)) or not isinstance(height, (int, float)) or width <= 0 or height <= 0:
+        info['reason'] = 'unknown view size'
+        return vega_spec, info, None
+    selection = _submatrix_labels(vega_spec)
+    if selection is None:
+        info['reason'] = 'view has transforms'
+        return vega_spec, info, None
+    resolved = pivot_for_spec(vega_spec)
+    if resolved is None:
+        info['reason'] = 'no pivotable data'
+        return vega_spec, info, None
+    pivot, pinfo = resolved
+    op = pinfo['op'] if aggregate == 'auto' else aggregate
+    if op not in HEATMAP_LOD_AGGREGATES:
+        info['reason'] = f'unsupported aggregate: {op}'
+        return vega_spec, info, None
+
+    x_enc, y_enc = encoding['x'], encoding['y']
+    x_order = _display_order(pivot, 'x', x_enc, selection.get('x'))
+    y_order = _display_order(pivot, 'y', y_enc, selection.get('y'))
+    if x_order is None or y_order is None:
+        info['reason'] = 'axis order cannot be resolved'
+        return vega_spec, info, None
+
+    n_x, n_y = len(x_order), len(y_order)
+    fx = max(1, math.ceil(n_x / max(1, int(width // min_cell_px))))
+    fy = max(1, math.ceil(n_y / max(1, int(height // min_cell_px))))
+    info.update({'cells': [n_y, n_x], 'aggregate': op})
+    if fx == 1 and fy == 1:
+        info['reason'] = 'cells fit the view resolution'
+        return vega_spec, info, None
+
+    x_unit, y_unit = _timeunit(x_enc), _timeunit(y_enc)
+    x_bins, x_names = _axis_bins(pivot, 'x', x_order, fx, x_unit)
+    y_bins, y_names = _axis_bins(pivot, 'y', y_order, fy, y_unit)
+    bins, agg, n_cells = pivot.binned(op, x_bins, y_bins)
+    n_bx = len(x_names)
+    rows = [
+        {'_lod_x': x_names[b % n_bx], '_lod_y': y_names[b // n_bx], '_lod_value': v, '_lod_cells': c}
+        for b, v, c in zip(bins.tolist(), agg.tolist(), n_cells.tolist())
+    ]
+
+    # 条件通道：工具记录的条件（test 与当前编码一致、x / y 字段未变）换算为块上的标记列，其余去掉
+    highlights = vega_spec.get('_heatmap_highlight') or {}
+    fields = [x_enc.get('field'), y_enc.get('field')]
+    extra: Dict[str, Any] = {}
+    dropped: List[str] = []
+    flag_columns: Dict[str, str] = {}
+    for channel, enc in encoding.items():
+        if channel in _LOD_CHANNELS:
+            continue
+        condition = enc.get('condition')
+        if condition is None:
+            extra[channel] = copy.deepcopy(enc)
+            continue
+        highlight = highlights.get(channel) or {}
+        test = condition.get('test')
+        if highlight.get('test') != test or highlight.get('fields') != fields:
+            dropped.append(channel)
+            continue
+        column = flag_columns.get(test)
+        if column is None:
+            column = flag_columns[test] = f'_lod_hl{len(flag_columns)}'
+            flags = _highlight_flags(pivot, op, highlight, bins, agg, x_bins, y_bins, n_bx)
+            for row, flag in zip(rows, flags.tolist()):
+                row[column] = flag
+        extra[channel] = {
+            **{k: copy.deepcopy(v) for k, v in enc.items() if k != 'condition'},
+            'condition': {**{k: copy.deepcopy(v) for k, v in condition.items() if k != 'test'},
+                          'test': f"datum['{column}']"},
+        }
+
+    c_enc = encoding.get('color') or {}
+    value_title = c_enc.get('title') or (f"{op}({pinfo['value_field']})" if pinfo['value_field'] else op)
+    color = {k: copy.deepcopy(v) for k, v in c_enc.items() if k not in ('field', 'type', 'aggregate', 'bin', 'timeUnit')}
+    color.update({'field': '_lod_value', 'type': 'quantitative', 'title': value_title})
+    x_new = _binned_axis_encoding(x_enc, '_lod_x', x_names, fx > 1, x_unit)
+    y_new = _binned_axis_encoding(y_enc, '_lod_y', y_names, fy > 1, y_unit)
+
+    new_spec = copy.deepcopy({k: v for k, v in vega_spec.items()
+                              if k not in ('data', 'transform', 'encoding', '_heatmap_highlight')})
+    new_spec['data'] = {'values': rows}
+    new_spec['encoding'] = {
+        'x': x_new,
+        'y': y_new,
+        'color': color,
+        'tooltip': [
+            {'field': '_lod_x', 'type': 'ordinal', 'title': x_new.get('title') or x_enc.get('field')},
+            {'field': '_lod_y', 'type': 'ordinal', 'title': y_new.get('title') or y_enc.get('field')},
+            {'field': '_lod_value', 'type': 'quantitative', 'title': value_title, 'format': '.4~g'},
+            {'field': '_lod_cells', 'type': 'quantitative', 'title': 'cells'},
+        ],
+        **extra,
+    }
+    info.update({
+        'applied': True,
+        'bins': [len(y_names), n_bx],
+        'cells_per_bin': [fy, fx],
+        'non_empty_bins': int(len(rows)),
+        'original_rows': len(spec_values(vega_spec)),
+    })
+    if dropped:
+        info['dropped_channels'] = dropped
+    grid = {
+        'pivot': pivot, 'value_field': pinfo['value_field'],
+        'x': (x_bins, x_names, fx > 1, x_unit, x_new.get('title') or x_enc.get('field')),
+        'y': (y_bins, y_names, fy > 1, y_unit, y_new.get('title') or y_enc.get('field')),
+    }
+    return new_spec, info, grid
+
+
+def _lod_marginal_bar(bar: Dict, axis: str, grid: Dict[str, Any], op: str) -> Dict:
+    """边际条形图按主图 axis 方向的块重新聚合（另一方向取全部行）"""
+    pivot = grid['pivot']
+    axis_bins, names, binned, unit, title = grid[axis]
+    other = np.zeros(pivot.shape[0] if axis == 'x' else pivot.shape[1], dtype=np.int64)
+    x_bins, y_bins = (axis_bins, other) if axis == 'x' else (other, axis_bins)
+    bins, agg, _ = pivot.binned(op, x_bins, y_bins)
+    label = f'_lod_{axis}'
+    value_channel = 'y' if axis == 'x' else 'x'
+    encoding = bar.get('encoding') or {}
+    new_bar = copy.deepcopy({k: v for k, v in bar.items() if k not in ('data', 'transform', 'encoding')})
+    new_bar['data'] = {'values': [{label: names[b], '_lod_value': v} for b, v in zip(bins.tolist(), agg.tolist())]}
+    new_bar['encoding'] = {
+        axis: _binned_axis_encoding(encoding.get(axis) or {}, label, names, binned, unit),
+        value_channel: {'field': '_lod_value', 'type': 'quantitative', 'title': None,
+                        'axis': copy.deepcopy((encoding.get(value_channel) or {}).get('axis'))},
+        'tooltip': [
+            {'field': label, 'type': 'ordinal', 'title': title},
+            {'field': '_lod_value', 'type': 'quantitative', 'title': f"{op}({grid['value_field']})", 'format': '.4~g'},
+        ],
+    }
+    return new_bar
+
+
+def _lod_marginal_spec(vega_spec: Dict, layout: Tuple[Dict, Optional[Dict], Optional[Dict]], width: Any, height: Any,
+                       aggregate: str, min_cell_px: float) -> Tuple[Dict, Dict[str, Any]]:
+    """add_marginal_bars 组合视图：合并主热力图，边际条形图随主图的块重新聚合（共享的 x / y 比例尺保持对齐）"""
+    main, top, right = layout
+    state = vega_spec['_marginal_bars_state']
+    main_width = main.get('width') if isinstance(main.get('width'), (int, float)) else width
+    main_height = main.get('height') if isinstance(main.get('height'), (int, float)) else height
+    new_main, info, grid = _lod_view(main, main_width, main_height, aggregate, min_cell_px)
+    if grid is None:
+        return vega_spec, info
+    op = str(state.get('op') or 'mean').lower()
+    if op not in HEATMAP_LOD_AGGREGATES or state.get('value_field') != grid['value_field']:
+        return vega_spec, {'applied': False, 'reason': 'marginal bars cannot follow the binned heatmap'}
+
+    new_spec = copy.deepcopy({k: v for k, v in vega_spec.items() if k != 'vconcat'})
+    row = copy.deepcopy({k: v for k, v in vega_spec['vconcat'][-1].items() if k != 'hconcat'})
+    row['hconcat'] = [new_main] + ([_lod_marginal_bar(right, 'y', grid, op)] if right is not None else [])
+    new_spec['vconcat'] = ([_lod_marginal_bar(top, 'x', grid, op)] if top is not None else []) + [row]
+    info['marginals'] = op
+    return new_spec, info
+
+
+def lod_heatmap_spec(vega_spec: Dict, width: Optional[int] = None, height: Optional[int] = None,
+                     aggregate: str = 'auto', min_cell_px: float = 2.0) -> Tuple[Dict, Dict[str, Any]]:
+    """
+    按视图分辨率合并热力图单元格（用于渲染前）
+
+    Args:
+        vega_spec: Vega-Lite 规范（单一热力图视图，或 add_marginal_bars 的组合视图）
+        width / height: 视图尺寸（像素），默认取 spec.width / spec.height（组合视图取主热力图的尺寸）
+        aggregate: 块内聚合方式，auto 表示与 color 的聚合方式一致（mean/sum/min/max/count/median）
+        min_cell_px: 单元格的最小像素尺寸，小于该尺寸的行 / 列被合并
+
+    Returns:
+        (合并后的 spec（未合并时为原 spec）, 统计信息)
+    """
+    if not isinstance(vega_spec, dict):
+        return vega_spec, {'applied': False, 'reason': 'not a single-view heatmap'}
+    layout = _marginal_layout(vega_spec)
+    if layout is not None:
+        return _lod_marginal_spec(vega_spec, layout, width, height, aggregate, min_cell_px)
+    new_spec, info, _ = _lod_view(vega_spec, width or vega_spec.get('width'), height or vega_spec.get('height'),
+                                  aggregate, min_cell_px)
+    return new_spec, info
+
+
+def lod_message(info: Dict[str, Any]) -> str:
+    """LOD 统计的简短说明（附在渲染结果 / 工具反馈中告知 agent）"""
+    if not info or not info.get('applied'):
+        return ''
+    (n_y, n_x), (b_y, b_x), (f_y, f_x) = info['cells'], info['bins'], info['cells_per_bin']
+    message = (f'heatmap binned to view resolution: {n_y}x{n_x} cells -> {b_y}x{b_x} bins '
+               f'({f_y}x{f_x} cells per bin, {info["aggregate"]}); '
+               f'select_submatrix shows full-resolution cells')
+    if info.get('dropped_channels'):
+        message += f'; not shown while binned: {", ".join(info["dropped_channels"])}'
+    return message
+
+
+__all__ = [
+    'HEATMAP_LOD_AGGREGATES',
+    'lod_heatmap_spec',
+    'lod_message',
+]
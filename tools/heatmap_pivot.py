@@ -0,0 +1,449 @@
+"""
+热力图透视矩阵缓存（长表 data.values -> 稠密 NumPy 矩阵）
+
+每个数据集（按 数据键 + x/y 字段及 timeUnit + 数值字段）只构建一次：
+x / y 编码为整数下标（标签按 Vega 默认升序），单元格按 (y, x) 分组后
+对 sum / mean / min / max / count / median 计算，稠密矩阵按聚合方式懒构建并缓存。
+行对应 y 轴标签，列对应 x 轴标签，空单元格为 NaN。
+
+timeUnit 轴按 UTC 截断，标签为整数：year、quarter(1-4)、month(1-12)、date(1-31)、
+day(0=周日)、hours、yearmonth(YYYYMM)、yearmonthdate(YYYYMMDD)、monthdate(MMDD)。
+"""
+
+from typing import Dict, Any, List, Optional, Tuple
+import threading
+
+import numpy as np
+
+
+PIVOT_AGGREGATES = ('mean', 'sum', 'min', 'max', 'count', 'median')
+PIVOT_TIMEUNITS = ('year', 'quarter', 'month', 'date', 'day', 'hours',
+                   'yearquarter', 'yearmonth', 'yearmonthdate', 'monthdate')
+
+
+def _timeunit_keys(ms: np.ndarray, unit: str) -> np.ndarray:
+    """Unix 毫秒 -> timeUnit 整数键（float64，无法解析为 NaN）"""
+    valid = np.isfinite(ms)
+    out = np.full(len(ms), np.nan)
+    if not np.any(valid):
+        return out
+    stamps = ms[valid].astype(np.int64).astype('datetime64[ms]')
+    days = stamps.astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    year = months.astype('datetime64[Y]').astype(np.int64) + 1970
+    month = months.astype(np.int64) % 12 + 1
+    date = (days - months.astype('datetime64[D]')).astype(np.int64) + 1
+    if unit == 'year':
+        keys = year
+    elif unit == 'quarter':
+        keys = (month - 1) // 3 + 1
+    elif unit == 'month':
+        keys = month
+    elif unit == 'date':
+        keys = date
+    elif unit == 'day':
+        keys = (days.astype(np.int64) + 4) % 7  # 1970-01-01 为周四
+    elif unit == 'hours':
+        keys = (stamps - days.astype('datetime64[ms]')).astype(np.int64) // 3600000
+    elif unit == 'yearquarter':
+        keys = year * 10 + (month - 1) // 3 + 1
+    elif unit == 'yearmonth':
+        keys = year * 100 + month
+    elif unit == 'yearmonthdate':
+        keys = year * 10000 + month * 100 + date
+    else:  # monthdate
+        keys = month * 100 + date
+    out[valid] = keys
+    return out
+
+
+def _label_sort_key(value: Any) -> Tuple[int, Any]:
+    if isinstance(value, bool) or value is None:
+        return (2, str(value))
+    if isinstance(value, (int, float)):
+        return (0, value)
+    return (1, str(value))
+
+
+def axis_codes(values: List[Dict[str, Any]], field: str, timeunit: Optional[str],
+               key: str) -> Tuple[np.ndarray, List[Any]]:
+    """
+    轴的整数编码（标签升序），按 (数据键, 字段, timeUnit) 缓存
+
+    Returns:
+        (每行的下标 int64 数组，缺失/无法解析为 -1, 标签列表)
+    """
+    from .data_cache import category_codes, time_column, get_or_compute
+
+    def build():
+        if timeunit:
+            keys = _timeunit_keys(time_column(values, field, key), timeunit)
+            valid = np.isfinite(keys)
+            labels, inverse = np.unique(keys[valid].astype(np.int64), return_inverse=True)
+            codes = np.full(len(values), -1, dtype=np.int64)
+            codes[valid] = inverse
+            labels = labels.tolist()
+        else:
+            raw_codes, raw_labels = category_codes(values, field, key)
+            present = [i for i, label in enumerate(raw_labels) if label is not None]
+            ordered = sorted(present, key=lambda i: _label_sort_key(raw_labels[i]))
+            remap = np.full(len(raw_labels), -1, dtype=np.int64)
+            remap[ordered] = np.arange(len(ordered))
+            codes = remap[raw_codes]
+            labels = [raw_labels[i] for i in ordered]
+        codes.setflags(write=False)
+        return codes, labels
+
+    return get_or_compute('heatmap_axis', (key, field, timeunit), build)
+
+
+def _reduce_sorted(keys: np.ndarray, vals: np.ndarray, op: str) -> Tuple[np.ndarray, np.ndarray]:
+    """按 (键, 数值) 排好序的行分组聚合，返回 (键, 聚合值)"""
+    if not len(keys):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = np.diff(np.concatenate((starts, [len(keys)])))
+    # 组内已按数值升序：首个为最小值，末个为最大值
+    if op == 'sum':
+        agg = np.add.reduceat(vals, starts)
+    elif op == 'min':
+        agg = vals[starts]
+    elif op == 'max':
+        agg = vals[starts + counts - 1]
+    elif op == 'median':
+        agg = (vals[starts + (counts - 1) // 2] + vals[starts + counts // 2]) / 2
+    else:  # mean
+        agg = np.add.reduceat(vals, starts) / counts
+    return keys[starts], agg
+
+
+class HeatmapPivot:
+    """单个数据集的热力图透视（各聚合方式的稠密矩阵按需构建后缓存）"""
+
+    def __init__(self, x_codes: np.ndarray, x_labels: List[Any], y_codes: np.ndarray, y_labels: List[Any],
+                 values: np.ndarray):
+        self.x_labels = x_labels
+        self.y_labels = y_labels
+        self.shape = (len(y_labels), len(x_labels))
+        placed = (x_codes >= 0) & (y_codes >= 0)
+        flat = y_codes[placed] * len(x_labels) + x_codes[placed]
+        vals = values[placed]
+        # count 与 Vega 一致：单元格内的行数（包括数值缺失的行）
+        self._row_counts = np.bincount(flat, minlength=self.shape[0] * self.shape[1])
+        finite = np.isfinite(vals)
+        flat, vals = flat[finite], vals[finite]
+        order = np.lexsort((vals, flat))
+        self._flat = flat[order]
+        self._vals = vals[order]
+        self._dense: Dict[str, np.ndarray] = {}
+        self._cells: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._label_index: Dict[str, Dict[Any, int]] = {}
+        self._lock = threading.Lock()
+
+    def cells(self, op: str) -> Tuple[np.ndarray, np.ndarray]:
+        """非空单元格（稀疏形式）：(扁平下标 y * n_x + x, 聚合值)，按聚合方式缓存"""
+        with self._lock:
+            cached = self._cells.get(op)
+            if cached is None:
+                cached = self._cells[op] = self._build_cells(op)
+            return cached
+
+    def _build_cells(self, op: str) -> Tuple[np.ndarray, np.ndarray]:
+        if op == 'count':
+            cells = np.flatnonzero(self._row_counts)
+            return cells, self._row_counts[cells].astype(np.float64)
+        return _reduce_sorted(self._flat, self._vals, op)
+
+    def binned(self, op: str, x_bins: np.ndarray, y_bins: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        把单元格合并为块后聚合（块内全部原始行做 op，与直接按块分组一致）
+
+        Args:
+            x_bins / y_bins: 每个 x / y 下标所属的块号（-1 表示不参与）
+
+        Returns:
+            (非空块的扁平下标 块y * 块数x + 块x, 聚合值, 块内非空单元格数)
+        """
+        n_x = self.shape[1]
+        n_bx = int(x_bins.max()) + 1 if len(x_bins) else 0
+        n_by = int(y_bins.max()) + 1 if len(y_bins) else 0
+        if n_bx <= 0 or n_by <= 0:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty.astype(np.float64), empty
+
+        def to_bin(flat: np.ndarray) -> np.ndarray:
+            bx, by = x_bins[flat % n_x], y_bins[flat // n_x]
+            return np.where((bx >= 0) & (by >= 0), by * n_bx + bx, -1)
+
+        cells = np.flatnonzero(self._row_counts)
+        cell_bins = to_bin(cells)
+        placed = cell_bins >= 0
+        n_cells = np.bincount(cell_bins[placed], minlength=n_bx * n_by)
+        if op == 'count':
+            totals = np.bincount(cell_bins[placed], weights=self._row_counts[cells[placed]], minlength=n_bx * n_by)
+            bins = np.flatnonzero(n_cells)
+            return bins, totals[bins], n_cells[bins]
+        row_bins = to_bin(self._flat)
+        placed = row_bins >= 0
+        row_bins, vals = row_bins[placed], self._vals[placed]
+        order = np.lexsort((vals, row_bins))
+        bins, agg = _reduce_sorted(row_bins[order], vals[order], op)
+        return bins, agg, n_cells[bins]
+
+    def dense(self, op: str) -> np.ndarray:
+        """稠密矩阵（行 = y 标签，列 = x 标签，空单元格为 NaN），只读"""
+        cells, agg = self.cells(op)
+        with self._lock:
+            matrix = self._dense.get(op)
+            if matrix is None:
+                matrix = np.full(self.shape[0] * self.shape[1], np.nan)
+                matrix[cells] = agg
+                matrix = matrix.reshape(self.shape)
+                matrix.setflags(write=False)
+                self._dense[op] = matrix
+            return matrix
+
+    def cell_labels(self, cells: np.ndarray) -> Tuple[List[Any], List[Any]]:
+        """扁平下标 -> (x 标签列表, y 标签列表)"""
+        n_x = self.shape[1]
+        return ([self.x_labels[i] for i in (cells % n_x).tolist()],
+                [self.y_labels[i] for i in (cells // n_x).tolist()])
+
+    def extremes(self, op: str, n: int, largest: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        聚合值最大（或最小）的 n 个单元格，argpartition 选出后只对这 n 个排序
+
+        Returns:
+            (扁平下标, 聚合值)，按极端程度排序
+        """
+        cells, agg = self.cells(op)
+        n = min(int(n), len(agg))
+        if n <= 0:
+            return cells[:0], agg[:0]
+        keyed = -agg if largest else agg
+        picked = np.argpartition(keyed, n - 1)[:n] if n < len(agg) else np.arange(len(agg))
+        picked = picked[np.argsort(keyed[picked], kind='stable')]
+        return cells[picked], agg[picked]
+
+    def count_in_range(self, op: str, min_value: Optional[float] = None, max_value: Optional[float] = None) -> int:
+        """聚合值落在 [min_value, max_value] 内的非空单元格数（向量化掩码）"""
+        _, agg = self.cells(op)
+        mask = np.ones(len(agg), dtype=bool)
+        if min_value is not None:
+            mask &= agg >= float(min_value)
+        if max_value is not None:
+            mask &= agg <= float(max_value)
+        return int(mask.sum())
+
+    def label_positions(self, axis: str, labels: List[Any]) -> Tuple[np.ndarray, List[Any]]:
+        """
+        标签 -> 轴下标（axis 为 'x' 或 'y'；标签按字符串形式匹配，兼容 "2012" 与 2012）
+
+        Returns:
+            (下标数组, 未找到的标签)
+        """
+        with self._lock:
+            index = self._label_index.get(axis)
+            if index is None:
+                source = self.x_labels if axis == 'x' else self.y_labels
+                index = self._label_index[axis] = {str(label): i for i, label in enumerate(source)}
+        found, missing = [], []
+        for label in labels:
+            position = index.get(str(label))
+            if position is None:
+                missing.append(label)
+            else:
+                found.append(position)
+        return np.array(found, dtype=np.int64), missing
+
+    def submatrix(self, op: str, x_positions: Optional[np.ndarray] = None,
+                  y_positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """按轴下标切片稠密矩阵（None 表示整轴）"""
+        matrix = self.dense(op)
+        if y_positions is not None:
+            matrix = matrix[y_positions, :]
+        if x_positions is not None:
+            matrix = matrix[:, x_positions]
+        return matrix
+
+    def marginal(self, axis: str, op: str) -> np.ndarray:
+        """
+        边际聚合：对每个 x（axis='x'）或 y（axis='y'）标签的全部数据行做 op 聚合（与 Vega 按轴分组一致）
+        sum / count / mean / min / max 由单元格结果合并，median 基于原始行
+        """
+        n_x = self.shape[1]
+        size = self.shape[1] if axis == 'x' else self.shape[0]
+        to_axis = (lambda flat: flat % n_x) if axis == 'x' else (lambda flat: flat // n_x)
+        if op == 'count':
+            cells, counts = self.cells('count')
+            return np.bincount(to_axis(cells), weights=counts, minlength=size)
+        if op in ('sum', 'mean'):
+            cells, sums = self.cells('sum')
+            positions = to_axis(cells)
+            total = np.bincount(positions, weights=sums, minlength=size)
+            if op == 'sum':
+                return np.where(np.bincount(positions, minlength=size) > 0, total, np.nan)
+            counts = np.bincount(to_axis(self._flat), minlength=size)
+            return np.where(counts > 0, total / np.maximum(counts, 1), np.nan)
+        if op in ('min', 'max'):
+            cells, agg = self.cells(op)
+            out = np.full(size, np.inf if op == 'min' else -np.inf)
+            (np.minimum if op == 'min' else np.maximum).at(out, to_axis(cells), agg)
+            return np.where(np.isfinite(out), out, np.nan)
+        # median：按轴下标与数值排序后取中位
+        positions = to_axis(self._flat)
+        order = np.lexsort((self._vals, positions))
+        positions, vals = positions[order], self._vals[order]
+        counts = np.bincount(positions, minlength=size)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        out = np.full(size, np.nan)
+        present = counts > 0
+        lo = starts[present] + (counts[present] - 1) // 2
+        hi = starts[present] + counts[present] // 2
+        out[present] = (vals[lo] + vals[hi]) / 2
+        return out
+
+
+def get_pivot(values: List[Dict[str, Any]], key: str, x_field: str, y_field: str, value_field: Optional[str],
+              x_timeunit: Optional[str] = None, y_timeunit: Optional[str] = None) -> HeatmapPivot:
+    """获取（或构建）数据集的热力图透视"""
+    from .data_cache import numeric_column, get_or_compute
+
+    def build():
+        x_codes, x_labels = axis_codes(values, x_field, x_timeunit, key)
+        y_codes, y_labels = axis_codes(values, y_field, y_timeunit, key)
+        nums = numeric_column(values, value_field, key) if value_field else np.zeros(len(values))
+        return HeatmapPivot(x_codes, x_labels, y_codes, y_labels, nums)
+
+    return get_or_compute('heatmap_pivot', (key, x_field, x_timeunit, y_field, y_timeunit, value_field), build)
+
+
+# timeUnit 轴标签对应的 Vega 表达式（{f} 为时间函数前缀 '' 或 'utc'，{d} 为 timeUnit 输出字段）
+_TIMEUNIT_LABEL_EXPR = {
+    'year': '{f}year({d})',
+    'quarter': '{f}quarter({d})',
+    'month': '({f}month({d}) + 1)',
+    'date': '{f}date({d})',
+    'day': '{f}day({d})',
+    'hours': '{f}hours({d})',
+    'yearquarter': '({f}year({d}) * 10 + {f}quarter({d}))',
+    'yearmonth': '({f}year({d}) * 100 + {f}month({d}) + 1)',
+    'yearmonthdate': '({f}year({d}) * 10000 + ({f}month({d}) + 1) * 100 + {f}date({d}))',
+    'monthdate': '(({f}month({d}) + 1) * 100 + {f}date({d}))',
+}
+
+
+def _raw_timeunit(enc: Dict) -> Optional[str]:
+    unit = enc.get('timeUnit')
+    if isinstance(unit, dict):
+        unit = unit.get('unit')
+    return str(unit).lower() if unit else None
+
+
+def _timeunit(enc: Dict) -> Optional[str]:
+    unit = _raw_timeunit(enc)
+    return unit[3:] if unit and unit.startswith('utc') else unit
+
+
+def label_expr(enc: Dict, stage: str = 'mark') -> str:
+    """
+    Vega 表达式：对 datum 求值得到该轴的透视标签（与 HeatmapPivot 标签一致）
+
+    无 timeUnit 时为字段本身。有 timeUnit 时：
+    - stage='mark'（encoding 条件）：读取 Vega-Lite 生成的 "<timeUnit>_<field>" 字段（聚合与非聚合视图中都存在）
+    - stage='data'（顶层 transform.filter，timeUnit 尚未计算）：对原始字段求值
+    """
+    field = enc.get('field')
+    raw = _raw_timeunit(enc)
+    if not raw:
+        return _datum_ref(field)
+    utc = raw.startswith('utc')
+    unit = raw[3:] if utc else raw
+    template = _TIMEUNIT_LABEL_EXPR.get(unit)
+    if template is None:
+        return _datum_ref(field)
+    source = _datum_ref(f'{raw}_{field}') if stage == 'mark' else _datum_ref(field)
+    return template.format(f='utc' if utc else '', d=source)
+
+
+_MONTH_NAMES = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+
+
+def normalize_labels(enc: Dict, labels: List[Any]) -> List[Any]:
+    """
+    用户给出的轴值 -> 透视标签：timeUnit 轴转为整数（month 接受 1-12 或 Jan / January 等名称），其余原样返回
+    """
+    unit = _timeunit(enc)
+    if not unit:
+        return list(labels)
+    out = []
+    for label in labels:
+        if unit == 'month' and isinstance(label, str) and label.strip()[:3].lower() in _MONTH_NAMES:
+            out.append(_MONTH_NAMES[label.strip()[:3].lower()])
+            continue
+        try:
+            out.append(int(label))
+        except (TypeError, ValueError):
+            out.append(label)
+    return out
+
+
+def _datum_ref(field: str) -> str:
+    s = str(field).replace("\\", "\\\\").replace("'", "\\'")
+    return f"datum['{s}']"
+
+
+def pivot_key(values: List[Dict[str, Any]], fields: Tuple[Optional[str], ...]) -> str:
+    """透视数据键：只哈希透视用到的列（远快于整行的 data_key）"""
+    from .data_cache import column_fingerprint
+    return 'pivot:' + '|'.join(column_fingerprint(values, f) for f in fields if f)
+
+
+def pivot_for_spec(vega_spec: Dict) -> Optional[Tuple[HeatmapPivot, Dict[str, Any]]]:
+    """
+    按热力图 spec（单视图，encoding.x / y / color）获取透视
+
+    Returns:
+        (透视, {'x_field','y_field','value_field','op','x_timeunit','y_timeunit','key'})；
+        无内联数据、字段缺失或 timeUnit 不支持时返回 None
+    """
+    from .data_cache import spec_values
+
+    encoding = vega_spec.get('encoding', {}) if isinstance(vega_spec, dict) else {}
+    x_enc = encoding.get('x', {}) or {}
+    y_enc = encoding.get('y', {}) or {}
+    c_enc = encoding.get('color', {}) or {}
+    x_field, y_field = x_enc.get('field'), y_enc.get('field')
+    value_field = c_enc.get('field')
+    values = spec_values(vega_spec)
+    if not x_field or not y_field or not values or not isinstance(values, list):
+        return None
+    x_unit, y_unit = _timeunit(x_enc), _timeunit(y_enc)
+    if (x_unit and x_unit not in PIVOT_TIMEUNITS) or (y_unit and y_unit not in PIVOT_TIMEUNITS):
+        return None
+    op = str(c_enc.get('aggregate') or ('mean' if value_field else 'count')).lower()
+    if op not in PIVOT_AGGREGATES:
+        op = 'mean'
+    # 渲染前的 LOD 阶段每次都会调用，数据键只哈希用到的列
+    key = pivot_key(values, (x_field, y_field, value_field))
+    pivot = get_pivot(values, key, x_field, y_field, value_field, x_unit, y_unit)
+    return pivot, {
+        'x_field': x_field, 'y_field': y_field, 'value_field': value_field, 'op': op,
+        'x_timeunit': x_unit, 'y_timeunit': y_unit, 'key': key
+    }
+
+
+__all__ = [
+    'PIVOT_AGGREGATES',
+    'PIVOT_TIMEUNITS',
+    'axis_codes',
+    'HeatmapPivot',
+    'get_pivot',
+    'pivot_key',
+    'pivot_for_spec',
+    'label_expr',
+    'normalize_labels',
+]
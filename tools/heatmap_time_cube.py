@@ -0,0 +1,119 @@
+"""
+热力图时间立方体（drilldown_time / reset_drilldown 的预聚合缓存）
+
+每个数据集（按 数据键 + 时间字段 + 分类字段 + 数值字段）只构建一次：
+底层是 x = 时间字段按 yearmonthdate（日）截断、y = 分类字段的 HeatmapPivot，
+与其他热力图工具共用 heatmap_pivot 缓存中的同一份存储（不复制原始行）。
+year / month / date 各粒度按 (粒度, 聚合方式) 由 HeatmapPivot.binned 把日合并到时间段后缓存，
+下钻、上卷直接换入这些小的预聚合 data.values，渲染器无需再聚合原始行。
+
+时间段键为整数：year = YYYY，month = YYYYMM，date = YYYYMMDD（UTC，与透视一致）。
+"""
+
+from typing import Dict, Any, List, Optional, Tuple
+import threading
+
+import numpy as np
+
+from .heatmap_pivot import PIVOT_AGGREGATES
+
+
+CUBE_GRAINS = ('year', 'month', 'date')
+CUBE_AGGREGATES = PIVOT_AGGREGATES
+
+# 日键 YYYYMMDD -> 各粒度时间段键的除数
+_GRAIN_DIVISOR = {'year': 10000, 'month': 100, 'date': 1}
+
+
+def period_start(grain: str, period: int) -> str:
+    """时间段键 -> 起点的 ISO 日期字符串"""
+    if grain == 'year':
+        return f'{period:04d}-01-01'
+    if grain == 'month':
+        return f'{period // 100:04d}-{period % 100:02d}-01'
+    return f'{period // 10000:04d}-{period // 100 % 100:02d}-{period % 100:02d}'
+
+
+class HeatmapTimeCube:
+    """单个数据集的热力图时间立方体（各 (粒度, 聚合方式) 按需构建后缓存）"""
+
+    def __init__(self, pivot):
+        self.pivot = pivot
+        self.labels = pivot.y_labels
+        self._days = np.array(pivot.x_labels, dtype=np.int64)
+        self._levels: Dict[Tuple[str, str], Dict[str, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def level(self, grain: str, op: str) -> Dict[str, np.ndarray]:
+        """某一粒度、聚合方式的非空单元格：{'period', 'code', 'value'}（按分类、时间段排序）"""
+        with self._lock:
+            cached = self._levels.get((grain, op))
+            if cached is None:
+                cached = self._levels[(grain, op)] = self._build(grain, op)
+            return cached
+
+    def _build(self, grain: str, op: str) -> Dict[str, np.ndarray]:
+        periods, x_bins = np.unique(self._days // _GRAIN_DIVISOR[grain], return_inverse=True)
+        y_bins = np.arange(self.pivot.shape[0], dtype=np.int64)
+        bins, agg, _ = self.pivot.binned(op, x_bins.astype(np.int64), y_bins)
+        n_periods = max(1, len(periods))
+        level = {
+            'period': periods[bins % n_periods] if len(periods) else np.array([], dtype=np.int64),
+            'code': bins // n_periods,
+            'value': agg,
+        }
+        for column in level.values():
+            column.setflags(write=False)
+        return level
+
+    def rows(self, grain: str, op: str, time_as: str, category_as: str, value_as: str,
+             start: Optional[int] = None, end: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        生成预聚合的 data.values
+
+        Args:
+            grain: year | month | date
+            op: mean | sum | min | max | count | median
+            time_as / category_as / value_as: 时间段起点（ISO 日期）、分类、聚合值的输出字段名
+            start, end: 可选的时间段键范围 [start, end)（如 month 粒度的 201201 到 201301）
+        """
+        level = self.level(grain, op)
+        mask = np.ones(len(level['period']), dtype=bool)
+        if start is not None:
+            mask &= level['period'] >= start
+        if end is not None:
+            mask &= level['period'] < end
+        periods = level['period'][mask].tolist()
+        codes = level['code'][mask].tolist()
+        vals = level['value'][mask].tolist()
+        if op == 'count':
+            vals = [int(v) for v in vals]
+        return [
+            {time_as: period_start(grain, p), category_as: self.labels[c], value_as: v}
+            for p, c, v in zip(periods, codes, vals)
+        ]
+
+
+def get_heatmap_time_cube(values: List[Dict[str, Any]], key: str, time_field: str, category_field: str,
+                          value_field: Optional[str]) -> Optional[HeatmapTimeCube]:
+    """获取（或构建）数据集的热力图时间立方体；时间字段无有效值时返回 None"""
+    from .heatmap_pivot import get_pivot
+    from .data_cache import get_or_compute
+
+    def build():
+        pivot = get_pivot(values, key, time_field, category_field, value_field, x_timeunit='yearmonthdate')
+        if not pivot.x_labels or not pivot.y_labels:
+            return False
+        return HeatmapTimeCube(pivot)
+
+    cube = get_or_compute('heatmap_time_cube', (key, time_field, category_field, value_field), build)
+    return cube or None
+
+
+__all__ = [
+    'CUBE_GRAINS',
+    'CUBE_AGGREGATES',
+    'period_start',
+    'HeatmapTimeCube',
+    'get_heatmap_time_cube',
+]
@@ -7,6 +7,8 @@ import copy
 import json
 from datetime import datetime
 
+import numpy as np
+
 
 def _datum_ref(field: str) -> str:
     """Vega expr: datum access for field names with spaces/special chars."""
@@ -16,6 +18,42 @@ def _datum_ref(field: str) -> str:
     return f"datum['{s}']"
 
 
+def _copy_spec_keep_data(vega_spec: Dict) -> Dict:
+    """
+    深拷贝 spec，但 data.values 数据行与原 spec 共享（只读，避免大数据集的逐行拷贝）；
+    drilldown_time 保存在 _heatmap_state.raw_data 中的原始数据同样共享
+    """
+    data = vega_spec.get('data')
+    state = vega_spec.get('_heatmap_state')
+    raw_data = state.get('raw_data') if isinstance(state, dict) else None
+    new_spec = copy.deepcopy({k: v for k, v in vega_spec.items() if k not in ('data', '_heatmap_state')})
+    if isinstance(data, dict) and isinstance(data.get('values'), list):
+        new_spec['data'] = copy.deepcopy({k: v for k, v in data.items() if k != 'values'})
+        new_spec['data']['values'] = data['values']
+    elif 'data' in vega_spec:
+        new_spec['data'] = copy.deepcopy(data)
+    if isinstance(state, dict):
+        new_spec['_heatmap_state'] = copy.deepcopy({k: v for k, v in state.items() if k != 'raw_data'})
+        if raw_data is not None:
+            new_spec['_heatmap_state']['raw_data'] = raw_data
+    elif '_heatmap_state' in vega_spec:
+        new_spec['_heatmap_state'] = copy.deepcopy(state)
+    return new_spec
+
+
+def _record_highlight(new_spec: Dict, channels: Tuple[str, ...], test: str, **condition: Any):
+    """
+    记录条件通道的高亮条件（_heatmap_highlight），供渲染前的 LOD 换算到合并后的块上（见 heatmap_lod）
+
+    condition 为按单元格（cells 坐标列表，或 x / y 标签集合）或按值（min / max）的条件
+    """
+    encoding = new_spec.get('encoding', {})
+    fields = [(encoding.get('x') or {}).get('field'), (encoding.get('y') or {}).get('field')]
+    highlights = new_spec.setdefault('_heatmap_highlight', {})
+    for channel in channels:
+        highlights[channel] = {'test': test, 'fields': fields, **condition}
+
+
 def adjust_color_scale(vega_spec: Dict, scheme: str = "viridis", domain: List = None) -> Dict[str, Any]:
     """
     调整颜色比例
@@ -110,6 +148,24 @@ def filter_cells(
     }
 
 
+def _pivot_axis_labels(vega_spec: Dict, axis: str, enc: Dict, values: List[Any]) -> Tuple[List[Any], List[Any]]:
+    """
+    用户给出的轴值 -> 透视标签（"2012" 与 2012 视为同一标签，匹配到的使用数据中的原始值）
+
+    Returns:
+        (标签, 未在数据中找到的值)；无法透视时按 normalize_labels 原样返回
+    """
+    from .heatmap_pivot import pivot_for_spec, normalize_labels
+    labels = normalize_labels(enc, list(values))
+    resolved = pivot_for_spec(vega_spec)
+    if resolved is None:
+        return labels, []
+    pivot, _ = resolved
+    positions, missing = pivot.label_positions(axis, labels)
+    axis_labels = pivot.x_labels if axis == 'x' else pivot.y_labels
+    return [axis_labels[i] for i in positions.tolist()] + missing, missing
+
+
 def highlight_region(
     vega_spec: Dict,
     x_values: Optional[List] = None,
@@ -120,15 +176,18 @@ def highlight_region(
     - 仅 x_values：高亮整列（该 x 轴下的所有 y）
     - 仅 y_values：高亮整行（该 y 轴下的所有 x）
     - 两者都提供：高亮交叉区域
+
+    轴值按透视标签匹配（timeUnit 轴 month 为 1-12 或月份名称）。
     """
-    new_spec = copy.deepcopy(vega_spec)
-    
-    x_field = new_spec.get('encoding', {}).get('x', {}).get('field')
-    y_field = new_spec.get('encoding', {}).get('y', {}).get('field')
-    x_timeunit = new_spec.get('encoding', {}).get('x', {}).get('timeUnit')
-    y_timeunit = new_spec.get('encoding', {}).get('y', {}).get('timeUnit')
+    from .heatmap_pivot import label_expr
+    from .predicates import membership_test
+
+    new_spec = _copy_spec_keep_data(vega_spec)
+    encoding = new_spec.get('encoding', {})
+    x_enc = encoding.get('x', {})
+    y_enc = encoding.get('y', {})
     
-    if not x_field or not y_field:
+    if not x_enc.get('field') or not y_enc.get('field'):
         return {'success': False, 'error': 'Cannot find x/y fields'}
 
     x_vals = x_values if x_values is not None else []
@@ -136,70 +195,15 @@ def highlight_region(
     if not x_vals and not y_vals:
         return {'success': False, 'error': 'Must provide at least one of x_values or y_values'}
 
-    # Month name map (Vega month(): 0=Jan ... 11=Dec)
-    MONTH_MAP = {
-        "Jan": 0, "Feb": 1, "Mar": 2, "Apr": 3, "May": 4, "Jun": 5,
-        "Jul": 6, "Aug": 7, "Sep": 8, "Oct": 9, "Nov": 10, "Dec": 11,
-        "January": 0, "February": 1, "March": 2, "April": 3, "June": 5,
-        "July": 6, "August": 7, "September": 8, "October": 9, "November": 10, "December": 11
-    }
-
-    def _normalize_values_for_timeunit(field_name: str, values: List, timeunit: Optional[str]) -> Tuple[str, str]:
-        """
-        Returns (value_list_str, expr) where expr is the datum-side expression to test.
-        value_list_str is already formatted for use inside [ ... ].
-        """
-        if not timeunit:
-            # Treat as raw field value (string compare)
-            value_list_str = ','.join([f'"{v}"' for v in values])
-            return value_list_str, f'datum["{field_name}"]'
-
-        tu = str(timeunit).lower().strip()
-        if tu == 'date':
-            nums = []
-            for v in values:
-                try:
-                    nums.append(str(int(v)))
-                except Exception:
-                    pass
-            value_list_str = ','.join(nums) if nums else ','.join([f'"{v}"' for v in values])
-            return value_list_str, f'date(datum["{field_name}"])'
-        if tu == 'month':
-            months = []
-            for v in values:
-                if isinstance(v, str) and v in MONTH_MAP:
-                    months.append(str(MONTH_MAP[v]))
-                else:
-                    try:
-                        m = int(v)
-                        # user-facing month is 1-12; vega month() is 0-11
-                        months.append(str(m - 1))
-                    except Exception:
-                        pass
-            value_list_str = ','.join(months) if months else ','.join([f'"{v}"' for v in values])
-            return value_list_str, f'month(datum["{field_name}"])'
-        if tu == 'year':
-            years = []
-            for v in values:
-                try:
-                    years.append(str(int(v)))
-                except Exception:
-                    pass
-            value_list_str = ','.join(years) if years else ','.join([f'"{v}"' for v in values])
-            return value_list_str, f'year(datum["{field_name}"])'
-
-        # other timeUnit fall back
-        value_list_str = ','.join([f'"{v}"' for v in values])
-        return value_list_str, f'{tu}(datum["{field_name}"])'
-
-    # Build expressions for x/y (support temporal+timeUnit); only for axes with values
+    # 只对提供了值的轴生成条件（标记阶段：timeUnit 轴读取 "<timeUnit>_<field>"）
     parts: List[str] = []
-    if x_vals:
-        x_list, x_expr = _normalize_values_for_timeunit(x_field, x_vals, x_timeunit)
-        parts.append(f'indexof([{x_list}], {x_expr}) >= 0')
-    if y_vals:
-        y_list, y_expr = _normalize_values_for_timeunit(y_field, y_vals, y_timeunit)
-        parts.append(f'indexof([{y_list}], {y_expr}) >= 0')
+    region: Dict[str, Any] = {'x': None, 'y': None}
+    for axis, vals, enc in (('x', x_vals, x_enc), ('y', y_vals, y_enc)):
+        if vals:
+            labels, _ = _pivot_axis_labels(vega_spec, axis, enc, vals)
+            test, _ = membership_test(new_spec, f'region_{axis}', label_expr(enc), labels)
+            parts.append(test)
+            region[axis] = labels
     test_expr = ' && '.join(parts)
     
     if 'encoding' not in new_spec:
@@ -213,6 +217,7 @@ def highlight_region(
         # 未选中格子更淡，提升区分度
         'value': 0.15
     }
+    _record_highlight(new_spec, ('opacity',), test_expr, **region)
     
     return {
         'success': True,
@@ -222,6 +227,20 @@ def highlight_region(
     }
 
 
+def _cells_in_range(vega_spec: Dict, min_value: Optional[float], max_value: Optional[float]) -> Dict[str, Any]:
+    """范围内 / 全部非空单元格数（基于缓存的透视矩阵）；无法透视时返回空字典"""
+    from .heatmap_pivot import pivot_for_spec
+    resolved = pivot_for_spec(vega_spec)
+    if resolved is None:
+        return {}
+    pivot, info = resolved
+    cells, _ = pivot.cells(info['op'])
+    return {
+        'cells_in_range': pivot.count_in_range(info['op'], min_value, max_value),
+        'cells_total': int(len(cells))
+    }
+
+
 def highlight_region_by_value(
     vega_spec: Dict,
     min_value: Optional[float] = None,
@@ -238,7 +257,7 @@ def highlight_region_by_value(
     if min_value is None and max_value is None:
         return {'success': False, 'error': 'Must provide at least one of min_value or max_value'}
 
-    new_spec = copy.deepcopy(vega_spec)
+    new_spec = _copy_spec_keep_data(vega_spec)
 
     color_enc = (new_spec.get('encoding', {}) or {}).get('color', {}) or {}
     color_field = color_enc.get('field')
@@ -272,13 +291,19 @@ def highlight_region_by_value(
         },
         'value': float(outside_opacity)
     }
+    _record_highlight(new_spec, ('opacity',), test_expr, min=min_value, max=max_value)
 
-    return {
+    result = {
         'success': True,
         'operation': 'highlight_region_by_value',
         'vega_spec': new_spec,
         'message': f'Highlighted cells by value (min={min_value}, max={max_value}); outside_opacity={outside_opacity}'
     }
+    summary = _cells_in_range(vega_spec, min_value, max_value)
+    if summary:
+        result.update(summary)
+        result['message'] += f' - {summary["cells_in_range"]} of {summary["cells_total"]} cells in range'
+    return result
 
 
 def filter_cells_by_region(
@@ -299,13 +324,14 @@ def filter_cells_by_region(
     - 单格子：传 x_value + y_value
     - 多格子（笛卡尔积）：传 x_values + y_values
     """
-    new_spec = copy.deepcopy(vega_spec)
+    from .heatmap_pivot import label_expr
+    from .predicates import membership_test
+
+    new_spec = _copy_spec_keep_data(vega_spec)
 
-    x_field = (new_spec.get('encoding', {}) or {}).get('x', {}).get('field')
-    y_field = (new_spec.get('encoding', {}) or {}).get('y', {}).get('field')
-    x_timeunit = (new_spec.get('encoding', {}) or {}).get('x', {}).get('timeUnit')
-    y_timeunit = (new_spec.get('encoding', {}) or {}).get('y', {}).get('timeUnit')
-    if not x_field or not y_field:
+    x_enc = (new_spec.get('encoding', {}) or {}).get('x', {}) or {}
+    y_enc = (new_spec.get('encoding', {}) or {}).get('y', {}) or {}
+    if not x_enc.get('field') or not y_enc.get('field'):
         return {'success': False, 'error': 'Cannot find x/y fields'}
 
     # normalize to lists
@@ -316,62 +342,14 @@ def filter_cells_by_region(
     if (not x_values or len(x_values) == 0) and (not y_values or len(y_values) == 0):
         return {'success': False, 'error': 'Must provide at least one of x_value/x_values or y_value/y_values'}
 
-    # Reuse the same normalization logic as highlight_region for timeUnit (month/year/date)
-    MONTH_MAP = {
-        "Jan": 0, "Feb": 1, "Mar": 2, "Apr": 3, "May": 4, "Jun": 5,
-        "Jul": 6, "Aug": 7, "Sep": 8, "Oct": 9, "Nov": 10, "Dec": 11,
-        "January": 0, "February": 1, "March": 2, "April": 3, "June": 5,
-        "July": 6, "August": 7, "September": 8, "October": 9, "November": 10, "December": 11
-    }
-
-    def _normalize_values_for_timeunit(field_name: str, values: List[Any], timeunit: Optional[str]) -> Tuple[str, str]:
-        if not timeunit:
-            value_list_str = ','.join([json.dumps(v, ensure_ascii=False) for v in values])
-            return value_list_str, _datum_ref(field_name)
-
-        tu = str(timeunit).lower().strip()
-        if tu == 'date':
-            nums = []
-            for v in values:
-                try:
-                    nums.append(str(int(v)))
-                except Exception:
-                    pass
-            value_list_str = ','.join(nums) if nums else ','.join([json.dumps(v, ensure_ascii=False) for v in values])
-            return value_list_str, f'date({_datum_ref(field_name)})'
-        if tu == 'month':
-            months = []
-            for v in values:
-                if isinstance(v, str) and v in MONTH_MAP:
-                    months.append(str(MONTH_MAP[v]))
-                else:
-                    try:
-                        m = int(v)
-                        months.append(str(m - 1))
-                    except Exception:
-                        pass
-            value_list_str = ','.join(months) if months else ','.join([json.dumps(v, ensure_ascii=False) for v in values])
-            return value_list_str, f'month({_datum_ref(field_name)})'
-        if tu == 'year':
-            years = []
-            for v in values:
-                try:
-                    years.append(str(int(v)))
-                except Exception:
-                    pass
-            value_list_str = ','.join(years) if years else ','.join([json.dumps(v, ensure_ascii=False) for v in values])
-            return value_list_str, f'year({_datum_ref(field_name)})'
-
-        value_list_str = ','.join([json.dumps(v, ensure_ascii=False) for v in values])
-        return value_list_str, f'{tu}({_datum_ref(field_name)})'
-
+    # 数据阶段的过滤（timeUnit 尚未计算，对原始字段求值）；多次过滤叠加，查找表名称带上 transform 位置
+    index = len(new_spec.get('transform', []) or [])
     exclude_parts: List[str] = []
-    if x_values and len(x_values) > 0:
-        x_list, x_expr = _normalize_values_for_timeunit(x_field, list(x_values), x_timeunit)
-        exclude_parts.append(f'indexof([{x_list}], {x_expr}) >= 0')
-    if y_values and len(y_values) > 0:
-        y_list, y_expr = _normalize_values_for_timeunit(y_field, list(y_values), y_timeunit)
-        exclude_parts.append(f'indexof([{y_list}], {y_expr}) >= 0')
+    for axis, vals, enc in (('x', x_values, x_enc), ('y', y_values, y_enc)):
+        if vals:
+            labels, _ = _pivot_axis_labels(vega_spec, axis, enc, vals)
+            test, _ = membership_test(new_spec, f'excluded_{index}_{axis}', label_expr(enc, stage='data'), labels)
+            exclude_parts.append(test)
     exclude_expr = ' && '.join(exclude_parts)
 
     if 'transform' not in new_spec:
@@ -386,54 +364,89 @@ def filter_cells_by_region(
     }
 
 
-def cluster_rows_cols(vega_spec: Dict, cluster_rows: bool = True, 
-                     cluster_cols: bool = True, method: str = "sum") -> Dict[str, Any]:
+# 层次聚类：支持的连接方式 / 距离；叶子数超过上限时跳过最优叶序（O(n^3)），
+# 矩阵单元格数（行 × 列）超过上限且列数超过目标维数时才先随机投影降维
+CLUSTER_LINKAGE_METHODS = ('average', 'complete', 'single', 'ward')
+CLUSTER_METRICS = ('euclidean', 'correlation', 'cosine')
+CLUSTER_OLO_MAX_LEAVES = 1000
+CLUSTER_PROJECTION_MIN_CELLS = 4_000_000
+CLUSTER_MAX_FEATURES = 256
+_LEGACY_SORT_OPS = ('sum', 'mean', 'max')
+
+
+def _cluster_features(matrix: np.ndarray) -> np.ndarray:
     """
-    对热力图的行/列按数值聚合结果重新排序（实现逻辑与说明）
-    
-    实现逻辑：
-    - 使用 encoding.color.field 作为度量字段（即热力图着色的数值）。
-    - 对行（Y 轴）：按 color 字段在每行上的聚合（sum/mean/max）降序排序；
-      对列（X 轴）：按 color 字段在每列上的聚合降序排序。
-    - 通过设置 encoding.y.sort / encoding.x.sort 为 { op, field, order } 实现，
-      Vega-Lite 自动按指定 op 对 field 聚合后排序，使高值行/列靠前，便于发现热点。
-    
-    说明：实现的是“按行/列聚合排序”，而非严格聚类算法；效果类似行列重排，使高值区域更集中。
+    聚类特征：空单元格填充为列均值；行 × 列超过 CLUSTER_PROJECTION_MIN_CELLS 时
+    用固定种子的高斯随机投影降到 CLUSTER_MAX_FEATURES 维（距离近似保持）
     """
+    features = np.array(matrix, dtype=np.float64)
+    missing = np.isnan(features)
+    col_mean = np.nansum(features, axis=0) / np.maximum((~missing).sum(axis=0), 1)
+    features[missing] = np.take(col_mean, np.nonzero(missing)[1])
+    n, d = features.shape
+    if n * d > CLUSTER_PROJECTION_MIN_CELLS and d > CLUSTER_MAX_FEATURES:
+        rng = np.random.default_rng(0)
+        projection = rng.standard_normal((d, CLUSTER_MAX_FEATURES)) / np.sqrt(CLUSTER_MAX_FEATURES)
+        features = features @ projection
+    return features
+
+
+def _cluster_distances(features: np.ndarray, method: str, metric: str) -> np.ndarray:
+    """
+    压缩距离矩阵（pdist 格式）
+
+    single / complete 连接的树只取决于距离的大小顺序，correlation / cosine 可以在按行标准化后
+    用平方欧氏距离 / 2 计算（数值上等于 1 - 相关系数 / 1 - 余弦相似度）；其余情况直接用 pdist(features, metric)
+    """
+    from scipy.spatial.distance import pdist
+
+    if metric in ('correlation', 'cosine') and method in ('single', 'complete'):
+        rows = features - features.mean(axis=1, keepdims=True) if metric == 'correlation' else features
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        rows = rows / np.where(norms > 0, norms, 1.0)
+        return pdist(rows, 'sqeuclidean') / 2.0
+    distances = pdist(features, metric)
+    if metric != 'euclidean':
+        # 常数行的 correlation / 全零行的 cosine 距离为 NaN，按最大距离处理
+        distances = np.nan_to_num(distances, nan=2.0)
+    return distances
+
+
+def _axis_linkage(pivot_key: Tuple, matrix: np.ndarray, axis: str, method: str, metric: str) -> Dict[str, Any]:
+    """
+    单个轴（rows = y 标签，cols = x 标签）的层次聚类，按 (透视, 轴, 连接方式, 距离) 缓存
+
+    Returns:
+        {'order': 叶序（标签下标）, 'linkage': scipy linkage 矩阵, 'optimal': 是否最优叶序}
+    """
+    from scipy.cluster.hierarchy import linkage, leaves_list, optimal_leaf_ordering
+    from .data_cache import get_or_compute
+
+    def build():
+        features = _cluster_features(matrix if axis == 'rows' else matrix.T)
+        n = features.shape[0]
+        if n < 2:
+            return {'order': np.arange(n), 'linkage': None, 'optimal': False}
+        distances = _cluster_distances(features, method, metric)
+        tree = linkage(distances, method=method)
+        optimal = n <= CLUSTER_OLO_MAX_LEAVES
+        if optimal:
+            tree = optimal_leaf_ordering(tree, distances)
+        return {'order': leaves_list(tree), 'linkage': tree, 'optimal': optimal}
+
+    return get_or_compute('heatmap_linkage', (pivot_key, axis, method, metric), build)
+
+
+def _legacy_sort(vega_spec: Dict, cluster_rows: bool, cluster_cols: bool, method: str) -> Dict[str, Any]:
+    """旧版行为：按 color 字段的行/列聚合（sum/mean/max）降序排序"""
     new_spec = copy.deepcopy(vega_spec)
-    
-    if 'encoding' not in new_spec:
-        return {'success': False, 'error': 'No encoding found'}
-    
     encoding = new_spec['encoding']
     color_field = encoding.get('color', {}).get('field')
-    
     if not color_field:
         return {'success': False, 'error': 'Cannot find color field for sorting'}
-    
-    if method == "sum":
-        sort_op = "sum"
-    elif method == "mean":
-        sort_op = "mean"
-    elif method == "max":
-        sort_op = "max"
-    else:
-        sort_op = "sum"
-    
-    if cluster_rows and 'y' in encoding:
-        encoding['y']['sort'] = {
-            'op': sort_op,
-            'field': color_field,
-            'order': 'descending'
-        }
-    
-    if cluster_cols and 'x' in encoding:
-        encoding['x']['sort'] = {
-            'op': sort_op,
-            'field': color_field,
-            'order': 'descending'
-        }
-    
+    for enabled, channel in ((cluster_rows, 'y'), (cluster_cols, 'x')):
+        if enabled and channel in encoding:
+            encoding[channel]['sort'] = {'op': method, 'field': color_field, 'order': 'descending'}
     return {
         'success': True,
         'operation': 'cluster_rows_cols',
@@ -442,212 +455,223 @@ def cluster_rows_cols(vega_spec: Dict, cluster_rows: bool = True,
     }
 
 
+def cluster_rows_cols(vega_spec: Dict, cluster_rows: bool = True, cluster_cols: bool = True,
+                      method: str = "average", metric: str = "euclidean",
+                      n_clusters: Optional[int] = None) -> Dict[str, Any]:
+    """
+    对热力图的行/列做层次聚类并按叶序重排
+
+    实现逻辑：
+    - 长表数据一次性透视为稠密矩阵（行 = y 标签，列 = x 标签，单元格按 color 的 aggregate 聚合，默认 mean），
+      透视按数据缓存（见 heatmap_pivot）。
+    - 对行 / 列分别做 scipy 层次聚类（叶子数不超过 CLUSTER_OLO_MAX_LEAVES 时使用最优叶序），
+      连接矩阵按 (数据, 轴, method, metric) 缓存。
+    - 通过显式的 encoding.y.sort / encoding.x.sort 标签数组应用叶序，相似的行/列相邻。
+    - 指定 n_clusters 时按树切分，返回每个簇包含的标签。
+    - timeUnit 轴（时间顺序）不重排。
+
+    Args:
+        vega_spec: Vega-Lite规范
+        cluster_rows: 是否对行（y）聚类
+        cluster_cols: 是否对列（x）聚类
+        method: 连接方式 average | complete | single | ward（旧值 sum | mean | max 仍按聚合值降序排序）
+        metric: 距离 euclidean | correlation | cosine
+        n_clusters: 树切分的簇数（可选）
+    """
+    from .heatmap_pivot import pivot_for_spec
+
+    if 'encoding' not in vega_spec:
+        return {'success': False, 'error': 'No encoding found'}
+    method = str(method).lower().strip()
+    if method in _LEGACY_SORT_OPS:
+        return _legacy_sort(vega_spec, cluster_rows, cluster_cols, method)
+    if method not in CLUSTER_LINKAGE_METHODS:
+        return {'success': False, 'error': f'Unsupported method: {method}. Use one of {list(CLUSTER_LINKAGE_METHODS)}'}
+    if metric not in CLUSTER_METRICS:
+        return {'success': False, 'error': f'Unsupported metric: {metric}. Use one of {list(CLUSTER_METRICS)}'}
+    if method == 'ward' and metric != 'euclidean':
+        return {'success': False, 'error': 'ward linkage requires metric=euclidean'}
+
+    resolved = pivot_for_spec(vega_spec)
+    if resolved is None:
+        return {'success': False, 'error': 'Cannot build the heatmap matrix (needs inline data and x/y fields)'}
+    pivot, info = resolved
+    matrix = pivot.dense(info['op'])
+    pivot_key = (info['key'], info['x_field'], info['x_timeunit'], info['y_field'], info['y_timeunit'],
+                 info['value_field'], info['op'])
+
+    new_spec = _copy_spec_keep_data(vega_spec)
+    encoding = new_spec['encoding']
+    result: Dict[str, Any] = {
+        'success': True,
+        'operation': 'cluster_rows_cols',
+        'vega_spec': new_spec,
+        'matrix_shape': list(pivot.shape),
+        'method': method,
+        'metric': metric
+    }
+    details: List[str] = []
+    done: List[str] = []
+    for enabled, axis, channel, labels, unit in (
+        (cluster_rows, 'rows', 'y', pivot.y_labels, info['y_timeunit']),
+        (cluster_cols, 'cols', 'x', pivot.x_labels, info['x_timeunit'])
+    ):
+        if not enabled:
+            continue
+        if unit:
+            details.append(f'{axis} use timeUnit {unit}; kept in time order')
+            continue
+        engine = _axis_linkage(pivot_key, matrix, axis, method, metric)
+        ordered = [labels[i] for i in engine['order'].tolist()]
+        encoding.setdefault(channel, {})['sort'] = ordered
+        result[f'{axis[:-1]}_order'] = ordered[:100]
+        done.append(axis)
+        details.append(f'{axis}: {len(labels)} leaves, '
+                       f'{"optimal leaf ordering" if engine["optimal"] else "dendrogram order (too many leaves for optimal ordering)"}')
+        if n_clusters and engine['linkage'] is not None:
+            from scipy.cluster.hierarchy import fcluster
+            cut = fcluster(engine['linkage'], t=int(n_clusters), criterion='maxclust')
+            clusters: Dict[str, List[Any]] = {}
+            for i in engine['order'].tolist():
+                clusters.setdefault(str(int(cut[i])), []).append(labels[i])
+            result[f'{axis[:-1]}_clusters'] = clusters
+
+    result['details'] = details
+    result['message'] = (f'Clustered {" and ".join(done)} ({method} linkage, {metric} distance)'
+                         if done else 'Nothing to cluster')
+    return result
+
+
 def select_submatrix(vega_spec: Dict, x_values: List = None, 
                     y_values: List = None) -> Dict[str, Any]:
-    """选择子矩阵"""
-    if not x_values and not y_values:
-        return {'success': False, 'error': 'Must specify x_values or y_values'}
+    """
+    选择子矩阵
     
-    new_spec = copy.deepcopy(vega_spec)
+    给定值按透视标签匹配（"2012" 与 2012 视为同一标签；timeUnit 轴 year 为年份，
+    month 为 1-12 或月份名称，date 为 1-31），子矩阵统计直接对缓存的透视矩阵切片计算。
+    """
+    from .heatmap_pivot import pivot_for_spec, label_expr, normalize_labels
+    from .predicates import membership_test
     
-    # 月份名称到数字的映射 (Vega month 从 0 开始: 0=Jan, 11=Dec)
-    MONTH_MAP = {
-        "Jan": 0, "Feb": 1, "Mar": 2, "Apr": 3,
-        "May": 4, "Jun": 5, "Jul": 6, "Aug": 7,
-        "Sep": 8, "Oct": 9, "Nov": 10, "Dec": 11,
-        "January": 0, "February": 1, "March": 2, "April": 3,
-        "May": 4, "June": 5, "July": 6, "August": 7,
-        "September": 8, "October": 9, "November": 10, "December": 11
-    }
+    if not x_values and not y_values:
+        return {'success': False, 'error': 'Must specify x_values or y_values'}
     
+    new_spec = _copy_spec_keep_data(vega_spec)
     encoding = new_spec.get('encoding', {})
     x_encoding = encoding.get('x', {})
     y_encoding = encoding.get('y', {})
     
-    x_field = x_encoding.get('field')
-    y_field = y_encoding.get('field')
-    x_timeunit = x_encoding.get('timeUnit')
-    y_timeunit = y_encoding.get('timeUnit')
-    
-    if 'transform' not in new_spec:
-        new_spec['transform'] = []
-    
-    filters = []
+    x_labels = normalize_labels(x_encoding, x_values) if x_values and x_encoding.get('field') else None
+    y_labels = normalize_labels(y_encoding, y_values) if y_values and y_encoding.get('field') else None
     
-    # 处理 X 轴过滤
-    if x_values and x_field:
-        if x_timeunit:
-            # 有 timeUnit，使用 Vega 表达式函数
-            if x_timeunit == 'date':
-                # 提取日期（1-31）
-                x_nums = ','.join([str(int(v)) for v in x_values])
-                filters.append(f'indexof([{x_nums}], date(datum.{x_field})) >= 0')
-            elif x_timeunit == 'month':
-                # 提取月份，尝试转换月份名称为数字
-                x_months = []
-                for v in x_values:
-                    if v in MONTH_MAP:
-                        x_months.append(str(MONTH_MAP[v]))
-                    else:
-                        try:
-                            x_months.append(str(int(v)))
-                        except:
-                            x_months.append(f'"{v}"')
-                x_str = ','.join(x_months)
-                filters.append(f'indexof([{x_str}], month(datum.{x_field})) >= 0')
-            elif x_timeunit == 'year':
-                x_nums = ','.join([str(int(v)) for v in x_values])
-                filters.append(f'indexof([{x_nums}], year(datum.{x_field})) >= 0')
-            else:
-                # 其他 timeUnit，直接使用函数名
-                x_str = ','.join([f'"{v}"' for v in x_values])
-                filters.append(f'indexof([{x_str}], {x_timeunit}(datum.{x_field})) >= 0')
-        else:
-            # 没有 timeUnit，直接匹配字段值
-            x_str = ','.join([f'"{v}"' for v in x_values])
-            filters.append(f'indexof([{x_str}], datum.{x_field}) >= 0')
-    
-    # 处理 Y 轴过滤
-    if y_values and y_field:
-        if y_timeunit:
-            # 有 timeUnit，使用 Vega 表达式函数
-            if y_timeunit == 'date':
-                y_nums = ','.join([str(int(v)) for v in y_values])
-                filters.append(f'indexof([{y_nums}], date(datum.{y_field})) >= 0')
-            elif y_timeunit == 'month':
-                # 提取月份，尝试转换月份名称为数字
-                y_months = []
-                for v in y_values:
-                    if v in MONTH_MAP:
-                        y_months.append(str(MONTH_MAP[v]))
-                    else:
-                        try:
-                            y_months.append(str(int(v)))
-                        except:
-                            y_months.append(f'"{v}"')
-                y_str = ','.join(y_months)
-                filters.append(f'indexof([{y_str}], month(datum.{y_field})) >= 0')
-            elif y_timeunit == 'year':
-                y_nums = ','.join([str(int(v)) for v in y_values])
-                filters.append(f'indexof([{y_nums}], year(datum.{y_field})) >= 0')
-            else:
-                # 其他 timeUnit，直接使用函数名
-                y_str = ','.join([f'"{v}"' for v in y_values])
-                filters.append(f'indexof([{y_str}], {y_timeunit}(datum.{y_field})) >= 0')
-        else:
-            # 没有 timeUnit，直接匹配字段值
-            y_str = ','.join([f'"{v}"' for v in y_values])
-            filters.append(f'indexof([{y_str}], datum.{y_field}) >= 0')
-    
-    if filters:
-        new_spec['transform'].append({
-            'filter': ' && '.join(filters)
-        })
-    
-    return {
+    result = {
         'success': True,
         'operation': 'select_submatrix',
         'vega_spec': new_spec,
         'message': f'Selected submatrix with {len(x_values) if x_values else "all"} cols, {len(y_values) if y_values else "all"} rows'
     }
+    
+    # 子矩阵统计：标签 -> 下标后对透视矩阵切片；匹配到的标签使用数据中的原始值（类型一致）
+    resolved = pivot_for_spec(vega_spec)
+    if resolved is not None:
+        pivot, info = resolved
+        x_pos, x_missing = pivot.label_positions('x', x_labels) if x_labels else (None, [])
+        y_pos, y_missing = pivot.label_positions('y', y_labels) if y_labels else (None, [])
+        if x_labels:
+            x_labels = [pivot.x_labels[i] for i in x_pos.tolist()] + x_missing
+        if y_labels:
+            y_labels = [pivot.y_labels[i] for i in y_pos.tolist()] + y_missing
+        block = pivot.submatrix(info['op'], x_pos, y_pos)
+        filled = block[np.isfinite(block)]
+        summary = {'shape': list(block.shape), 'non_empty_cells': int(filled.size), 'aggregate': info['op']}
+        if filled.size:
+            summary.update({'min': float(filled.min()), 'max': float(filled.max()), 'mean': float(filled.mean())})
+        result['submatrix'] = summary
+        if x_missing or y_missing:
+            result['missing_values'] = {'x': x_missing, 'y': y_missing}
+            result['message'] += f' (not found: x={x_missing}, y={y_missing})'
+    
+    # 多次选择会叠加过滤，查找表名称带上该过滤在 transform 中的位置
+    index = len(new_spec.get('transform', []) or [])
+    filters = []
+    for axis, labels, enc in (('x', x_labels, x_encoding), ('y', y_labels, y_encoding)):
+        if labels:
+            test, _ = membership_test(new_spec, f'submatrix_{index}_{axis}', label_expr(enc, stage="data"), labels)
+            filters.append(test)
+    if filters:
+        # 记录选中的标签，供渲染前的 LOD 阶段确定可见的行列（只有子矩阵过滤时才可确定）
+        state = new_spec.get('_heatmap_submatrix') or {}
+        transforms = new_spec.setdefault('transform', [])
+        chained = not transforms or state.get('transforms') == len(transforms)
+        transforms.append({
+            'filter': ' && '.join(filters)
+        })
+        if chained:
+            new_spec['_heatmap_submatrix'] = {
+                'x': _intersect_labels(state.get('x'), x_labels),
+                'y': _intersect_labels(state.get('y'), y_labels),
+                'transforms': len(transforms)
+            }
+        else:
+            new_spec.pop('_heatmap_submatrix', None)
+    return result
+
+
+def _intersect_labels(previous: Optional[List[Any]], labels: Optional[List[Any]]) -> Optional[List[Any]]:
+    """叠加的子矩阵选择：两次都选择了该轴时取交集（None 表示整轴）"""
+    if previous is None:
+        return labels
+    if labels is None:
+        return previous
+    wanted = {str(label) for label in labels}
+    return [label for label in previous if str(label) in wanted]
 
 
 def find_extremes(vega_spec: Dict, top_n: int = 5, mode: str = "both") -> Dict[str, Any]:
     """
     标记极值点位置
     
+    单元格值来自缓存的透视矩阵（按 color 的 aggregate 聚合，默认 mean），
+    用 argpartition 取前 N 个，无需对全部单元格排序。
+    
     Args:
         vega_spec: Vega-Lite规范
         top_n: 标记前N个极值
         mode: "max" | "min" | "both"
     """
-    new_spec = copy.deepcopy(vega_spec)
+    from .heatmap_pivot import pivot_for_spec, label_expr
+    from .predicates import membership_test
     
-    # 获取字段信息
-    encoding = new_spec.get('encoding', {})
-    x_field = encoding.get('x', {}).get('field')
-    y_field = encoding.get('y', {}).get('field')
-    color_field = encoding.get('color', {}).get('field')
-    
-    if not color_field:
+    encoding = vega_spec.get('encoding', {})
+    if not encoding.get('color', {}).get('field'):
         return {'success': False, 'error': 'Cannot find color field for finding extremes'}
     
-    # 获取数据
-    data = new_spec.get('data', {}).get('values', [])
-    if not data:
+    resolved = pivot_for_spec(vega_spec)
+    if resolved is None:
         return {'success': False, 'error': 'No data found'}
+    pivot, info = resolved
+    agg_op = info['op']
     
-    # 聚合为格子值（按 x/y 分组）
-    agg_op = (encoding.get('color', {}) or {}).get('aggregate')
-    agg_op = str(agg_op).lower().strip() if agg_op else 'mean'
-    allowed = {"mean", "sum", "max", "min", "median", "count"}
-    if agg_op not in allowed:
-        agg_op = 'mean'
-    
-    grouped = {}
-    for d in data:
-        if d.get(color_field) is None:
-            continue
-        x_val = d.get(x_field)
-        y_val = d.get(y_field)
-        if x_val is None or y_val is None:
-            continue
-        key = (x_val, y_val)
-        grouped.setdefault(key, []).append(d.get(color_field))
-    
-    def _aggregate(vals: List[Any]) -> float:
-        nums = [v for v in vals if isinstance(v, (int, float))]
-        if not nums:
-            return 0.0
-        if agg_op == 'sum':
-            return float(sum(nums))
-        if agg_op == 'max':
-            return float(max(nums))
-        if agg_op == 'min':
-            return float(min(nums))
-        if agg_op == 'median':
-            s = sorted(nums)
-            mid = len(s) // 2
-            return float(s[mid]) if len(s) % 2 == 1 else float((s[mid - 1] + s[mid]) / 2)
-        if agg_op == 'count':
-            return float(len(nums))
-        # mean (default)
-        return float(sum(nums) / len(nums))
-    
-    aggregated = [
-        {x_field: k[0], y_field: k[1], color_field: _aggregate(v)}
-        for k, v in grouped.items()
-    ]
-    if not aggregated:
-        return {'success': False, 'error': 'No aggregated values found'}
-    
-    # 按聚合后的格子值排序找极值
-    sorted_data = sorted(
-        aggregated,
-        key=lambda x: x.get(color_field, 0)
-    )
-    
-    extremes = []
+    picked = []
     if mode in ["max", "both"]:
-        extremes.extend(sorted_data[-top_n:])
+        picked.append(pivot.extremes(agg_op, top_n, largest=True))
     if mode in ["min", "both"]:
-        extremes.extend(sorted_data[:top_n])
-    
-    # 构建极值点的坐标条件（支持含空格的字段名）
-    dx, dy = _datum_ref(x_field), _datum_ref(y_field)
-    extreme_conditions = []
-    for e in extremes:
-        x_val = e.get(x_field)
-        y_val = e.get(y_field)
-        if x_val is not None and y_val is not None:
-            xq = json.dumps(x_val) if isinstance(x_val, str) else x_val
-            yq = json.dumps(y_val) if isinstance(y_val, str) else y_val
-            extreme_conditions.append(f'({dx} === {xq} && {dy} === {yq})')
-    
-    if not extreme_conditions:
-        return {'success': False, 'error': 'No extreme values found'}
+        picked.append(pivot.extremes(agg_op, top_n, largest=False))
+    if not picked or not any(len(cells) for cells, _ in picked):
+        return {'success': False, 'error': 'No aggregated values found'}
     
-    test_expr = ' || '.join(extreme_conditions)
+    extreme_info = []
+    for cells, agg in picked:
+        x_labels, y_labels = pivot.cell_labels(cells)
+        for x_val, y_val, value in zip(x_labels, y_labels, agg.tolist()):
+            extreme_info.append({'x': x_val, 'y': y_val, 'value': value, 'aggregate': agg_op})
+    
+    # 极值点的坐标条件（timeUnit 轴按 timeUnit 标签匹配；条目多时用 indexof / 查找表代替 || 子句）
+    new_spec = _copy_spec_keep_data(vega_spec)
+    test_expr, _ = membership_test(
+        new_spec, 'extremes', [label_expr(encoding['x']), label_expr(encoding['y'])],
+        [(e['x'], e['y']) for e in extreme_info]
+    )
     # 使用 transparent 替代 null，避免 Vega 信号名问题
     new_spec['encoding']['stroke'] = {
         'condition': {'test': test_expr, 'value': 'red'},
@@ -660,23 +684,15 @@ def find_extremes(vega_spec: Dict, top_n: int = 5, mode: str = "both") -> Dict[s
         },
         'value': 0
     }
-    
-    # 返回极值信息
-    extreme_info = []
-    for e in extremes:
-        extreme_info.append({
-            'x': e.get(x_field),
-            'y': e.get(y_field),
-            'value': e.get(color_field),
-            'aggregate': agg_op
-        })
+    _record_highlight(new_spec, ('stroke', 'strokeWidth'), test_expr,
+                      cells=[[e['x'], e['y']] for e in extreme_info])
     
     return {
         'success': True,
         'operation': 'find_extremes',
         'vega_spec': new_spec,
         'extremes': extreme_info,
-        'message': f'Marked {len(extremes)} extreme points (mode: {mode})'
+        'message': f'Marked {len(extreme_info)} extreme points (mode: {mode})'
     }
 
 
@@ -695,7 +711,7 @@ def threshold_mask(
         max_value: 上阈值（包含）
         outside_opacity: 范围外的透明度
     """
-    new_spec = copy.deepcopy(vega_spec)
+    new_spec = _copy_spec_keep_data(vega_spec)
 
     color_enc = new_spec.get('encoding', {}).get('color', {})
     color_field = color_enc.get('field')
@@ -716,20 +732,27 @@ def threshold_mask(
         new_spec['encoding'] = {}
 
     ref = _datum_ref(value_field)
+    test_expr = f'{ref} >= {min_value} && {ref} <= {max_value}'
     new_spec['encoding']['opacity'] = {
         'condition': {
-            'test': f'{ref} >= {min_value} && {ref} <= {max_value}',
+            'test': test_expr,
             'value': 1.0
         },
         'value': float(outside_opacity)
     }
+    _record_highlight(new_spec, ('opacity',), test_expr, min=min_value, max=max_value)
 
-    return {
+    result = {
         'success': True,
         'operation': 'threshold_mask',
         'vega_spec': new_spec,
         'message': f'Applied threshold mask on {value_field} in [{min_value}, {max_value}]'
     }
+    summary = _cells_in_range(vega_spec, min_value, max_value)
+    if summary:
+        result.update(summary)
+        result['message'] += f' - {summary["cells_in_range"]} of {summary["cells_total"]} cells in range'
+    return result
 
 
 def drilldown_time(
@@ -744,6 +767,8 @@ def drilldown_time(
     约定：
     - 时间字段在 encoding.x.field，且 encoding.x.type == 'temporal'
     - 初始建议 timeUnit='year'（若缺省，也可被记录并在 reset 时恢复）
+    - y 为分类轴且没有其他 transform 时，从时间立方体（tools.heatmap_time_cube）换入该时间段的
+      预聚合行；否则退回 filter + timeUnit，由渲染器聚合原始行（每次下钻按当前视图重新判断）
     
     Args:
         vega_spec: Vega-Lite规范
@@ -751,7 +776,7 @@ def drilldown_time(
         value: 对应 level 的值（year=int；month=1-12；date=1-31）
         parent: 可选父级信息，如 {'year': 2012} 或 {'year':2012,'month':3}
     """
-    new_spec = copy.deepcopy(vega_spec)
+    new_spec = _copy_spec_keep_data(vega_spec)
 
     encoding = new_spec.get('encoding', {})
     x_enc = encoding.get('x', {})
@@ -803,6 +828,7 @@ def drilldown_time(
         state['parent'] = {'year': year_val}
         next_timeunit = 'month'
         filters.append(f'year(datum.{time_field}) == {year_val}')
+        cube_range = ('month', year_val * 100, (year_val + 1) * 100)
 
     elif level == 'month':
         # month drilldown needs year
@@ -820,6 +846,8 @@ def drilldown_time(
         # Vega-Lite month() returns 0-11, so month 1-12 => compare month()==month-1
         filters.append(f'year(datum.{time_field}) == {year_val}')
         filters.append(f'month(datum.{time_field}) == {month_val - 1}')
+        month_key = year_val * 100 + month_val
+        cube_range = ('date', month_key * 100, (month_key + 1) * 100)
 
     elif level == 'date':
         # date drilldown needs year+month
@@ -839,6 +867,8 @@ def drilldown_time(
         filters.append(f'year(datum.{time_field}) == {year_val}')
         filters.append(f'month(datum.{time_field}) == {month_val - 1}')
         filters.append(f'date(datum.{time_field}) == {date_val}')
+        date_key = (year_val * 100 + month_val) * 100 + date_val
+        cube_range = ('date', date_key, date_key + 1)
 
     else:
         return {'success': False, 'error': f'Unsupported level: {level}. Use year|month|date'}
@@ -853,12 +883,23 @@ def drilldown_time(
         new_spec['encoding']['x']['type'] = 'temporal'
         new_spec['encoding']['x']['field'] = time_field
 
-    # add filter transform
-    if filters:
-        new_spec['transform'].append({
-            'filter': ' && '.join(filters),
-            '_avs_tag': 'heatmap_drilldown_time'
-        })
+    # 优先使用时间立方体：直接换入预聚合行，渲染器无需再聚合原始数据。
+    # 每次下钻都先换回原始数据再按当前视图重新判断：上次下钻后加入的 transform（如 filter_cells）
+    # 或编码变化会让立方体不再适用，此时走 filter + timeUnit，由渲染器聚合原始行
+    _restore_raw_heatmap(new_spec, state)
+    state['cube'] = _time_cube_config(new_spec)
+    rollup = _time_cube_rows(new_spec, state, *cube_range) if state['cube'] else None
+    if rollup is not None:
+        _apply_time_cube_rows(new_spec, state, rollup, cube_range[0])
+        message = f'Drilldown to {level}={value} ({len(rollup)} pre-aggregated cells)'
+    else:
+        # add filter transform
+        if filters:
+            new_spec['transform'].append({
+                'filter': ' && '.join(filters),
+                '_avs_tag': 'heatmap_drilldown_time'
+            })
+        message = f'Drilldown to {level}={value}'
 
     new_spec['_heatmap_state'] = state
 
@@ -866,16 +907,124 @@ def drilldown_time(
         'success': True,
         'operation': 'drilldown_time',
         'vega_spec': new_spec,
-        'message': f'Drilldown to {level}={value}',
+        'message': message,
         'state': state.get('parent')
     }
 
 
+def _time_cube_config(vega_spec: Dict) -> Optional[Dict[str, Any]]:
+    """
+    判断当前（原始数据）视图能否使用时间立方体（y 为无 timeUnit 的分类轴、color 为可预聚合的数值、
+    没有 drilldown_time 以外的 transform、其他通道不引用字段），返回立方体参数或 None；每次下钻都重新判断
+    """
+    from .heatmap_time_cube import CUBE_AGGREGATES
+    from .heatmap_pivot import _timeunit
+
+    encoding = vega_spec.get('encoding') or {}
+    y_enc = encoding.get('y') or {}
+    c_enc = encoding.get('color') or {}
+    if not y_enc.get('field') or _timeunit(y_enc) or y_enc.get('aggregate') or y_enc.get('bin'):
+        return None
+    if any(channel not in ('x', 'y', 'color', 'tooltip') for channel in encoding):
+        return None
+    if any(not (isinstance(t, dict) and t.get('_avs_tag') == 'heatmap_drilldown_time')
+           for t in vega_spec.get('transform', []) or []):
+        return None
+    value_field = c_enc.get('field')
+    op = str(c_enc.get('aggregate') or ('mean' if value_field else 'count')).lower()
+    if op not in CUBE_AGGREGATES or c_enc.get('bin') or c_enc.get('timeUnit'):
+        return None
+    if value_field and c_enc.get('type') not in (None, 'quantitative'):
+        return None
+    return {
+        'time_field': (encoding.get('x') or {}).get('field'),
+        'category_field': y_enc['field'],
+        'value_field': value_field,
+        'op': op,
+    }
+
+
+def _time_cube_rows(vega_spec: Dict, state: Dict, grain: str, start: int, end: int) -> Optional[List[Dict[str, Any]]]:
+    """从时间立方体取时间段键 [start, end) 内的预聚合行；原始数据不适用时返回 None"""
+    from .heatmap_time_cube import get_heatmap_time_cube
+    from .heatmap_pivot import pivot_key
+    from .data_cache import load_full_values
+
+    config = state['cube']
+    source = state['raw_data'] if isinstance(state.get('raw_data'), dict) else vega_spec.get('data')
+    if not isinstance(source, dict) or not isinstance(source.get('values'), list):
+        return None
+    fields = (config['time_field'], config['category_field'], config['value_field'])
+    full = load_full_values(dict(vega_spec, data=source))
+    if full is not None:
+        values, key = full
+    else:
+        values = source['values']
+        key = pivot_key(values, fields)
+    if not values:
+        return None
+    cube = get_heatmap_time_cube(values, key, *fields)
+    if cube is None:
+        return None
+    return cube.rows(grain, config['op'], config['time_field'], config['category_field'],
+                     config['value_field'] or 'count', start=start, end=end)
+
+
+def _apply_time_cube_rows(new_spec: Dict, state: Dict, rows: List[Dict[str, Any]], grain: str):
+    """换入预聚合行：color 改为直接映射聚合值（不再由渲染器聚合），tooltip 改为预聚合字段"""
+    config = state['cube']
+    encoding = new_spec['encoding']
+    if 'raw_data' not in state:
+        state['raw_data'] = new_spec.get('data')
+        state['original_color_encoding'] = copy.deepcopy(encoding.get('color'))
+        state['original_tooltip'] = copy.deepcopy(encoding.get('tooltip'))
+    new_spec['data'] = {'values': rows}
+
+    value_as = config['value_field'] or 'count'
+    original_color = state.get('original_color_encoding') or {}
+    value_title = original_color.get('title') or (
+        f"{config['op']}({config['value_field']})" if config['value_field'] else 'count')
+    color = {k: v for k, v in (encoding.get('color') or {}).items() if k != 'aggregate'}
+    color.update({'field': value_as, 'type': 'quantitative', 'title': value_title})
+    encoding['color'] = color
+    if state.get('original_tooltip') is not None:
+        encoding['tooltip'] = [
+            {'field': config['time_field'], 'type': 'temporal', 'title': encoding['x'].get('title', config['time_field']),
+             'format': '%Y-%m' if grain == 'month' else '%Y-%m-%d'},
+            {'field': config['category_field'], 'type': 'nominal'},
+            {'field': value_as, 'type': 'quantitative', 'title': value_title, 'format': '.4~g'},
+        ]
+    new_spec['transform'] = [
+        t for t in new_spec.get('transform', []) or []
+        if not (isinstance(t, dict) and t.get('_avs_tag') == 'heatmap_drilldown_time')
+    ]
+
+
+def _restore_raw_heatmap(new_spec: Dict, state: Dict):
+    """恢复立方体下钻前的原始数据、color 与 tooltip（保留之后对 color 的其他调整，如配色）"""
+    if not isinstance(state.get('raw_data'), dict):
+        return
+    new_spec['data'] = state.pop('raw_data')
+    encoding = new_spec.setdefault('encoding', {})
+    original_color = state.pop('original_color_encoding', None) or {}
+    color = {k: v for k, v in (encoding.get('color') or {}).items()
+             if k not in ('field', 'type', 'aggregate', 'title')}
+    color.update({k: copy.deepcopy(original_color[k]) for k in ('field', 'type', 'aggregate', 'title')
+                  if k in original_color})
+    if color:
+        encoding['color'] = color
+    original_tooltip = state.pop('original_tooltip', None)
+    if original_tooltip is not None:
+        encoding['tooltip'] = original_tooltip
+    else:
+        encoding.pop('tooltip', None)
+
+
 def reset_drilldown(vega_spec: Dict) -> Dict[str, Any]:
     """
-    重置时间热力图下钻：移除 drilldown_time 添加的 filter，并恢复原始 x 编码（timeUnit 等）。
+    重置时间热力图下钻：移除 drilldown_time 添加的 filter，恢复原始数据（立方体下钻时换出）与原始 x 编码（timeUnit 等）。
     """
-    new_spec = copy.deepcopy(vega_spec)
+    new_spec = _copy_spec_keep_data(vega_spec)
 
     state = new_spec.get('_heatmap_state')
     original_x = None
@@ -888,6 +1037,10 @@ def reset_drilldown(vega_spec: Dict) -> Dict[str, Any]:
             if not (isinstance(t, dict) and t.get('_avs_tag') == 'heatmap_drilldown_time')
         ]
 
+    # 恢复立方体下钻换出的原始数据（无需重新聚合，立方体保留在缓存中供下次下钻）
+    if isinstance(state, dict):
+        _restore_raw_heatmap(new_spec, state)
+
     if original_x and isinstance(original_x, dict):
         if 'encoding' not in new_spec:
             new_spec['encoding'] = {}
@@ -933,7 +1086,7 @@ def add_marginal_bars(
     if not show_top and not show_right:
         return {'success': False, 'error': 'At least one of show_top/show_right must be True'}
 
-    new_spec = copy.deepcopy(vega_spec)
+    new_spec = _copy_spec_keep_data(vega_spec)
     encoding = new_spec.get("encoding", {}) or {}
     x_enc = encoding.get("x", {}) or {}
     y_enc = encoding.get("y", {}) or {}
@@ -950,7 +1103,7 @@ def add_marginal_bars(
     if agg not in allowed:
         return {'success': False, 'error': f'Unsupported op: {op}. Use one of {sorted(list(allowed))}'}
 
-    main = copy.deepcopy(new_spec)
+    main = _copy_spec_keep_data(new_spec)
     title = main.pop("title", None)
 
     default_w, default_h = 400, 300
@@ -970,7 +1123,8 @@ def add_marginal_bars(
     def _base_block() -> Dict[str, Any]:
         block: Dict[str, Any] = {}
         if base_data is not None:
-            block["data"] = copy.deepcopy(base_data)
+            # 各子图共享同一份数据行（只读）
+            block["data"] = {**base_data} if isinstance(base_data, dict) else copy.deepcopy(base_data)
         if base_transform is not None:
             block["transform"] = copy.deepcopy(base_transform)
         if base_config is not None:
@@ -1015,6 +1169,28 @@ def add_marginal_bars(
         right_spec["encoding"]["y"]["axis"] = {"labels": False, "ticks": False, "title": None, "domain": False}
         right_spec["encoding"]["x"]["axis"] = {"grid": False, "ticks": False, "title": None}
 
+    # 边际值由缓存的透视矩阵向量化计算，作为小的预聚合数据内联（无需在每个子图中复制全部数据行）；
+    # 有 transform 或 timeUnit 轴时仍由渲染器聚合
+    from .heatmap_pivot import pivot_for_spec
+    resolved = pivot_for_spec(vega_spec) if not base_transform else None
+    precomputed = []
+    for block, axis, enc, value_channel in ((top_spec, 'x', x_enc, 'y'), (right_spec, 'y', y_enc, 'x')):
+        if block is None or resolved is None or enc.get('timeUnit'):
+            continue
+        pivot, _ = resolved
+        labels = pivot.x_labels if axis == 'x' else pivot.y_labels
+        margins = pivot.marginal(axis, agg)
+        block["data"] = {"values": [
+            {enc["field"]: label, "_marginal": float(v)}
+            for label, v in zip(labels, margins.tolist()) if np.isfinite(v)
+        ]}
+        block.pop("transform", None)
+        value_enc = {"field": "_marginal", "type": "quantitative", "title": None,
+                     "axis": block["encoding"][value_channel].get("axis")}
+        block["encoding"][value_channel] = value_enc
+        block["encoding"]["tooltip"][1] = {"field": "_marginal", "type": "quantitative", "title": f"{agg}({value_field})"}
+        precomputed.append('top' if axis == 'x' else 'right')
+
     # Compose: vconcat(top, hconcat(main, right))
     # We want x shared between top and main; y shared between main and right.
     row = {
@@ -1044,7 +1220,8 @@ def add_marginal_bars(
         "success": True,
         "operation": "add_marginal_bars",
         "vega_spec": composed,
-        "message": f"Added marginal bars (op={agg}, top={show_top}, right={show_right})"
+        "message": f"Added marginal bars (op={agg}, top={show_top}, right={show_right})",
+        "precomputed_margins": precomputed
     }
 
 
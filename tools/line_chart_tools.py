@@ -6,6 +6,8 @@ from typing import List, Dict, Any, Tuple, Optional
 import copy
 import json
 
+import numpy as np
+
 
 def _datum_ref(field: str) -> str:
     """Vega expr: datum access for field names with spaces/special chars."""
@@ -91,13 +93,25 @@ def zoom_time_range(vega_spec: Dict, start: str, end: str) -> Dict[str, Any]:
             else:
                 new_spec['mark'] = {'type': new_spec['mark'], 'clip': True}
     
-    return {
+    details = [f'View zoomed to show time range between {start} and {end}']
+    result = {
         'success': True,
         'operation': 'zoom_time_range',
         'vega_spec': new_spec,
         'message': f'Zoomed to time range: {start} to {end}',
-        'details': [f'View zoomed to show time range between {start} and {end}']
+        'details': details
     }
+    
+    # 通过排序时间索引统计窗口内的行数（O(log n)）
+    data = new_spec.get('data', {}).get('values') if isinstance(new_spec.get('data'), dict) else None
+    if isinstance(data, list) and data:
+        from .data_cache import parse_time, time_window
+        lb, ub = parse_time(start), parse_time(end)
+        if lb is not None and ub is not None:
+            visible = len(time_window(data, time_field, min(lb, ub), max(lb, ub)))
+            result['visible_count'] = visible
+            details.append(f'{visible} of {len(data)} rows fall inside the window')
+    return result
 
 
 def highlight_trend(vega_spec: Dict, trend_type: str = "increasing") -> Dict[str, Any]:
@@ -161,11 +175,118 @@ def highlight_trend(vega_spec: Dict, trend_type: str = "increasing") -> Dict[str
 
 
 
-def detect_anomalies(vega_spec: Dict, threshold: float = 2.0) -> Dict[str, Any]:
-    """检测异常点 - 检测并在视图中高亮标记异常数据点"""
-    import numpy as np
+# 异常检测：各方法的默认阈值与滚动窗口
+ANOMALY_DEFAULT_THRESHOLDS = {'zscore': 2.0, 'rolling': 2.0, 'mad': 3.5}
+ANOMALY_DEFAULT_WINDOW = 7
+_ANOMALY_TAG = 'detect_anomalies'
+# 异常行的标记列（紧凑列，异常行为 true，其余为 null）
+_ANOMALY_FLAG_FIELD = '_avs_anomaly'
+
+
+def _line_series_field(encoding: Dict) -> Optional[str]:
+    """折线的分组字段（color 优先，其次 detail）"""
+    return encoding.get('color', {}).get('field') or encoding.get('detail', {}).get('field')
+
+
+def _group_median(codes: np.ndarray, vals: np.ndarray, n_groups: int) -> np.ndarray:
+    """按组求中位数（向量化）"""
+    order = np.lexsort((vals, codes))
+    sorted_vals = vals[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    safe = np.maximum(counts, 1)
+    lo = starts + (safe - 1) // 2
+    hi = starts + safe // 2
+    lo = np.minimum(lo, max(len(vals) - 1, 0))
+    hi = np.minimum(hi, max(len(vals) - 1, 0))
+    medians = (sorted_vals[lo] + sorted_vals[hi]) / 2 if len(vals) else np.zeros(n_groups)
+    return np.where(counts > 0, medians, np.nan)
+
+
+def _anomaly_scores(values: List[Dict], key: str, x_field: Optional[str], y_field: str,
+                    series_field: Optional[str], method: str, window: int) -> Dict[str, Any]:
+    """
+    计算每行的异常分数（|标准化偏差|），按 (数据键, 字段, 方法, 窗口) 缓存；
+    阈值只在分数上比较，调整阈值无需重新扫描数据。
+    
+    - zscore:  各序列内 |y - mean| / std
+    - rolling: 各序列按时间排序后，相对前 window 个点的 |y - mean| / std
+    - mad:     各序列内 0.6745 * |y - median| / MAD
+    """
+    from .data_cache import numeric_column, time_column, category_codes, get_or_compute
+    
+    def build():
+        ys = numeric_column(values, y_field, key)
+        codes, labels = category_codes(values, series_field, key)
+        valid = np.flatnonzero(np.isfinite(ys))
+        scores = np.full(len(values), np.nan)
+        n_groups = len(labels)
+        g = codes[valid]
+        y = ys[valid]
+        
+        if method == 'zscore':
+            counts = np.bincount(g, minlength=n_groups)
+            safe = np.maximum(counts, 1)
+            mean = np.bincount(g, weights=y, minlength=n_groups) / safe
+            var = np.bincount(g, weights=y * y, minlength=n_groups) / safe - mean ** 2
+            std = np.sqrt(np.maximum(var, 0))
+            denom = std[g]
+            scores[valid] = np.where(denom > 0, np.abs(y - mean[g]) / np.where(denom > 0, denom, 1), 0.0)
+        elif method == 'mad':
+            median = _group_median(g, y, n_groups)
+            mad = _group_median(g, np.abs(y - median[g]), n_groups)
+            denom = mad[g]
+            scores[valid] = np.where(denom > 0, 0.6745 * np.abs(y - median[g]) / np.where(denom > 0, denom, 1), 0.0)
+        else:  # rolling
+            ts = time_column(values, x_field, key)[valid] if x_field else np.arange(len(valid), dtype=np.float64)
+            order = np.lexsort((ts, g))
+            gs = g[order]
+            yv = y[order]
+            n = len(yv)
+            idx = np.arange(n)
+            group_start = np.searchsorted(gs, gs, side='left')
+            start = np.maximum(idx - window, group_start)
+            cs = np.concatenate(([0.0], np.cumsum(yv)))
+            cs2 = np.concatenate(([0.0], np.cumsum(yv * yv)))
+            # 前 window 个点（不含当前点）的均值/标准差
+            cnt = idx - start
+            safe = np.maximum(cnt, 1)
+            mean = (cs[idx] - cs[start]) / safe
+            var = (cs2[idx] - cs2[start]) / safe - mean ** 2
+            std = np.sqrt(np.maximum(var, 0))
+            rolling = np.where((cnt >= max(2, window // 2)) & (std > 0), np.abs(yv - mean) / np.where(std > 0, std, 1), np.nan)
+            scores[valid[order]] = rolling
+        
+        scores.setflags(write=False)
+        return {'scores': scores, 'codes': codes, 'labels': labels, 'n_valid': int(len(valid))}
+    
+    return get_or_compute('line_anomalies', (key, x_field, y_field, series_field, method, window), build)
+
+
+def detect_anomalies(vega_spec: Dict, threshold: Optional[float] = None, method: str = "zscore",
+                     window: int = ANOMALY_DEFAULT_WINDOW, line_field: Optional[str] = None) -> Dict[str, Any]:
+    """
+    检测异常点 - 检测并在视图中高亮标记异常数据点
     
-    data = vega_spec.get('data', {}).get('values', [])
+    按折线的 color/detail 字段分序列检测；异常分数按 (数据, 方法, 窗口) 缓存，
+    调整 threshold 的后续调用无需重新计算。
+    
+    Args:
+        vega_spec: Vega-Lite规范
+        threshold: 阈值（默认 zscore/rolling 为 2.0，mad 为 3.5）
+        method: zscore（序列内全局）| rolling（滚动窗口）| mad（中位数绝对偏差，稳健）
+        window: rolling 方法的窗口大小（点数）
+        line_field: 分组字段（可选，默认取 color/detail 编码字段）
+    """
+    from .data_cache import data_key
+    
+    if method not in ANOMALY_DEFAULT_THRESHOLDS:
+        return {'success': False, 'error': f'Unsupported method: {method}'}
+    if threshold is None:
+        threshold = ANOMALY_DEFAULT_THRESHOLDS[method]
+    window = max(2, int(window or ANOMALY_DEFAULT_WINDOW))
+    
+    data = vega_spec.get('data', {}).get('values', []) if isinstance(vega_spec.get('data'), dict) else []
     
     # 获取字段（支持 layer 结构）
     if 'layer' in vega_spec and len(vega_spec['layer']) > 0:
@@ -175,36 +296,46 @@ def detect_anomalies(vega_spec: Dict, threshold: float = 2.0) -> Dict[str, Any]:
     
     y_field = encoding.get('y', {}).get('field')
     x_field = encoding.get('x', {}).get('field')
+    series_field = line_field or _line_series_field(encoding)
     
     if not data or not y_field:
         return {'success': False, 'error': 'Missing data or y field'}
     
-    values = [row.get(y_field) for row in data if row.get(y_field) is not None]
+    key = data_key(data)
+    engine = _anomaly_scores(data, key, x_field, y_field, series_field, method, window)
     
-    if len(values) < 3:
+    if engine['n_valid'] < 3:
         return {'success': False, 'error': 'Not enough data for anomaly detection'}
     
-    # 计算统计特征
-    mean = np.mean(values)
-    std = np.std(values)
+    scores = engine['scores']
+    with np.errstate(invalid='ignore'):
+        anomaly_rows = np.flatnonzero(scores > threshold)
+    # 按异常程度降序
+    anomaly_rows = anomaly_rows[np.argsort(-scores[anomaly_rows], kind='stable')]
     
-    # 识别异常点
-    anomaly_data = []
-    for row in data:
-        val = row.get(y_field)
-        if val is not None and abs(val - mean) > threshold * std:
-            anomaly_data.append(row)
+    per_series: Dict[str, int] = {}
+    if series_field:
+        codes = engine['codes']
+        labels = engine['labels']
+        for code, count in zip(*np.unique(codes[anomaly_rows], return_counts=True)):
+            per_series[str(labels[code])] = int(count)
     
     new_spec = copy.deepcopy(vega_spec)
     
+    # 移除之前的异常标记图层与标记列
+    from .row_columns import set_row_column, drop_row_columns
+    if 'layer' in new_spec:
+        new_spec['layer'] = [l for l in new_spec['layer'] if l.get('_avs_tag') != _ANOMALY_TAG]
+    drop_row_columns(new_spec, [_ANOMALY_FLAG_FIELD])
+    
     # 如果检测到异常点，在视图中标记
-    if anomaly_data:
+    if len(anomaly_rows):
         # 转换为 layer 结构
         if 'layer' not in new_spec:
             original_layer = copy.deepcopy(new_spec)
-            for key in ['mark', 'encoding']:
-                if key in original_layer:
-                    del original_layer[key]
+            for k in ['mark', 'encoding']:
+                if k in original_layer:
+                    del original_layer[k]
             
             new_spec = original_layer
             new_spec['layer'] = [{
@@ -212,9 +343,12 @@ def detect_anomalies(vega_spec: Dict, threshold: float = 2.0) -> Dict[str, Any]:
                 'encoding': vega_spec.get('encoding', {})
             }]
         
-        # 添加异常点标记图层
+        # 异常点标记图层：按逐行标记列筛选原始数据行（不复制数据；标记列随行切片，见 row_columns）
+        flags = np.full(len(data), -1, dtype=np.int64)
+        flags[anomaly_rows] = 0
+        set_row_column(new_spec, _ANOMALY_FLAG_FIELD, flags, [True])
         new_spec['layer'].append({
-            'data': {'values': anomaly_data},
+            'transform': [{'filter': f'datum.{_ANOMALY_FLAG_FIELD} === true'}],
             'mark': {
                 'type': 'point',
                 'color': 'red',
@@ -227,22 +361,38 @@ def detect_anomalies(vega_spec: Dict, threshold: float = 2.0) -> Dict[str, Any]:
                 'tooltip': [
                     {'field': x_field, 'type': encoding['x'].get('type', 'temporal'), 'title': 'Time'} if x_field else {},
                     {'field': y_field, 'type': 'quantitative', 'title': 'Value (Anomaly)'}
-                ]
-            }
+                ] + ([{'field': series_field, 'type': 'nominal', 'title': 'Series'}] if series_field else [])
+            },
+            '_avs_tag': _ANOMALY_TAG
         })
     
+    anomalies = []
+    for row_idx in anomaly_rows[:10].tolist():
+        item = dict(data[row_idx])
+        item['anomaly_score'] = round(float(scores[row_idx]), 3)
+        anomalies.append(item)
+    
+    method_desc = {
+        'zscore': f'beyond {threshold} standard deviations from the series mean',
+        'rolling': f'beyond {threshold} standard deviations from the previous {window} points',
+        'mad': f'with robust z-score (MAD) above {threshold}'
+    }[method]
+    details = [f'Anomalies are values {method_desc}']
+    if series_field:
+        details.append(f'Detected per series ({series_field}): {per_series}')
+    details.append('Anomalies marked with red points on the chart')
+    
     return {
         'success': True,
         'operation': 'detect_anomalies',
         'vega_spec': new_spec,
-        'anomaly_count': len(anomaly_data),
-        'anomalies': anomaly_data[:10],
-        'message': f'Detected and highlighted {len(anomaly_data)} anomalies (threshold={threshold} std)',
-        'details': [
-            f'Mean: {mean:.2f}, Std: {std:.2f}',
-            f'Anomalies are values beyond {threshold} standard deviations from mean',
-            f'Anomalies marked with red points on the chart'
-        ]
+        'method': method,
+        'threshold': threshold,
+        'anomaly_count': int(len(anomaly_rows)),
+        'anomalies': anomalies,
+        'anomalies_by_series': per_series,
+        'message': f'Detected and highlighted {len(anomaly_rows)} anomalies ({method}, threshold={threshold})',
+        'details': details
     }
 
 
@@ -359,21 +509,123 @@ def filter_lines(vega_spec: Dict, lines_to_remove: List[str], line_field: str =
     }
 
 
-def show_moving_average(vega_spec: Dict, window_size: int = 3) -> Dict[str, Any]:
+# 移动平均：支持的统计方法与结果中返回的平滑点数上限（每条序列）
+MOVING_AVERAGE_METHODS = ('mean', 'median', 'ewma')
+MOVING_AVERAGE_PREVIEW_POINTS = 50
+_MOVING_AVERAGE_TAG = 'show_moving_average'
+
+
+def _x_order_column(values: List[Dict], x_field: str, x_type: Optional[str], key: str) -> np.ndarray:
+    """x 字段的排序键：时间/数值按数值排序，其余按字符串排序（与 Vega window sort 一致）"""
+    from .data_cache import time_column, numeric_column
+    
+    if x_type == 'quantitative':
+        return numeric_column(values, x_field, key)
+    if x_type in (None, 'temporal'):
+        ts = time_column(values, x_field, key)
+        if np.any(np.isfinite(ts)):
+            return ts
+    raw = np.array(['' if not isinstance(row, dict) or row.get(x_field) is None else str(row.get(x_field))
+                    for row in values], dtype=object)
+    _, ranks = np.unique(raw, return_inverse=True)
+    return ranks.astype(np.float64)
+
+
+def _rolling_series(values: List[Dict], key: str, x_field: str, x_type: Optional[str], y_field: str,
+                    series_field: Optional[str], method: str, window: int) -> Dict[str, Any]:
+    """
+    各序列按 x 排序后的滚动统计，按 (数据键, 字段, 分组字段, 方法, 窗口) 缓存
+    
+    - mean:   前 window 个点（含当前点）的均值，前缀和 O(n)
+    - median: 前 window 个点（含当前点）的中位数，分块的滑动窗口矩阵
+    - ewma:   指数加权均值，alpha = 2 / (window + 1)，每条序列一次线性滤波
+    
+    序列开头不足 window 个点时使用已有的点（与 Vega window frame [-(w-1), 0] 一致）。
+    """
+    from .data_cache import numeric_column, category_codes, get_or_compute
+    
+    def build():
+        xs = _x_order_column(values, x_field, x_type, key)
+        ys = numeric_column(values, y_field, key)
+        codes, labels = category_codes(values, series_field, key)
+        valid = np.flatnonzero(np.isfinite(xs) & np.isfinite(ys))
+        order = valid[np.lexsort((xs[valid], codes[valid]))]
+        g = codes[order]
+        y = ys[order]
+        n = len(y)
+        idx = np.arange(n)
+        group_start = np.searchsorted(g, g, side='left')
+        
+        if method == 'mean':
+            start = np.maximum(idx - (window - 1), group_start)
+            cs = np.concatenate(([0.0], np.cumsum(y)))
+            smoothed = (cs[idx + 1] - cs[start]) / (idx + 1 - start)
+        elif method == 'median':
+            smoothed = np.empty(n)
+            offsets = np.arange(-(window - 1), 1)
+            chunk = max(1, 4_000_000 // window)
+            for lo in range(0, n, chunk):
+                rows = idx[lo:lo + chunk]
+                cols = rows[:, None] + offsets[None, :]
+                inside = cols >= group_start[rows][:, None]
+                block = np.where(inside, y[np.maximum(cols, 0)], np.nan)
+                smoothed[lo:lo + chunk] = np.nanmedian(block, axis=1)
+        else:  # ewma
+            from scipy.signal import lfilter
+            alpha = 2.0 / (window + 1)
+            smoothed = np.empty(n)
+            bounds = np.flatnonzero(np.concatenate(([True], g[1:] != g[:-1]))) if n else np.array([], dtype=np.int64)
+            for lo, hi in zip(bounds, np.concatenate((bounds[1:], [n])).astype(np.int64)):
+                segment = y[lo:hi]
+                smoothed[lo:hi], _ = lfilter([alpha], [1.0, alpha - 1.0], segment, zi=[(1.0 - alpha) * segment[0]])
+        
+        order.setflags(write=False)
+        smoothed.setflags(write=False)
+        return {'rows': order, 'codes': g, 'smoothed': smoothed, 'labels': labels}
+    
+    return get_or_compute('moving_average', (key, x_field, y_field, series_field, method, window), build)
+
+
+def _precomputable_line_view(vega_spec: Dict, encoding: Dict) -> bool:
+    """数据行与折线点一一对应（内联数据、无改变行集合的 transform、无 encoding 聚合）"""
+    data = vega_spec.get('data')
+    if not isinstance(data, dict) or not isinstance(data.get('values'), list):
+        return False
+    if vega_spec.get('transform'):
+        return False
+    for channel in ('x', 'y'):
+        enc = encoding.get(channel) or {}
+        if enc.get('aggregate') or enc.get('timeUnit') or enc.get('bin'):
+            return False
+    return True
+
+
+def show_moving_average(vega_spec: Dict, window_size: int = 3, method: str = "mean",
+                        line_field: Optional[str] = None) -> Dict[str, Any]:
     """
     叠加移动平均线
     
+    滚动统计在服务端按序列计算（结果按数据与窗口缓存），作为只含 x / 分组 / 平滑值三列的
+    预计算图层加入视图，渲染器不再逐次计算 window transform；平滑后的序列同时返回。
+    视图数据无法与折线点一一对应时（如经过聚合或过滤），退回 Vega window transform（仅 mean）。
+    
     Args:
         vega_spec: Vega-Lite规范
         window_size: 移动平均窗口大小
+        method: mean（简单移动平均）| median（滚动中位数）| ewma（指数加权，alpha = 2/(window+1)）
+        line_field: 分组字段（可选，默认取 color/detail 编码字段）
     """
-    new_spec = copy.deepcopy(vega_spec)
+    from .data_cache import data_key
+    
+    if method not in MOVING_AVERAGE_METHODS:
+        return {'success': False, 'error': f'Unsupported method: {method}'}
+    window_size = max(1, int(window_size or 1))
     
     # 获取字段
-    if 'layer' in new_spec and len(new_spec['layer']) > 0:
-        encoding = new_spec['layer'][0].get('encoding', {})
+    if 'layer' in vega_spec and len(vega_spec['layer']) > 0:
+        encoding = vega_spec['layer'][0].get('encoding', {})
     else:
-        encoding = new_spec.get('encoding', {})
+        encoding = vega_spec.get('encoding', {})
     
     y_field = encoding.get('y', {}).get('field')
     x_field = encoding.get('x', {}).get('field')
@@ -384,6 +636,15 @@ def show_moving_average(vega_spec: Dict, window_size: int = 3) -> Dict[str, Any]
             'error': 'Cannot find x or y field for moving average'
         }
     
+    precompute = _precomputable_line_view(vega_spec, encoding)
+    if not precompute and method != 'mean':
+        return {
+            'success': False,
+            'error': f'method={method} needs row-level inline data; this view is aggregated or filtered'
+        }
+    
+    new_spec = copy.deepcopy(vega_spec)
+    
     # 如果原规范没有 layer，转换为 layer 结构
     if 'layer' not in new_spec:
         original_layer = copy.deepcopy(new_spec)
@@ -397,33 +658,21 @@ def show_moving_average(vega_spec: Dict, window_size: int = 3) -> Dict[str, Any]
             'encoding': vega_spec.get('encoding', {})
         }]
     
+    # 移除之前的移动平均图层
+    new_spec['layer'] = [l for l in new_spec['layer'] if l.get('_avs_tag') != _MOVING_AVERAGE_TAG]
+    
     # 检测是否有分组字段（多条线的情况）
     color_field = encoding.get('color', {}).get('field')
     detail_field = encoding.get('detail', {}).get('field')
-    group_field = color_field or detail_field
+    group_field = line_field or color_field or detail_field
     
     # 移动平均字段名
     ma_field = f'{y_field}_ma'
     
-    # 构建 window transform 计算移动平均
-    window_transform = {
-        'window': [{
-            'op': 'mean',
-            'field': y_field,
-            'as': ma_field
-        }],
-        'frame': [-(window_size - 1), 0],
-        'sort': [{'field': x_field, 'order': 'ascending'}]  # 按 x 轴排序，确保时间顺序正确
-    }
-    
-    # 如果有分组字段（多条线），需要按组分别计算移动平均
-    if group_field:
-        window_transform['groupby'] = [group_field]
-    
     # 添加移动平均线图层
     ma_encoding = {
         'x': {'field': x_field, 'type': encoding['x'].get('type', 'temporal')},
-        'y': {'field': ma_field, 'type': 'quantitative'}
+        'y': {'field': ma_field, 'type': 'quantitative', 'title': f'{y_field} ({window_size}-point {method})'}
     }
     
     # 保持与原折线一致的分组/颜色编码，避免不同 lines 被连成一条线
@@ -431,24 +680,81 @@ def show_moving_average(vega_spec: Dict, window_size: int = 3) -> Dict[str, Any]
         ma_encoding['color'] = copy.deepcopy(encoding.get('color'))
     elif detail_field and isinstance(encoding.get('detail'), dict):
         ma_encoding['detail'] = copy.deepcopy(encoding.get('detail'))
+    elif group_field:
+        ma_encoding['detail'] = {'field': group_field, 'type': 'nominal'}
     
-    new_spec['layer'].append({
+    ma_layer = {
         'mark': {
             'type': 'line',
             'color': 'orange',
             'strokeWidth': 3,
             'opacity': 0.8
         },
-        'transform': [window_transform],
-        'encoding': ma_encoding
-    })
-    
-    return {
+        'encoding': ma_encoding,
+        '_avs_tag': _MOVING_AVERAGE_TAG
+    }
+    result = {
         'success': True,
         'operation': 'show_moving_average',
         'vega_spec': new_spec,
-        'message': f'Added {window_size}-period moving average line'
+        'method': method,
+        'window_size': window_size,
+        'message': f'Added {window_size}-period moving average line ({method})'
     }
+    
+    if not precompute:
+        # 视图经过聚合/过滤：由渲染器按视图行计算
+        window_transform = {
+            'window': [{'op': 'mean', 'field': y_field, 'as': ma_field}],
+            'frame': [-(window_size - 1), 0],
+            'sort': [{'field': x_field, 'order': 'ascending'}]  # 按 x 轴排序，确保时间顺序正确
+        }
+        if group_field:
+            window_transform['groupby'] = [group_field]
+        ma_layer['transform'] = [window_transform]
+        new_spec['layer'].append(ma_layer)
+        return result
+    
+    data = vega_spec['data']['values']
+    engine = _rolling_series(data, data_key(data), x_field, encoding['x'].get('type'), y_field,
+                             group_field, method, window_size)
+    rows = engine['rows'].tolist()
+    smoothed = np.round(engine['smoothed'], 6).tolist()
+    codes = engine['codes'].tolist()
+    labels = engine['labels']
+    
+    # 预计算图层：每个点只保留 x / 分组 / 平滑值
+    if group_field:
+        ma_values = [{x_field: data[r].get(x_field), group_field: labels[c], ma_field: v}
+                     for r, c, v in zip(rows, codes, smoothed)]
+    else:
+        ma_values = [{x_field: data[r].get(x_field), ma_field: v} for r, v in zip(rows, smoothed)]
+    ma_layer['data'] = {'values': ma_values}
+    new_spec['layer'].append(ma_layer)
+    
+    # 返回平滑后的序列（每条序列最多返回最后 MOVING_AVERAGE_PREVIEW_POINTS 个点）
+    series_out: Dict[str, Any] = {}
+    bounds = np.flatnonzero(np.concatenate(([True], np.diff(engine['codes']) != 0))) if rows else []
+    ends = list(bounds[1:]) + [len(rows)] if rows else []
+    for lo, hi in zip(bounds, ends):
+        lo, hi = int(lo), int(hi)
+        tail_lo = max(lo, hi - MOVING_AVERAGE_PREVIEW_POINTS)
+        segment = engine['smoothed'][lo:hi]
+        series_out[str(labels[codes[lo]]) if group_field else y_field] = {
+            'count': hi - lo,
+            'first': smoothed[lo],
+            'last': smoothed[hi - 1],
+            'min': round(float(segment.min()), 6),
+            'max': round(float(segment.max()), 6),
+            'points': [[data[rows[i]].get(x_field), smoothed[i]] for i in range(tail_lo, hi)],
+            'truncated': tail_lo > lo
+        }
+    result['smoothed'] = series_out
+    result['details'] = [
+        f'{method} over {window_size} points computed server-side for {len(series_out)} series',
+        f'Smoothed values are in field {ma_field}; each series returns up to its last {MOVING_AVERAGE_PREVIEW_POINTS} points'
+    ]
+    return result
 
 
 def focus_lines(
@@ -528,6 +834,240 @@ def focus_lines(
     }
 
 
+# 系列聚焦：排名依据与 "Others" 带的标签
+SERIES_SCORES = ('variance', 'total', 'mean', 'latest', 'max')
+_SERIES_FOCUS_TAG = 'series_focus'
+_OTHERS_LABEL = 'Others'
+
+
+def _series_scores(values: List[Dict], key: str, x_field: str, x_type: Optional[str], y_field: str,
+                   series_field: str, score: str) -> Tuple[np.ndarray, List[Any]]:
+    """各序列的排名分数（按 (数据键, 字段, 依据) 缓存），返回 (分数, 序列值列表)"""
+    from .data_cache import numeric_column, category_codes, get_or_compute
+    
+    def build():
+        ys = numeric_column(values, y_field, key)
+        codes, labels = category_codes(values, series_field, key)
+        n_groups = len(labels)
+        valid = np.isfinite(ys)
+        g = codes[valid]
+        y = ys[valid]
+        counts = np.bincount(g, minlength=n_groups)
+        safe = np.maximum(counts, 1)
+        total = np.bincount(g, weights=y, minlength=n_groups)
+        if score == 'total':
+            scores = total
+        elif score == 'mean':
+            scores = total / safe
+        elif score == 'variance':
+            mean = total / safe
+            scores = np.bincount(g, weights=y * y, minlength=n_groups) / safe - mean ** 2
+        elif score == 'max':
+            scores = np.full(n_groups, -np.inf)
+            np.maximum.at(scores, g, y)
+        else:  # latest：每条序列 x 最大的点的值
+            xs = _x_order_column(values, x_field, x_type, key)[valid]
+            order = np.lexsort((xs, g))
+            last = np.flatnonzero(np.concatenate((g[order][1:] != g[order][:-1], [True]))) if len(order) else order
+            scores = np.full(n_groups, -np.inf)
+            scores[g[order][last]] = y[order][last]
+        scores = np.where(counts > 0, scores, -np.inf)
+        scores.setflags(write=False)
+        return scores, labels
+    
+    return get_or_compute('series_scores', (key, x_field, y_field, series_field, score), build)
+
+
+def _others_band(values: List[Dict], key: str, x_field: str, x_type: Optional[str], y_field: str,
+                 rows: np.ndarray) -> List[Dict[str, Any]]:
+    """折叠序列在每个 x 上的 min / mean / max（"Others" 带的预计算数据）"""
+    from .data_cache import numeric_column
+    
+    xs = _x_order_column(values, x_field, x_type, key)[rows]
+    ys = numeric_column(values, y_field, key)[rows]
+    valid = np.isfinite(xs) & np.isfinite(ys)
+    rows, xs, ys = rows[valid], xs[valid], ys[valid]
+    if not len(rows):
+        return []
+    order = np.lexsort((ys, xs))
+    xs, ys, rows = xs[order], ys[order], rows[order]
+    starts = np.flatnonzero(np.concatenate(([True], xs[1:] != xs[:-1])))
+    ends = np.concatenate((starts[1:], [len(xs)])) - 1
+    counts = ends - starts + 1
+    means = np.add.reduceat(ys, starts) / counts
+    return [
+        {x_field: values[int(r)].get(x_field), '_others_min': lo, '_others_mean': round(m, 6),
+         '_others_max': hi, '_others_count': int(c)}
+        for r, lo, m, hi, c in zip(rows[starts].tolist(), ys[starts].tolist(), means.tolist(),
+                                   ys[ends].tolist(), counts.tolist())
+    ]
+
+
+def focus_top_series(vega_spec: Dict, top_k: int = 10, score: str = "variance",
+                     line_field: Optional[str] = None) -> Dict[str, Any]:
+    """
+    系列精简：只保留排名前 top_k 的折线，其余序列折叠为灰色 "Others" 带（每个 x 上的 min–max 范围及均值线）
+    
+    视图数据只保留前 top_k 条序列的行，渲染与阅读负担随之下降；原视图以列式紧凑形式保存在
+    _original_view（见 row_columns.pack_view），可用 reset_view 还原。对已精简的视图再次调用时基于原视图重新排名。
+    
+    Args:
+        vega_spec: Vega-Lite规范
+        top_k: 保留的序列数
+        score: 排名依据 variance（波动）| total（总量）| mean（均值）| latest（最新值）| max（峰值）
+        line_field: 分组字段（可选，默认取 color/detail 编码字段）
+    """
+    from .data_cache import data_key, category_codes
+    from .row_columns import take_rows, pack_view, unpack_view
+    
+    if score not in SERIES_SCORES:
+        return {'success': False, 'error': f'Unsupported score: {score}'}
+    top_k = max(1, int(top_k))
+    
+    source = vega_spec
+    if vega_spec.get('_series_focus'):
+        if not vega_spec.get('_original_view'):
+            return {'success': False, 'error': 'Original (unfocused) view not found in _original_view; cannot re-rank series'}
+        source = unpack_view(vega_spec['_original_view'])
+    
+    if 'layer' in source and len(source['layer']) > 0:
+        encoding = source['layer'][0].get('encoding', {})
+    else:
+        encoding = source.get('encoding', {})
+    
+    y_field = encoding.get('y', {}).get('field')
+    x_field = encoding.get('x', {}).get('field')
+    series_field = line_field or _line_series_field(encoding)
+    data = source.get('data', {}).get('values') if isinstance(source.get('data'), dict) else None
+    
+    if not x_field or not y_field or not series_field:
+        return {'success': False, 'error': 'Cannot find x, y or line grouping field. Please specify line_field.'}
+    if not isinstance(data, list) or not data:
+        return {'success': False, 'error': 'Series focus needs inline data values'}
+    
+    x_type = encoding['x'].get('type')
+    key = data_key(data)
+    scores, labels = _series_scores(data, key, x_field, x_type, y_field, series_field, score)
+    
+    if len(labels) <= top_k:
+        return {
+            'success': True,
+            'operation': 'focus_top_series',
+            'vega_spec': copy.deepcopy(vega_spec),
+            'series_count': len(labels),
+            'message': f'{len(labels)} series <= top_k={top_k}, nothing to fold'
+        }
+    
+    ranking = np.argsort(-scores, kind='stable')
+    kept_codes = ranking[:top_k]
+    keep_mask = np.zeros(len(labels), dtype=bool)
+    keep_mask[kept_codes] = True
+    codes, _ = category_codes(data, series_field, key)
+    row_kept = keep_mask[codes]
+    
+    new_spec = copy.deepcopy({k: v for k, v in source.items() if k not in ('data', '_original_view')})
+    new_spec['data'] = dict(source['data'])
+    # 逐行标记列（如异常标记）随数据行一起切片
+    take_rows(new_spec, np.flatnonzero(row_kept).tolist())
+    new_spec['_original_view'] = pack_view(source)
+    
+    # 转换为 layer 结构
+    if 'layer' not in new_spec:
+        base = new_spec
+        new_spec = {k: v for k, v in base.items() if k not in ('mark', 'encoding')}
+        new_spec['layer'] = [{
+            'mark': source.get('mark', 'line'),
+            'encoding': copy.deepcopy(source.get('encoding', {}))
+        }]
+    
+    # Others 带：折叠序列在每个 x 上的范围与均值（预计算，不含原始行）
+    band_values = _others_band(data, key, x_field, x_type, y_field, np.flatnonzero(~row_kept))
+    folded = [labels[c] for c in ranking[top_k:].tolist()]
+    x_enc = {'field': x_field, 'type': x_type or 'temporal'}
+    y_title = encoding['y'].get('title', y_field)
+    others_name = f'{_OTHERS_LABEL} ({len(folded)} series)'
+    band_tooltip = [
+        {'field': x_field, 'type': x_type or 'temporal'},
+        {'field': '_others_mean', 'type': 'quantitative', 'title': f'{others_name} mean'},
+        {'field': '_others_min', 'type': 'quantitative', 'title': 'min'},
+        {'field': '_others_max', 'type': 'quantitative', 'title': 'max'}
+    ]
+    # 追加在原折线图层之后（layer[0] 仍为原折线，其他折线工具依赖它）
+    new_spec['layer'].append({
+        'data': {'values': band_values},
+        'mark': {'type': 'area', 'color': '#bbbbbb', 'opacity': 0.25},
+        'encoding': {
+            'x': x_enc,
+            'y': {'field': '_others_min', 'type': 'quantitative', 'title': y_title},
+            'y2': {'field': '_others_max'},
+            'tooltip': band_tooltip
+        },
+        '_avs_tag': _SERIES_FOCUS_TAG
+    })
+    new_spec['layer'].append({
+        'data': {'values': band_values},
+        'mark': {'type': 'line', 'color': '#888888', 'strokeDash': [4, 3], 'strokeWidth': 1.5},
+        'encoding': {
+            'x': x_enc,
+            'y': {'field': '_others_mean', 'type': 'quantitative', 'title': y_title},
+            'tooltip': band_tooltip
+        },
+        '_avs_tag': _SERIES_FOCUS_TAG
+    })
+    
+    kept = [labels[c] for c in kept_codes.tolist()]
+    new_spec['_series_focus'] = {
+        'line_field': series_field,
+        'score': score,
+        'top_k': top_k,
+        'kept': kept,
+        'folded_count': len(folded)
+    }
+    
+    ranked = [{'series': labels[c], 'score': round(float(scores[c]), 6)} for c in kept_codes.tolist()]
+    return {
+        'success': True,
+        'operation': 'focus_top_series',
+        'vega_spec': new_spec,
+        'series_count': len(labels),
+        'kept_series': ranked,
+        'folded_series': folded[:50],
+        'folded_count': len(folded),
+        'message': f'Kept top {top_k} of {len(labels)} series by {score}; folded {len(folded)} into "{_OTHERS_LABEL}" band',
+        'details': [
+            f'Grey band shows min-max of the {len(folded)} folded series at each x, dashed line their mean',
+            'Use reset_view to restore all series'
+        ]
+    }
+
+
+def _raw_line_dataset(vega_spec: Dict, raw_data: Optional[Dict]):
+    """下钻/重采样的原始数据集：优先 full_data_path 全量数据，其次保存的原始 data，再次当前 data"""
+    from .data_cache import get_dataset
+    source = raw_data if isinstance(raw_data, dict) else vega_spec.get('data')
+    if not isinstance(source, dict) or not isinstance(source.get('values'), list):
+        return None, None
+    values, key, _ = get_dataset(dict(vega_spec, data=source), use_full_data=True)
+    return values, key
+
+
+def _rollup_rows(vega_spec: Dict, raw_data: Optional[Dict], time_field: str, value_field: str,
+                 group_field: Optional[str], granularity: str, agg: str, time_as: str, value_as: str,
+                 start: Optional[str] = None, end: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+    """从时间汇总立方体取预聚合行；原始数据不适用（无时间/数值字段）时返回 None"""
+    from .time_cube import get_time_cube
+    values, key = _raw_line_dataset(vega_spec, raw_data)
+    if not values:
+        return None
+    sample = next((row for row in values if isinstance(row, dict)), {})
+    if time_field not in sample or value_field not in sample:
+        return None
+    cube = get_time_cube(values, key, time_field, value_field, group_field)
+    if cube is None:
+        return None
+    return cube.rows(granularity, agg, time_as, value_as, group_field, start=start, end=end)
+
+
 def drilldown_line_time(
     vega_spec: Dict,
     level: str,
@@ -760,6 +1300,27 @@ def drilldown_line_time(
     else:
         return {'success': False, 'error': f'无效的 level: {level}，应为 year/month/date'}
     
+    # 优先使用时间汇总立方体：直接换入预聚合行，渲染器无需再聚合原始数据
+    if level == 'year':
+        rollup = _rollup_rows(
+            new_spec, state.get('raw_data'), raw_date_field, raw_value_field, group_field,
+            'month', 'sum', 'month_date', 'total_value',
+            start=f'{value:04d}-01-01', end=f'{value + 1:04d}-01-01'
+        )
+    else:
+        year_int = int(year_val)
+        next_year, next_month = (year_int + 1, 1) if value == 12 else (year_int, value + 1)
+        rollup = _rollup_rows(
+            new_spec, state.get('raw_data'), raw_date_field, raw_value_field, group_field,
+            'day', 'sum', 'day_date', 'total_value',
+            start=f'{year_int:04d}-{value:02d}-01', end=f'{next_year:04d}-{next_month:02d}-01'
+        )
+    if rollup is not None:
+        if 'raw_data' not in state:
+            state['raw_data'] = new_spec.get('data')
+        new_spec['data'] = {'values': rollup}
+        new_transforms = []
+    
     # 应用新的 transform（替换原有的聚合 transform）
     new_spec['transform'] = new_transforms
     
@@ -812,6 +1373,10 @@ def reset_line_drilldown(vega_spec: Dict) -> Dict[str, Any]:
             'message': '未进行过下钻，无需重置'
         }
     
+    # 恢复原始数据（下钻时换入了预聚合行）
+    if isinstance(state.get('raw_data'), dict):
+        new_spec['data'] = state['raw_data']
+    
     # 恢复原始 transform
     original_transform = state.get('original_transform')
     if original_transform is not None:
@@ -927,6 +1492,37 @@ def resample_time(
         time_axis = 'y'
         value_axis = 'x'
     
+    # 单一视图且没有 transform 时，直接换入时间汇总立方体的预聚合行
+    value_field = encoding.get(value_axis, {}).get('field')
+    if 'layer' not in new_spec and not new_spec.get('transform') and value_field:
+        group_field = _line_series_field(encoding)
+        rollup = _rollup_rows(
+            new_spec, state.get('raw_data'), time_field, value_field, group_field,
+            granularity_lower, agg_lower, time_field, value_field
+        )
+        if rollup is not None:
+            if 'raw_data' not in state:
+                state['raw_data'] = new_spec.get('data')
+            new_spec['data'] = {'values': rollup}
+            restored = copy.deepcopy(state['original_encoding'])
+            for axis in (time_axis, value_axis):
+                if isinstance(restored.get(axis), dict):
+                    restored[axis].pop('timeUnit', None)
+                    restored[axis].pop('aggregate', None)
+            restored[time_axis]['type'] = 'temporal'
+            new_spec['encoding'] = restored
+            state['current_granularity'] = granularity_lower
+            state['current_agg'] = agg_lower
+            new_spec['_resample_state'] = state
+            return {
+                'success': True,
+                'operation': 'resample_time',
+                'vega_spec': new_spec,
+                'pre_aggregated': True,
+                'points': len(rollup),
+                'message': f'Resampled time to {granularity} with {agg} aggregation ({len(rollup)} pre-aggregated points)'
+            }
+    
     # 修改时间轴的 timeUnit
     def _update_encoding(enc: Dict) -> None:
         if time_axis in enc:
@@ -976,6 +1572,9 @@ def reset_resample(vega_spec: Dict) -> Dict[str, Any]:
             'message': 'No resample state to reset'
         }
     
+    if isinstance(state.get('raw_data'), dict):
+        new_spec['data'] = state['raw_data']
+    
     original_encoding = state.get('original_encoding')
     if original_encoding:
         if 'layer' in new_spec and len(new_spec['layer']) > 0:
@@ -1058,6 +1657,7 @@ __all__ = [
     'filter_lines',
     'show_moving_average',
     'focus_lines',
+    'focus_top_series',
     'drilldown_line_time',
     'reset_line_drilldown',
     'resample_time',
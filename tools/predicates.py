@@ -0,0 +1,148 @@
+"""
+Vega 表达式成员判断（"datum 是否属于给定集合"，用于高亮条件 / 过滤）
+
+按集合大小选择最省的形式：
+- inline：少量条目直接展开为 (a === x && b === y) || ...
+- indexof：中等数量时写成 indexof([键, ...], 键表达式) >= 0，一个数组字面量代替 N 个子句
+- lookup：大量条目时把集合放进 spec 的查找表（Vega-Lite 顶层 params / Vega signals 中的对象 {键: 1}），
+  条件只剩一次哈希查找 avs_<name>['\\u001f' + 键表达式] === 1，表达式长度与条目数无关
+
+复合键（以及查找表的键）按 JavaScript String() 的规则把各字段转为字符串并以 \\u001f 连接；
+查找表的键统一带 \\u001f 前缀，避免与对象原型属性（constructor 等）冲突。
+"""
+
+from typing import Any, List, Optional, Sequence, Tuple, Union
+import json
+import math
+import re
+
+
+PREDICATE_FORMS = ('inline', 'indexof', 'lookup')
+
+# 条目数 <= INLINE_MAX 用 inline，<= INDEXOF_MAX 用 indexof，否则用 lookup
+PREDICATE_INLINE_MAX = 4
+PREDICATE_INDEXOF_MAX = 64
+
+_KEY_SEP = '\x1f'
+_KEY_SEP_EXPR = "'\\u001f'"
+_LOOKUP_PREFIX = 'avs_'
+
+
+def js_string(value: Any) -> str:
+    """与 JavaScript String(value) 一致的字符串形式（用于拼接键）"""
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return 'Infinity' if value > 0 else '-Infinity'
+        if value.is_integer() and abs(value) < 1e21:
+            return str(int(value))
+        text = repr(value)
+        if 'e' in text:
+            mantissa, exp = text.split('e')
+            exp = int(exp)
+            text = f"{mantissa}e{'+' if exp > 0 else '-'}{abs(exp)}"
+        return text
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _literal(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _is_vega(vega_spec: dict) -> bool:
+    schema = str(vega_spec.get('$schema', ''))
+    return '/schema/vega/' in schema or 'marks' in vega_spec or 'signals' in vega_spec
+
+
+def lookup_name(name: str) -> str:
+    """查找表（param / signal）名称"""
+    return _LOOKUP_PREFIX + re.sub(r'\W', '_', str(name))
+
+
+def _set_lookup(vega_spec: dict, param_name: str, table: Optional[dict]):
+    """写入（table 为 None 时移除）同名查找表"""
+    container = 'signals' if _is_vega(vega_spec) else 'params'
+    entries = [p for p in vega_spec.get(container, []) or []
+               if not (isinstance(p, dict) and p.get('name') == param_name)]
+    if table is not None:
+        entries.append({'name': param_name, 'value': table})
+    if entries:
+        vega_spec[container] = entries
+    else:
+        vega_spec.pop(container, None)
+
+
+def membership_test(vega_spec: dict, name: str, key_exprs: Union[str, Sequence[str]],
+                    items: Sequence[Any], form: Optional[str] = None) -> Tuple[str, str]:
+    """
+    生成成员判断表达式
+
+    Args:
+        vega_spec: 表达式所在的 spec（lookup 形式写入查找表；其他形式移除同名旧表）
+        name: 谓词名称，查找表名为 avs_<name>（同一 spec 中的不同集合需使用不同名称）
+        key_exprs: 键表达式，单个（如 "datum['x']"）或多个（复合键）
+        items: 条目；单键时为值列表，复合键时为与 key_exprs 等长的元组列表
+        form: 指定形式（inline | indexof | lookup），默认按条目数选择
+
+    Returns:
+        (test 表达式, 使用的形式)
+    """
+    exprs: List[str] = [key_exprs] if isinstance(key_exprs, str) else list(key_exprs)
+    composite = len(exprs) > 1
+    rows: List[Tuple[Any, ...]] = []
+    seen = set()
+    for item in items:
+        row = tuple(item) if composite else (item,)
+        marker = tuple(_literal(v) for v in row)
+        if marker not in seen:
+            seen.add(marker)
+            rows.append(row)
+
+    if form is None:
+        if len(rows) <= PREDICATE_INLINE_MAX:
+            form = 'inline'
+        elif len(rows) <= PREDICATE_INDEXOF_MAX:
+            form = 'indexof'
+        else:
+            form = 'lookup'
+    param_name = lookup_name(name)
+    _set_lookup(vega_spec, param_name, None)
+    if not rows:
+        return 'false', form
+
+    if form == 'inline':
+        clauses = [' && '.join(f'{e} === {_literal(v)}' for e, v in zip(exprs, row)) for row in rows]
+        if composite and len(clauses) > 1:
+            clauses = [f'({c})' for c in clauses]
+        return ' || '.join(clauses), form
+
+    if form == 'indexof' and not composite:
+        return f'indexof({_literal([row[0] for row in rows])}, {exprs[0]}) >= 0', form
+
+    # 字符串键：indexof 的复合键 / lookup 的全部键
+    key_expr = f' + {_KEY_SEP_EXPR} + '.join(exprs)
+    keys = [_KEY_SEP.join(js_string(v) for v in row) for row in rows]
+    if form == 'indexof':
+        return f'indexof({_literal(keys)}, {key_expr}) >= 0', form
+
+    _set_lookup(vega_spec, param_name, {_KEY_SEP + k: 1 for k in keys})
+    return f'{param_name}[{_KEY_SEP_EXPR} + {key_expr}] === 1', 'lookup'
+
+
+__all__ = [
+    'PREDICATE_FORMS',
+    'PREDICATE_INLINE_MAX',
+    'PREDICATE_INDEXOF_MAX',
+    'js_string',
+    'lookup_name',
+    'membership_test',
+]
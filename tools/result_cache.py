@@ -0,0 +1,234 @@
+"""
+工具结果缓存（纯分析类工具的记忆化）
+
+在注册表中标记 'cacheable': True 的工具，其结果按 (工具名, 归一化参数, spec 哈希)
+缓存在内存（LRU）中，重复调用时直接返回缓存结果。
+磁盘（pickle 文件）二级缓存需显式开启（TOOL_CACHE_DISK_ENABLED），按总字节数上限淘汰最久未用的文件。
+"""
+
+from typing import Dict, Any, Optional
+from collections import OrderedDict
+from pathlib import Path
+import copy
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+from config.settings import Settings
+
+
+def _canonical_json(obj: Any) -> str:
+    return json.dumps(obj, sort_keys=True, default=str, ensure_ascii=False)
+
+
+def hash_spec(vega_spec: Any) -> str:
+    """spec 内容哈希（数据 + encoding/transform 等，任何变化都会产生新的哈希；见 data_cache.content_digest）"""
+    from .data_cache import content_digest
+    return content_digest(vega_spec)
+
+
+def _full_data_stamp(vega_spec: Any) -> Optional[str]:
+    """
+    全量数据的版本标记：full_data_path 文件的 (路径, mtime, 大小)，文件改动后缓存键随之变化；
+    没有文件时为会话登记的 full_data_key 及其当前能否取得（被淘汰后结果改用视图数据，不能复用）
+    """
+    from .data_cache import _resolve_full_data_path, _registered_values
+
+    path = _resolve_full_data_path(vega_spec)
+    if path is None:
+        meta = vega_spec.get('_metadata') if isinstance(vega_spec, dict) else None
+        key = meta.get('full_data_key') if isinstance(meta, dict) else None
+        return f'{key}:{_registered_values(vega_spec) is not None}' if key else None
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return f'{path}:{stat.st_mtime_ns}:{stat.st_size}'
+
+
+def make_cache_key(tool_name: str, params: Dict[str, Any]) -> str:
+    """
+    缓存键：工具名 + 归一化参数（不含 vega_spec / context）+ spec 哈希
+
+    use_full_data 为真时结果取决于全量数据而不只是 spec，键中再加入全量数据的版本标记
+    """
+    other_params = {k: v for k, v in params.items() if k not in ('vega_spec', 'context')}
+    spec_hash = hash_spec(params.get('vega_spec'))
+    raw = f"{tool_name}|{_canonical_json(other_params)}|{spec_hash}"
+    if params.get('use_full_data'):
+        raw += f"|{_full_data_stamp(params.get('vega_spec'))}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ToolResultCache:
+    """内存 LRU + （可选）磁盘两级结果缓存"""
+
+    def __init__(self, max_entries: Optional[int] = None, cache_dir: Optional[Path] = None,
+                 disk_max_bytes: Optional[int] = None, use_disk: Optional[bool] = None):
+        self.max_entries = max_entries or Settings.TOOL_CACHE_MAX_ENTRIES
+        self.disk_max_bytes = disk_max_bytes or Settings.TOOL_CACHE_DISK_MAX_BYTES
+        self.use_disk = Settings.TOOL_CACHE_DISK_ENABLED if use_disk is None else use_disk
+        self.cache_dir = Path(cache_dir or Settings.TOOL_CACHE_DIR)
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 磁盘文件索引（键 -> 字节数，按最近使用排序）：首次访问磁盘时扫描一次目录，之后增量维护
+        self._disk_index: "Optional[OrderedDict[str, int]]" = None
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock()
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """查找缓存，命中时返回结果的深拷贝"""
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self._stats['hits'] += 1
+                return copy.deepcopy(result)
+
+        result = self._read_disk(key)
+        with self._lock:
+            if result is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            self._stats['disk_hits'] += 1
+            self._put_memory(key, result)
+        return copy.deepcopy(result)
+
+    def set(self, key: str, result: Dict[str, Any]):
+        """写入缓存（内存 + 磁盘）"""
+        stored = copy.deepcopy(result)
+        with self._lock:
+            self._put_memory(key, stored)
+            self._stats['stores'] += 1
+        self._write_disk(key, stored)
+
+    def clear(self, disk: bool = False):
+        """清空内存缓存（可选同时清空磁盘缓存）"""
+        with self._lock:
+            self._memory.clear()
+        if disk and self.cache_dir.exists():
+            with self._disk_lock:
+                for path in self.cache_dir.glob('*.pkl'):
+                    try:
+                        path.unlink()
+                    except OSError:
+                        pass
+                self._disk_index = None
+                self._disk_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """命中/未命中统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        with self._disk_lock:
+            stats['disk_entries'] = len(self._disk_index) if self._disk_index is not None else 0
+            stats['disk_bytes'] = self._disk_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _put_memory(self, key: str, result: Dict[str, Any]):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.use_disk:
+            return None
+        with self._disk_lock:
+            index = self._load_disk_index()
+            if key not in index:
+                return None
+            index.move_to_end(key)
+        path = self.cache_dir / f"{key}.pkl"
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            self._forget_disk(key)
+            return None
+        except Exception as e:  # noqa: BLE001
+            from core.utils import app_logger
+            app_logger.warning(f"Tool cache read failed ({path.name}): {e}")
+            return None
+
+    def _write_disk(self, key: str, result: Dict[str, Any]):
+        if not self.use_disk:
+            return
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            path = self.cache_dir / f"{key}.pkl"
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            if len(payload) > self.disk_max_bytes:
+                return
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except Exception as e:  # noqa: BLE001
+            from core.utils import app_logger
+            app_logger.warning(f"Tool cache write failed: {e}")
+            return
+        with self._disk_lock:
+            index = self._load_disk_index()
+            self._disk_bytes += len(payload) - index.pop(key, 0)
+            index[key] = len(payload)
+            self._prune_disk(index)
+
+    def _load_disk_index(self) -> "OrderedDict[str, int]":
+        """磁盘文件索引（调用方持有 _disk_lock）；首次调用时按 mtime 扫描目录"""
+        if self._disk_index is None:
+            entries = []
+            if self.cache_dir.exists():
+                for path in self.cache_dir.glob('*.pkl'):
+                    try:
+                        stat = path.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, path.stem, stat.st_size))
+            entries.sort()
+            self._disk_index = OrderedDict((key, size) for _, key, size in entries)
+            self._disk_bytes = sum(self._disk_index.values())
+            self._prune_disk(self._disk_index)
+        return self._disk_index
+
+    def _forget_disk(self, key: str):
+        with self._disk_lock:
+            if self._disk_index is not None:
+                self._disk_bytes -= self._disk_index.pop(key, 0)
+
+    def _prune_disk(self, index: "OrderedDict[str, int]"):
+        """磁盘缓存超过字节上限时删除最久未用的文件（调用方持有 _disk_lock）"""
+        while self._disk_bytes > self.disk_max_bytes and index:
+            key, size = index.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                (self.cache_dir / f"{key}.pkl").unlink()
+            except OSError:
+                pass
+
+
+_tool_result_cache = None
+
+
+def get_tool_result_cache() -> ToolResultCache:
+    """获取工具结果缓存单例"""
+    global _tool_result_cache
+    if _tool_result_cache is None:
+        _tool_result_cache = ToolResultCache()
+    return _tool_result_cache
+
+
+__all__ = [
+    'ToolResultCache',
+    'get_tool_result_cache',
+    'make_cache_key',
+    'hash_spec',
+]
@@ -0,0 +1,236 @@
+"""
+行对齐的紧凑列（工具派生的逐行字段，如 identify_clusters 的簇号）
+
+派生字段不写进数据行，而是以紧凑编码存放在 spec['_avs_columns']：
+    {字段: {'codes': 每行一个字符（'.' 为 null）, 'labels': [各编码对应的值], 'rows': 数据行摘要}}
+只在渲染（VegaService.render）和 get_data 时才合并到数据行上。
+
+'rows' 是挂载时数据行的内容摘要：改写 data.values 的工具通过 take_rows 同步切片各列；
+数据行被其他方式替换（摘要不符）时该列失效，不会错位地合并到别的行上。
+
+pack_rows / pack_view 把数据行按列紧凑存放（重复值较多的列按字典编码），供需要在 spec 中
+自带原视图的工具（如 focus_top_series，可由 reset_view 还原）使用，不依赖进程内缓存。
+"""
+
+from typing import Any, Dict, List, Optional, Sequence
+import copy
+import json
+import numpy as np
+
+
+ROW_COLUMNS_KEY = '_avs_columns'
+
+# 编码字符表（每行一个字符，最多 62 种取值）
+_CODE_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_NULL_CODE = '.'
+MAX_ROW_COLUMN_LABELS = len(_CODE_ALPHABET)
+
+
+def _rows(spec: Dict) -> Optional[List[Dict[str, Any]]]:
+    data = spec.get('data') if isinstance(spec, dict) else None
+    values = data.get('values') if isinstance(data, dict) else None
+    return values if isinstance(values, list) else None
+
+
+def _rows_digest(values: List[Dict[str, Any]]) -> str:
+    from .data_cache import content_digest
+    return f'{len(values)}:{content_digest(values)}'
+
+
+def set_row_column(spec: Dict, field: str, codes: np.ndarray, labels: Sequence[Any]) -> None:
+    """
+    挂载一列（就地修改 spec）
+
+    Args:
+        spec: 数据在 data.values 中的 spec
+        field: 合并到数据行时的字段名
+        codes: 每行的编码（labels 的下标，负数为 null），长度须等于数据行数
+        labels: 编码对应的值（最多 MAX_ROW_COLUMN_LABELS 个）
+    """
+    values = _rows(spec)
+    if values is None or len(codes) != len(values):
+        raise ValueError('row column length does not match data.values')
+    if len(labels) > MAX_ROW_COLUMN_LABELS:
+        raise ValueError(f'row column supports at most {MAX_ROW_COLUMN_LABELS} labels')
+    alphabet = np.frombuffer((_CODE_ALPHABET[:len(labels)] + _NULL_CODE).encode('ascii'), dtype='S1')
+    codes = np.asarray(codes, dtype=np.int64)
+    text = alphabet[np.where(codes < 0, len(labels), codes)].tobytes().decode('ascii')
+    spec.setdefault(ROW_COLUMNS_KEY, {})[field] = {
+        'codes': text,
+        'labels': list(labels),
+        'rows': _rows_digest(values)
+    }
+
+
+def drop_row_columns(spec: Dict, fields: Optional[Sequence[str]] = None) -> None:
+    """移除指定列（默认全部）"""
+    columns = spec.get(ROW_COLUMNS_KEY) if isinstance(spec, dict) else None
+    if not columns:
+        return
+    for field in list(columns) if fields is None else fields:
+        columns.pop(field, None)
+    if not columns:
+        spec.pop(ROW_COLUMNS_KEY, None)
+
+
+def row_columns(spec: Dict) -> Dict[str, List[Any]]:
+    """与当前数据行一致的各列（解码为逐行值）；摘要不符的列被忽略"""
+    columns = spec.get(ROW_COLUMNS_KEY) if isinstance(spec, dict) else None
+    values = _rows(spec)
+    if not columns or values is None:
+        return {}
+    digest = None
+    result = {}
+    for field, column in columns.items():
+        codes = column.get('codes', '')
+        if len(codes) != len(values):
+            continue
+        digest = digest or _rows_digest(values)
+        if column.get('rows') != digest:
+            continue
+        lookup = {ch: label for ch, label in zip(_CODE_ALPHABET, column.get('labels') or [])}
+        result[field] = [lookup.get(ch) for ch in codes]
+    return result
+
+
+def join_row_columns(spec: Dict) -> Dict:
+    """
+    返回数据行已合并各列的 spec 浅拷贝（供渲染；不含 _avs_columns）；没有挂载列时原样返回
+    """
+    if not isinstance(spec, dict) or ROW_COLUMNS_KEY not in spec:
+        return spec
+    columns = row_columns(spec)
+    joined = {k: v for k, v in spec.items() if k != ROW_COLUMNS_KEY}
+    if columns:
+        joined['data'] = dict(spec['data'], values=join_rows(spec['data']['values'], columns))
+    return joined
+
+
+def join_rows(values: List[Dict[str, Any]], columns: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """把 row_columns 的结果合并到数据行（返回行副本）"""
+    if not columns:
+        return values
+    joined = [dict(row) if isinstance(row, dict) else row for row in values]
+    for field, column in columns.items():
+        for row, value in zip(joined, column):
+            if isinstance(row, dict):
+                row[field] = value
+    return joined
+
+
+def take_rows(spec: Dict, indices: Sequence[int]) -> None:
+    """
+    只保留指定下标的数据行（就地修改 spec），挂载的各列同步切片；已失效的列被移除
+    """
+    values = _rows(spec)
+    if values is None:
+        return
+    columns = spec.get(ROW_COLUMNS_KEY) or {}
+    valid = row_columns(spec) if columns else {}
+    new_values = [values[i] for i in indices]
+    spec['data']['values'] = new_values
+    if not columns:
+        return
+    digest = _rows_digest(new_values)
+    for field in list(columns):
+        if field not in valid:
+            columns.pop(field)
+            continue
+        codes = columns[field]['codes']
+        columns[field]['codes'] = ''.join(codes[i] for i in indices)
+        columns[field]['rows'] = digest
+    if not columns:
+        spec.pop(ROW_COLUMNS_KEY, None)
+
+
+def _label_key(value: Any) -> Any:
+    """字典编码的去重键（区分 1 / 1.0 / True；不可哈希的值按 JSON 文本）"""
+    try:
+        hash(value)
+        return (type(value).__name__, value)
+    except TypeError:
+        return ('json', json.dumps(value, sort_keys=True, default=str))
+
+
+def pack_rows(values: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    数据行的列式紧凑形式
+
+    每列为 {'values': [...]}，或在取值重复较多 / 有行缺少该字段时字典编码为
+    {'labels': [...], 'codes': [...]}（code 为 -1 表示该行没有这个字段）
+    """
+    rows = [row for row in values if isinstance(row, dict)]
+    fields: Dict[str, None] = {}
+    for row in rows:
+        for field in row:
+            fields.setdefault(field, None)
+    missing = object()
+    columns = {}
+    for field in fields:
+        column = [row.get(field, missing) for row in rows]
+        index: Dict[Any, int] = {}
+        labels = []
+        codes = []
+        for value in column:
+            if value is missing:
+                codes.append(-1)
+                continue
+            key = _label_key(value)
+            code = index.get(key)
+            if code is None:
+                code = index[key] = len(labels)
+                labels.append(value)
+            codes.append(code)
+        if -1 in codes or len(labels) * 2 <= len(column):
+            columns[field] = {'labels': labels, 'codes': codes}
+        else:
+            columns[field] = {'values': column}
+    return {'n': len(rows), 'fields': list(fields), 'columns': columns}
+
+
+def unpack_rows(packed: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """pack_rows 的逆操作（字段顺序取各字段首次出现的顺序）"""
+    rows: List[Dict[str, Any]] = [{} for _ in range(packed.get('n', 0))]
+    for field in packed.get('fields', []):
+        column = packed['columns'][field]
+        if 'values' in column:
+            for row, value in zip(rows, column['values']):
+                row[field] = value
+        else:
+            labels = column['labels']
+            for row, code in zip(rows, column['codes']):
+                if code >= 0:
+                    row[field] = labels[code]
+    return rows
+
+
+def pack_view(spec: Dict) -> Dict[str, Any]:
+    """自带数据的视图快照：{'spec': 不含 data.values 的 spec 副本, 'rows': pack_rows(数据行)}"""
+    values = _rows(spec) or []
+    view = copy.deepcopy({k: v for k, v in spec.items() if k != 'data'})
+    if isinstance(spec.get('data'), dict):
+        view['data'] = copy.deepcopy({k: v for k, v in spec['data'].items() if k != 'values'})
+    return {'spec': view, 'rows': pack_rows(values)}
+
+
+def unpack_view(packed: Dict[str, Any]) -> Dict:
+    """pack_view 的逆操作（返回新的 spec）"""
+    spec = copy.deepcopy(packed['spec'])
+    spec.setdefault('data', {})['values'] = unpack_rows(packed['rows'])
+    return spec
+
+
+__all__ = [
+    'ROW_COLUMNS_KEY',
+    'MAX_ROW_COLUMN_LABELS',
+    'set_row_column',
+    'drop_row_columns',
+    'row_columns',
+    'join_row_columns',
+    'join_rows',
+    'take_rows',
+    'pack_rows',
+    'unpack_rows',
+    'pack_view',
+    'unpack_view',
+]
@@ -0,0 +1,183 @@
+"""
+桑基图索引图模型（rawLinks + nodeConfig -> 整数编号的图，供各桑基图工具复用）
+
+每组 (rawLinks, nodeConfig)（按内容摘要）只构建一次：
+- 节点编号：按连接中首次出现的顺序（source 先于 target），仅出现在 nodeConfig 中的节点排在最后
+- 边编号即 rawLinks 中的行号；src / tgt / value 为 NumPy 数组
+- CSR 邻接：down_ptr / down_edges（按 source 分组的出边），up_ptr / up_edges（按 target 分组的入边），
+  组内保持连接顺序
+- 每个节点的 inflow / outflow / total（max(入流, 出流)）
+- 层桶：depth_values（升序层号）/ depth_ptr / depth_nodes（每层节点按 order 排序），
+  只包含 nodeConfig 中的节点
+"""
+
+from typing import Dict, Any, List, Optional, Tuple
+import operator
+import threading
+
+import numpy as np
+
+
+def _rows_key(rows: Optional[List[Dict[str, Any]]], fields: Optional[Tuple[str, ...]] = None) -> str:
+    """
+    数据行的内容摘要（fields 给出时只摘要这些字段，见 data_cache.content_digest）
+
+    每次工具调用都会计算（spec 被深拷贝，无法按对象身份缓存）；给出 fields 时先走 C 层的 itemgetter 取列，
+    字段缺失时退回逐行 get
+    """
+    from .data_cache import content_digest
+
+    if rows is None:
+        return 'none'
+    if fields:
+        try:
+            rows = list(map(operator.itemgetter(*fields), rows))
+        except (KeyError, TypeError):
+            rows = [tuple(r.get(f) for f in fields) if isinstance(r, dict) else None for r in rows]
+    return f'{len(rows)}:{content_digest(rows)}'
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _csr(groups: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """按组号（0..n-1）建 CSR：(ptr, 按组排列的元素下标)，组内保持原顺序"""
+    order = np.argsort(groups, kind='stable')
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(groups, minlength=n), out=ptr[1:])
+    return ptr, order
+
+
+class SankeyGraph:
+    """单组 rawLinks / nodeConfig 的索引图（构建后只读，派生的邻接名称按需缓存）"""
+
+    def __init__(self, links: List[Dict[str, Any]], nodes: Optional[List[Dict[str, Any]]] = None):
+        index: Dict[Any, int] = {}
+        names: List[Any] = []
+
+        def intern(name: Any) -> int:
+            i = index.get(name)
+            if i is None:
+                i = index[name] = len(names)
+                names.append(name)
+            return i
+
+        n_edges = len(links)
+        src = np.empty(n_edges, dtype=np.int64)
+        tgt = np.empty(n_edges, dtype=np.int64)
+        for e, link in enumerate(links):
+            link = link if isinstance(link, dict) else {}
+            src[e] = intern(link.get('source', ''))
+            tgt[e] = intern(link.get('target', ''))
+        value = np.fromiter(
+            (_to_float(link.get('value', 0)) if isinstance(link, dict) else 0.0 for link in links),
+            dtype=np.float64, count=n_edges
+        )
+        self.n_linked = len(names)
+
+        # nodeConfig：每个名称取首次出现的行
+        self.node_rows: List[Optional[Dict[str, Any]]] = [None] * len(names)
+        for row in nodes or []:
+            if not isinstance(row, dict):
+                continue
+            i = intern(row.get('name', ''))
+            if i >= len(self.node_rows):
+                self.node_rows.append(row)
+            elif self.node_rows[i] is None:
+                self.node_rows[i] = row
+
+        n = len(names)
+        self.names = names
+        self.index = index
+        self.src, self.tgt, self.value = src, tgt, value
+        self.down_ptr, self.down_edges = _csr(src, n)
+        self.up_ptr, self.up_edges = _csr(tgt, n)
+        self.outflow = np.bincount(src, weights=value, minlength=n)
+        self.inflow = np.bincount(tgt, weights=value, minlength=n)
+        self.total = np.maximum(self.inflow, self.outflow)
+
+        configured = [i for i, row in enumerate(self.node_rows) if row is not None]
+        depth = np.array([_to_float(self.node_rows[i].get('depth', 0)) for i in configured],
+                         dtype=np.float64).astype(np.int64)
+        order_key = np.array([_to_float(self.node_rows[i].get('order', 0)) for i in configured], dtype=np.float64)
+        ranked = np.lexsort((order_key, depth)) if configured else np.array([], dtype=np.int64)
+        self.depth_nodes = np.array(configured, dtype=np.int64)[ranked]
+        sorted_depth = depth[ranked]
+        self.depth_values, starts = np.unique(sorted_depth, return_index=True)
+        self.depth_ptr = np.append(starts, len(sorted_depth)).astype(np.int64)
+
+        self._edge_index: Optional[Dict[Tuple[int, int], int]] = None
+        self._neighbors: Optional[List[Tuple[List[Any], List[Any]]]] = None
+        self._lock = threading.Lock()
+
+    def node_id(self, name: Any) -> int:
+        """节点名称 -> 编号（不存在为 -1）"""
+        return self.index.get(name, -1)
+
+    def has_links(self, name: Any) -> bool:
+        """节点是否出现在连接中"""
+        i = self.index.get(name, -1)
+        return 0 <= i < self.n_linked
+
+    def out_edges(self, i: int) -> np.ndarray:
+        """节点 i 的出边编号（rawLinks 行号，保持连接顺序）"""
+        return self.down_edges[self.down_ptr[i]:self.down_ptr[i + 1]]
+
+    def in_edges(self, i: int) -> np.ndarray:
+        """节点 i 的入边编号（rawLinks 行号，保持连接顺序）"""
+        return self.up_edges[self.up_ptr[i]:self.up_ptr[i + 1]]
+
+    def edge_id(self, source: Any, target: Any) -> int:
+        """source -> target 的第一条边编号（不存在为 -1）"""
+        with self._lock:
+            if self._edge_index is None:
+                edge_index: Dict[Tuple[int, int], int] = {}
+                for e, key in enumerate(zip(self.src.tolist(), self.tgt.tolist())):
+                    edge_index.setdefault(key, e)
+                self._edge_index = edge_index
+        return self._edge_index.get((self.node_id(source), self.node_id(target)), -1)
+
+    def neighbors(self, i: int) -> Tuple[List[Any], List[Any]]:
+        """节点 i 的 (上游节点名称, 下游节点名称)，去重并保持连接顺序"""
+        with self._lock:
+            if self._neighbors is None:
+                names = self.names
+                src, tgt = self.src, self.tgt
+                self._neighbors = [
+                    (list(dict.fromkeys(names[s] for s in src[self.in_edges(j)].tolist())),
+                     list(dict.fromkeys(names[t] for t in tgt[self.out_edges(j)].tolist())))
+                    for j in range(len(names))
+                ]
+        return self._neighbors[i]
+
+    def layers(self) -> List[Tuple[int, np.ndarray]]:
+        """层桶：[(层号, 该层节点编号（按 order 排序）), ...]，层号升序"""
+        return [(int(d), self.depth_nodes[self.depth_ptr[k]:self.depth_ptr[k + 1]])
+                for k, d in enumerate(self.depth_values.tolist())]
+
+    def flows(self) -> Dict[Any, Dict[str, float]]:
+        """出现在连接中的节点的 {名称: {'inflow', 'outflow', 'total'}}（按编号顺序）"""
+        n = self.n_linked
+        return {
+            name: {'inflow': i, 'outflow': o, 'total': t}
+            for name, i, o, t in zip(self.names[:n], self.inflow[:n].tolist(),
+                                     self.outflow[:n].tolist(), self.total[:n].tolist())
+        }
+
+
+def get_sankey_graph(links: List[Dict[str, Any]], nodes: Optional[List[Dict[str, Any]]] = None) -> SankeyGraph:
+    """获取（或构建）rawLinks / nodeConfig 的索引图，按两者的内容摘要缓存"""
+    from .data_cache import get_or_compute
+
+    key = (_rows_key(links, ('source', 'target', 'value')), _rows_key(nodes))
+    return get_or_compute('sankey_graph', key, lambda: SankeyGraph(links, nodes))
+
+
+__all__ = [
+    'SankeyGraph',
+    'get_sankey_graph',
+]
@@ -7,6 +7,8 @@
 - data 数组中有 name="depthLabelsData" 的数据源，包含列标签: {depth, label}
 - 布局由 Vega transform pipeline 自动计算（stack + window + lookup），无需手动管理坐标
 - 交互由 signals 驱动：threshold, selectedNode, nodeHover, edgeHover
+- 节点流量、上下游邻接、分层由 tools.sankey_graph 的索引图提供（按 rawLinks / nodeConfig 内容哈希缓存，
+  各工具共用，不再逐次扫描连接）
 
 前端 UI 集成说明：
     1. 页面加载或 spec 变更后，先调用 get_node_options(spec) 获取完整节点元数据。
@@ -20,6 +22,8 @@ from typing import Dict, Any, List, Optional, Tuple, Union
 import copy
 import json
 
+import numpy as np
+
 
 # ═══════════════════════════════════════════════════════════
 #  内部工具函数
@@ -69,27 +73,20 @@ def _get_depth_labels(vega_spec: Dict) -> Tuple[Optional[List[Dict]], Optional[i
     return _find_data_source(vega_spec, "depthLabelsData")
 
 
-def _compute_node_flows(links: List[Dict]) -> Dict[str, Dict[str, float]]:
-    """计算每个节点的入流和出流。"""
-    flows: Dict[str, Dict[str, float]] = {}
-
-    def _ensure(name: str):
-        if name not in flows:
-            flows[name] = {"inflow": 0.0, "outflow": 0.0, "total": 0.0}
-
-    for link in links:
-        src = link.get("source", "")
-        tgt = link.get("target", "")
-        val = float(link.get("value", 0))
-        _ensure(src)
-        _ensure(tgt)
-        flows[src]["outflow"] += val
-        flows[tgt]["inflow"] += val
+def _get_graph(vega_spec: Dict):
+    """rawLinks / nodeConfig 的索引图（按内容哈希缓存，见 tools.sankey_graph）；没有 rawLinks 时返回 None"""
+    from .sankey_graph import get_sankey_graph
+    links, _ = _get_raw_links(vega_spec)
+    if links is None:
+        return None
+    nodes, _ = _get_node_config(vega_spec)
+    return get_sankey_graph(links, nodes)
 
-    for info in flows.values():
-        info["total"] = max(info["inflow"], info["outflow"])
 
-    return flows
+def _compute_node_flows(links: List[Dict], nodes: Optional[List[Dict]] = None) -> Dict[str, Dict[str, float]]:
+    """计算每个节点的入流和出流（由缓存的索引图给出）。"""
+    from .sankey_graph import get_sankey_graph
+    return get_sankey_graph(links, nodes).flows()
 
 
 def _find_signal(vega_spec: Dict, signal_name: str) -> Tuple[Optional[Dict], Optional[int]]:
@@ -210,7 +207,9 @@ def _build_ui_hints(vega_spec: Dict) -> Dict[str, Any]:
     if not nodes or not links:
         return hints
 
-    node_flows = _compute_node_flows(links)
+    graph = _get_graph(vega_spec)
+    names = graph.names
+    totals = graph.total.tolist()
 
     # depth labels
     label_map: Dict[int, str] = {}
@@ -218,23 +217,24 @@ def _build_ui_hints(vega_spec: Dict) -> Dict[str, Any]:
         for dl in depth_labels_data:
             label_map[dl.get("depth", -1)] = dl.get("label", "")
 
-    # nodes_by_depth + all_nodes
+    # nodes_by_depth + all_nodes（索引图的层桶已按 order 排序）
     depth_groups: Dict[int, List[Dict]] = {}
-    all_names: List[str] = []
-    for node in sorted(nodes, key=lambda n: (n.get("depth", 0), n.get("order", 0))):
-        name = node.get("name", "")
-        depth = node.get("depth", 0)
-        all_names.append(name)
-        flow = node_flows.get(name, {})
-        entry: Dict[str, Any] = {
-            "name": name,
-            "order": node.get("order", 0),
-            "total": round(flow.get("total", 0), 2)
-        }
-        if node.get("_is_aggregate"):
-            entry["is_aggregate"] = True
-            entry["collapsed_nodes"] = node.get("_collapsed_nodes", [])
-        depth_groups.setdefault(depth, []).append(entry)
+    all_ids: List[int] = []
+    for depth, members in graph.layers():
+        group = depth_groups[depth] = []
+        for i in members.tolist():
+            node = graph.node_rows[i]
+            all_ids.append(i)
+            entry: Dict[str, Any] = {
+                "name": names[i],
+                "order": node.get("order", 0),
+                "total": round(totals[i], 2)
+            }
+            if node.get("_is_aggregate"):
+                entry["is_aggregate"] = True
+                entry["collapsed_nodes"] = node.get("_collapsed_nodes", [])
+            group.append(entry)
+    all_names = [names[i] for i in all_ids]
 
     hints["all_nodes"] = all_names
     hints["depth_count"] = len(depth_groups)
@@ -248,28 +248,21 @@ def _build_ui_hints(vega_spec: Dict) -> Dict[str, Any]:
     }
     hints["depth_labels"] = {str(k): v for k, v in label_map.items()}
 
-    # edges + adjacency + value_range
-    edge_list = []
-    adjacency: Dict[str, Dict[str, List[str]]] = {
-        name: {"upstream": [], "downstream": []} for name in all_names
-    }
-    values = []
-
-    for link in links:
-        src = link.get("source", "")
-        tgt = link.get("target", "")
-        val = float(link.get("value", 0))
-        edge_list.append({"source": src, "target": tgt, "value": val})
-        values.append(val)
-        if src in adjacency and tgt not in adjacency[src]["downstream"]:
-            adjacency[src]["downstream"].append(tgt)
-        if tgt in adjacency and src not in adjacency[tgt]["upstream"]:
-            adjacency[tgt]["upstream"].append(src)
-
-    hints["edges"] = edge_list
+    # edges + adjacency（CSR 上下游）+ value_range
+    hints["edges"] = [
+        {"source": names[s], "target": names[t], "value": v}
+        for s, t, v in zip(graph.src.tolist(), graph.tgt.tolist(), graph.value.tolist())
+    ]
+    adjacency: Dict[str, Dict[str, List[str]]] = {}
+    for i in all_ids:
+        upstream, downstream = graph.neighbors(i)
+        adjacency[names[i]] = {"upstream": list(upstream), "downstream": list(downstream)}
     hints["adjacency"] = adjacency
-    if values:
-        hints["value_range"] = {"min": round(min(values), 2), "max": round(max(values), 2)}
+    if len(graph.value):
+        hints["value_range"] = {
+            "min": round(float(graph.value.min()), 2),
+            "max": round(float(graph.value.max()), 2)
+        }
 
     # collapsed groups
     state = vega_spec.get("_sankey_state", {})
@@ -540,7 +533,7 @@ def auto_collapse_by_rank(vega_spec: Dict, top_n: int = 5) -> Dict[str, Any]:
     state = new_spec["_sankey_state"]
     state.setdefault("collapsed_groups", {})
 
-    node_flows = _compute_node_flows(links)
+    node_flows = _compute_node_flows(links, nodes)
 
     depth_groups: Dict[int, List[Dict]] = {}
     for node in nodes:
@@ -662,7 +655,7 @@ def reorder_nodes_in_layer(
         )
     else:
         sort_key = str(sort_by).lower().strip()
-        node_flows = _compute_node_flows(links)
+        node_flows = _compute_node_flows(links, nodes)
         if sort_key == "value_desc":
             sorted_names = sorted(
                 [n.get("name") for n in layer_nodes],
@@ -709,20 +702,21 @@ def highlight_path(vega_spec: Dict, path: Union[str, List[str]]) -> Dict[str, An
         vega_spec: Vega 规范
         path:      节点路径列表。支持 ["A","B","C"]、'["A","B","C"]'、'A,B,C'
     """
+    from .predicates import membership_test
+
     path = _parse_path_arg(path)
     if not path or len(path) < 2:
         return _make_error("Path must contain at least 2 nodes")
 
-    links, _ = _get_raw_links(vega_spec)
-    if links is None:
+    graph = _get_graph(vega_spec)
+    if graph is None:
         return _make_error("Cannot find rawLinks data source")
 
-    link_set = {(l.get("source"), l.get("target")) for l in links}
     highlight_edges = []
     missing_edges = []
     for i in range(len(path) - 1):
         edge = (path[i], path[i + 1])
-        if edge in link_set:
+        if graph.edge_id(*edge) >= 0:
             highlight_edges.append(edge)
         else:
             missing_edges.append(f"{edge[0]} → {edge[1]}")
@@ -732,15 +726,9 @@ def highlight_path(vega_spec: Dict, path: Union[str, List[str]]) -> Dict[str, An
 
     new_spec = copy.deepcopy(vega_spec)
 
-    path_nodes = set(path)
-    edge_conditions = [
-        f"(datum.source === '{_escape_vega_str(s)}' && datum.target === '{_escape_vega_str(t)}')"
-        for s, t in highlight_edges
-    ]
-    is_on_path = " || ".join(edge_conditions)
-
-    node_conditions = [f"datum.name === '{_escape_vega_str(n)}'" for n in path_nodes]
-    is_path_node = " || ".join(node_conditions)
+    # 长路径用 indexof 列表 / 查找表 signal 代替逐条 || 子句
+    is_on_path, _ = membership_test(new_spec, "path_edges", ["datum.source", "datum.target"], highlight_edges)
+    is_path_node, _ = membership_test(new_spec, "path_nodes", "datum.name", list(dict.fromkeys(path)))
 
     edge_mark = _find_mark(new_spec, "edgeMark")
     if edge_mark:
@@ -775,15 +763,11 @@ def trace_node(vega_spec: Dict, node_name: str) -> Dict[str, Any]:
         vega_spec: Vega 规范
         node_name: 节点名称
     """
-    links, _ = _get_raw_links(vega_spec)
-    if links is None:
+    graph = _get_graph(vega_spec)
+    if graph is None:
         return _make_error("Cannot find rawLinks data source")
 
-    node_exists = any(
-        l.get("source") == node_name or l.get("target") == node_name
-        for l in links
-    )
-    if not node_exists:
+    if not graph.has_links(node_name):
         return _make_error(f'Node "{node_name}" not found in links')
 
     new_spec = copy.deepcopy(vega_spec)
@@ -831,6 +815,8 @@ def color_flows(vega_spec: Dict, nodes: List[str], color: str = "#e74c3c") -> Di
         nodes:     节点名称列表
         color:     着色颜色（默认红色 #e74c3c）
     """
+    from .predicates import membership_test
+
     links_data, _ = _get_raw_links(vega_spec)
     if links_data is None:
         return _make_error("Cannot find rawLinks data source")
@@ -839,21 +825,19 @@ def color_flows(vega_spec: Dict, nodes: List[str], color: str = "#e74c3c") -> Di
     if not nodes_set:
         return _make_error("nodes list is empty")
 
+    graph = _get_graph(vega_spec)
+    node_ids = [graph.node_id(name) for name in nodes_set if graph.has_links(name)]
+    edge_ids = np.flatnonzero(np.isin(graph.src, node_ids) | np.isin(graph.tgt, node_ids))
     colored_edges = [
-        (l.get("source"), l.get("target"))
-        for l in links_data
-        if l.get("source") in nodes_set or l.get("target") in nodes_set
+        (links_data[e].get("source"), links_data[e].get("target"))
+        for e in edge_ids.tolist()
     ]
     if not colored_edges:
         return _make_error(f"No flows connected to nodes: {sorted(nodes_set)}")
 
     new_spec = copy.deepcopy(vega_spec)
 
-    parts = [
-        f"(datum.source === '{_escape_vega_str(s)}' && datum.target === '{_escape_vega_str(t)}')"
-        for s, t in colored_edges
-    ]
-    is_colored = " || ".join(parts)
+    is_colored, _ = membership_test(new_spec, "colored_flows", ["datum.source", "datum.target"], colored_edges)
 
     edge_mark = _find_mark(new_spec, "edgeMark")
     if edge_mark is None:
@@ -892,6 +876,34 @@ def color_flows(vega_spec: Dict, nodes: List[str], color: str = "#e74c3c") -> Di
 #  纯分析类工具
 # ═══════════════════════════════════════════════════════════
 
+def _conversion_entry(name: str, inflow: float, outflow: float) -> Dict[str, Any]:
+    """单个节点的转化率条目。"""
+    if inflow == 0 and outflow > 0:
+        node_type = "source"
+        rate = "source"
+    elif outflow == 0 and inflow > 0:
+        node_type = "sink"
+        rate = 0.0
+    else:
+        node_type = "intermediate"
+        rate = round(outflow / inflow, 4) if inflow > 0 else 0.0
+
+    conversion: Dict[str, Any] = {
+        "node": name,
+        "inflow": round(inflow, 2),
+        "outflow": round(outflow, 2),
+        "rate": rate,
+        "type": node_type
+    }
+
+    if node_type == "intermediate" and inflow > 0:
+        loss = inflow - outflow
+        conversion["loss"] = round(loss, 2)
+        conversion["loss_rate"] = round(loss / inflow, 4)
+
+    return conversion
+
+
 def calculate_conversion_rate(
     vega_spec: Dict,
     node_name: Optional[str] = None
@@ -907,65 +919,41 @@ def calculate_conversion_rate(
     if links is None:
         return _make_error("Cannot find rawLinks data source")
 
-    node_flows = _compute_node_flows(links)
+    graph = _get_graph(vega_spec)
     ui_hints = _build_ui_hints(vega_spec)
 
-    conversions = []
-    for name in sorted(node_flows.keys()):
-        info = node_flows[name]
-        inflow = info["inflow"]
-        outflow = info["outflow"]
-
-        if inflow == 0 and outflow > 0:
-            node_type = "source"
-            rate = "source"
-        elif outflow == 0 and inflow > 0:
-            node_type = "sink"
-            rate = 0.0
-        else:
-            node_type = "intermediate"
-            rate = round(outflow / inflow, 4) if inflow > 0 else 0.0
-
-        conversion: Dict[str, Any] = {
-            "node": name,
-            "inflow": round(inflow, 2),
-            "outflow": round(outflow, 2),
-            "rate": rate,
-            "type": node_type
-        }
-
-        if node_type == "intermediate" and inflow > 0:
-            loss = inflow - outflow
-            conversion["loss"] = round(loss, 2)
-            conversion["loss_rate"] = round(loss / inflow, 4)
-
-        conversions.append(conversion)
-
     if node_name:
-        target = [c for c in conversions if c["node"] == node_name]
-        if not target:
+        if not graph.has_links(node_name):
             return _make_error(f'Node "{node_name}" not found')
+        i = graph.node_id(node_name)
 
+        # CSR 入边 / 出边，只访问与该节点相连的连接
         upstream = [
-            {"from": l["source"], "value": l["value"]}
-            for l in links if l.get("target") == node_name
+            {"from": links[e]["source"], "value": links[e]["value"]}
+            for e in graph.in_edges(i).tolist()
         ]
         downstream = [
-            {"to": l["target"], "value": l["value"]}
-            for l in links if l.get("source") == node_name
+            {"to": links[e]["target"], "value": links[e]["value"]}
+            for e in graph.out_edges(i).tolist()
         ]
 
         result = _make_success(
             "calculate_conversion_rate",
             f"Conversion analysis for {node_name}",
             node=node_name,
-            conversion=target[0],
+            conversion=_conversion_entry(node_name, float(graph.inflow[i]), float(graph.outflow[i])),
             upstream=upstream,
             downstream=downstream
         )
         result["_ui_hints"] = ui_hints
         return result
 
+    node_flows = graph.flows()
+    conversions = [
+        _conversion_entry(name, node_flows[name]["inflow"], node_flows[name]["outflow"])
+        for name in sorted(node_flows.keys())
+    ]
+
     sources = [c for c in conversions if c["type"] == "source"]
     sinks = [c for c in conversions if c["type"] == "sink"]
     intermediates = [c for c in conversions if c["type"] == "intermediate"]
@@ -1000,25 +988,27 @@ def find_bottleneck(vega_spec: Dict, top_n: int = 3) -> Dict[str, Any]:
         vega_spec: Vega 规范
         top_n:     返回流失最严重的前 N 个节点
     """
-    links, _ = _get_raw_links(vega_spec)
-    if links is None:
+    graph = _get_graph(vega_spec)
+    if graph is None:
         return _make_error("Cannot find rawLinks data source")
 
-    node_flows = _compute_node_flows(links)
+    # 向量化筛选有流失的中间节点，只为候选节点生成条目
+    n = graph.n_linked
+    inflows, outflows = graph.inflow[:n], graph.outflow[:n]
+    candidates = np.flatnonzero((inflows > 0) & (outflows > 0) & (inflows > outflows))
 
     bottlenecks = []
-    for name, info in node_flows.items():
-        inflow = info["inflow"]
-        outflow = info["outflow"]
-        if inflow > 0 and outflow > 0 and inflow > outflow:
-            loss = inflow - outflow
-            bottlenecks.append({
-                "node": name,
-                "inflow": round(inflow, 2),
-                "outflow": round(outflow, 2),
-                "loss": round(loss, 2),
-                "loss_rate": round(loss / inflow, 4)
-            })
+    for i in candidates.tolist():
+        inflow = float(inflows[i])
+        outflow = float(outflows[i])
+        loss = inflow - outflow
+        bottlenecks.append({
+            "node": graph.names[i],
+            "inflow": round(inflow, 2),
+            "outflow": round(outflow, 2),
+            "loss": round(loss, 2),
+            "loss_rate": round(loss / inflow, 4)
+        })
 
     bottlenecks.sort(key=lambda x: x["loss_rate"], reverse=True)
     top = bottlenecks[:top_n]
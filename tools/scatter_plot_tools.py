@@ -2,12 +2,10 @@
 散点图专用工具
 """
 
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional
 import numpy as np
 import copy
 import json
-from sklearn.cluster import KMeans
-from scipy.stats import pearsonr, spearmanr
 
 
 def _datum_ref(field: str) -> str:
@@ -18,10 +16,136 @@ def _datum_ref(field: str) -> str:
     return f"datum['{s}']"
 
 
+def _point_view(vega_spec: Dict) -> Dict:
+    """
+    散点分析工具使用的原始点视图
 
-def identify_clusters(vega_spec: Dict, n_clusters: int = 3, method: str = "kmeans") -> Dict[str, Any]:
-    """识别数据聚类"""
-    new_spec = copy.deepcopy(vega_spec)
+    aggregate_density 聚合后的视图按 _avs_density 还原 mark / encoding / data（数据行由列式紧凑形式解出，
+    见 row_columns.unpack_rows），其余视图原样返回。返回值与输入共享对象，需要修改时由调用方深拷贝。
+    """
+    from .row_columns import unpack_rows
+
+    state = vega_spec.get('_avs_density') if isinstance(vega_spec, dict) else None
+    if not state:
+        return vega_spec
+    data = dict(state.get('data') or {})
+    if 'rows' in state:
+        data['values'] = unpack_rows(state['rows'])
+    point_spec = {k: v for k, v in vega_spec.items() if k not in ('_avs_density', 'layer')}
+    point_spec.update(mark=state.get('mark'), encoding=state.get('encoding'), data=data)
+    return point_spec
+
+
+def _note_full_data(result: Dict[str, Any], spec: Dict, use_full_data: bool, is_full: bool) -> Dict[str, Any]:
+    """请求了全量数据、spec 也声明了全量数据却无法取得时，在结果中说明实际使用的是视图中的点"""
+    from .data_cache import has_full_data
+    if use_full_data and not is_full and has_full_data(spec):
+        result['full_data_unavailable'] = True
+        result['message'] += ' (full data unavailable; used the points in the view)'
+    return result
+
+
+# 聚类：点数超过阈值时改用 MiniBatchKMeans（在采样上拟合，再对全部点预测）
+CLUSTER_MINIBATCH_THRESHOLD = 10000
+CLUSTER_FIT_SAMPLE_SIZE = 10000
+CLUSTER_SILHOUETTE_SAMPLE_SIZE = 2000
+# k 的上限（防止误传过大的 k；紧凑标签列最多支持 62 种取值）
+CLUSTER_MAX_K = 50
+
+
+def _cluster_points(vega_spec: Dict, x_field: str, y_field: str):
+    """取出 (x/y 列指纹组成的键, 有效点坐标, 有效行掩码)"""
+    from .data_cache import spec_values, column_fingerprint, numeric_column
+    values = spec_values(vega_spec)
+    x_key = column_fingerprint(values, x_field)
+    y_key = column_fingerprint(values, y_field)
+    key = f'{x_key}|{y_key}'
+    xs = numeric_column(values, x_field, x_key)
+    ys = numeric_column(values, y_field, y_key)
+    mask = np.isfinite(xs) & np.isfinite(ys)
+    return key, np.column_stack([xs[mask], ys[mask]]), mask
+
+
+def _fit_clusters(points: np.ndarray, k: int, key: str, x_field: str, y_field: str) -> Dict[str, Any]:
+    """拟合 k 个簇（按 (x/y 列指纹, k) 缓存）"""
+    from .data_cache import get_or_compute
+    
+    def build():
+        from sklearn.cluster import KMeans, MiniBatchKMeans
+        n = len(points)
+        if n <= CLUSTER_MINIBATCH_THRESHOLD:
+            model = KMeans(n_clusters=k, random_state=42, n_init=10).fit(points)
+            labels = model.labels_
+            fit_method = 'kmeans'
+        else:
+            rng = np.random.default_rng(42)
+            sample = points[rng.choice(n, size=min(n, CLUSTER_FIT_SAMPLE_SIZE), replace=False)]
+            model = MiniBatchKMeans(n_clusters=k, random_state=42, n_init=3, batch_size=1024).fit(sample)
+            labels = model.predict(points)
+            fit_method = 'minibatch_kmeans'
+        centers = model.cluster_centers_
+        inertia = float(((points - centers[labels]) ** 2).sum())
+        return {
+            'labels': labels.astype(np.int16),
+            'centers': centers,
+            'inertia': inertia,
+            'fit_method': fit_method
+        }
+    
+    return get_or_compute('scatter_clusters', (key, x_field, y_field, k), build)
+
+
+def _silhouette(points: np.ndarray, labels: np.ndarray) -> Optional[float]:
+    from sklearn.metrics import silhouette_score
+    if len(np.unique(labels)) < 2 or len(points) <= len(np.unique(labels)):
+        return None
+    sample_size = min(len(points), CLUSTER_SILHOUETTE_SAMPLE_SIZE)
+    return float(silhouette_score(points, labels, sample_size=sample_size, random_state=42))
+
+
+def _elbow_k(sweep: List[Dict[str, Any]]) -> Optional[int]:
+    """肘部法：惯性曲线二阶差分最大处"""
+    if len(sweep) < 3:
+        return None
+    inertias = np.array([item['inertia'] for item in sweep])
+    second_diff = inertias[:-2] - 2 * inertias[1:-1] + inertias[2:]
+    return sweep[int(np.argmax(second_diff)) + 1]['k']
+
+
+def _attach_cluster_labels(spec: Dict, labels: np.ndarray, mask: np.ndarray, cluster_field: str,
+                           n_clusters: int) -> None:
+    """
+    以紧凑列挂载聚类标签（见 row_columns：每行一个字符，不改写数据行），渲染与 get_data 时才合并到行上；
+    无有效坐标的行为 null
+    """
+    from .row_columns import set_row_column, drop_row_columns
+    
+    drop_row_columns(spec, [f for f in spec.get('_avs_columns', {}) if f.startswith('cluster_')])
+    codes = np.full(len(mask), -1, dtype=np.int64)
+    codes[mask] = labels
+    set_row_column(spec, cluster_field, codes, list(range(n_clusters)))
+
+
+def identify_clusters(vega_spec: Dict, n_clusters: int = 3, method: str = "kmeans",
+                      k_range: Optional[List[int]] = None) -> Dict[str, Any]:
+    """
+    识别数据聚类
+    
+    点数超过 CLUSTER_MINIBATCH_THRESHOLD 时在采样上拟合 MiniBatchKMeans 再预测全部点；
+    拟合结果按 (x/y 列指纹, k) 缓存。聚类标签以紧凑列挂载到 spec（不改写数据行，渲染时才合并）。
+    
+    Args:
+        vega_spec: Vega-Lite规范
+        n_clusters: 簇数
+        method: 聚类方法（目前仅支持 kmeans）
+        k_range: 可选，一次扫描多个 k（如 [2, 3, 4, 5, 6]），返回每个 k 的惯性与轮廓系数，
+                 并用轮廓系数最高的 k 着色
+    """
+    if method != "kmeans":
+        return {'success': False, 'error': f'Unsupported method: {method}'}
+    
+    point_spec = _point_view(vega_spec)
+    new_spec = copy.deepcopy(point_spec)
     
     x_field = new_spec.get('encoding', {}).get('x', {}).get('field')
     y_field = new_spec.get('encoding', {}).get('y', {}).get('field')
@@ -29,28 +153,38 @@ def identify_clusters(vega_spec: Dict, n_clusters: int = 3, method: str = "kmean
     if not x_field or not y_field:
         return {'success': False, 'error': 'Cannot find required fields'}
     
-    data = new_spec.get('data', {}).get('values', [])
-    
-    points = []
-    valid_indices = []
-    for i, row in enumerate(data):
-        if row.get(x_field) is not None and row.get(y_field) is not None:
-            points.append([row[x_field], row[y_field]])
-            valid_indices.append(i)
-    
-    if len(points) < n_clusters:
-        return {'success': False, 'error': f'Not enough points for {n_clusters} clusters'}
+    key, points_array, mask = _cluster_points(new_spec, x_field, y_field)
+    
+    candidate_ks = sorted({int(k) for k in k_range}) if k_range else [int(n_clusters)]
+    if any(k < 1 or k > CLUSTER_MAX_K for k in candidate_ks):
+        return {'success': False, 'error': f'n_clusters must be between 1 and {CLUSTER_MAX_K}'}
+    if len(points_array) < max(candidate_ks):
+        return {'success': False, 'error': f'Not enough points for {max(candidate_ks)} clusters'}
+    
+    k_sweep = None
+    recommended = None
+    if k_range:
+        k_sweep = []
+        for k in candidate_ks:
+            fit = _fit_clusters(points_array, k, key, x_field, y_field)
+            k_sweep.append({
+                'k': k,
+                'inertia': fit['inertia'],
+                'silhouette': _silhouette(points_array, fit['labels'])
+            })
+        scored = [item for item in k_sweep if item['silhouette'] is not None]
+        recommended = {
+            'silhouette': max(scored, key=lambda item: item['silhouette'])['k'] if scored else None,
+            'elbow': _elbow_k(k_sweep)
+        }
+        n_clusters = recommended['silhouette'] or recommended['elbow'] or candidate_ks[0]
     
-    points_array = np.array(points)
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    labels = kmeans.fit_predict(points_array)
-    centers = kmeans.cluster_centers_
+    fit = _fit_clusters(points_array, int(n_clusters), key, x_field, y_field)
+    labels = fit['labels']
+    centers = fit['centers']
     
     cluster_field = f'cluster_{n_clusters}'
-    for i, label in enumerate(labels):
-        data[valid_indices[i]][cluster_field] = int(label)
-    
-    new_spec['data']['values'] = data
+    _attach_cluster_labels(new_spec, labels, mask, cluster_field, n_clusters)
     new_spec['encoding']['color'] = {
         'field': cluster_field,
         'type': 'nominal',
@@ -58,71 +192,169 @@ def identify_clusters(vega_spec: Dict, n_clusters: int = 3, method: str = "kmean
         'legend': {'title': 'Cluster'}
     }
     
+    sizes = np.bincount(labels, minlength=n_clusters)
     cluster_stats = []
     for i in range(n_clusters):
-        cluster_points = points_array[labels == i]
         cluster_stats.append({
             'cluster_id': i,
-            'size': len(cluster_points),
+            'size': int(sizes[i]),
             'center': centers[i].tolist()
         })
     
-    return {
+    result = {
         'success': True,
         'operation': 'identify_clusters',
         'vega_spec': new_spec,
         'n_clusters': n_clusters,
         'cluster_statistics': cluster_stats,
+        'fit_method': fit['fit_method'],
+        'inertia': fit['inertia'],
         'message': f'Identified {n_clusters} clusters'
     }
+    if k_sweep is not None:
+        result['k_sweep'] = k_sweep
+        result['recommended_k'] = recommended
+        result['message'] = (
+            f'Identified {n_clusters} clusters (k sweep {candidate_ks}: '
+            f'best silhouette k={recommended["silhouette"]}, elbow k={recommended["elbow"]})'
+        )
+    if point_spec is not vega_spec:
+        result['message'] += ' (density view switched back to points to show cluster colors)'
+    return result
+
+
+# 在线相关累加器每次合并的块大小
+_CORRELATION_CHUNK_SIZE = 65536
+
+
+class _PearsonAccumulator:
+    """
+    单遍在线 Pearson 累加器（按块合并均值与二阶矩，数值稳定）
+    """
+    
+    def __init__(self):
+        self.n = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.c_xy = 0.0
+    
+    def update(self, xs: np.ndarray, ys: np.ndarray):
+        n_b = len(xs)
+        if n_b == 0:
+            return
+        mean_xb = float(xs.mean())
+        mean_yb = float(ys.mean())
+        dx = xs - mean_xb
+        dy = ys - mean_yb
+        m2_xb = float(dx @ dx)
+        m2_yb = float(dy @ dy)
+        c_xyb = float(dx @ dy)
+        
+        n_a = self.n
+        n = n_a + n_b
+        delta_x = mean_xb - self.mean_x
+        delta_y = mean_yb - self.mean_y
+        factor = n_a * n_b / n
+        self.m2_x += m2_xb + delta_x * delta_x * factor
+        self.m2_y += m2_yb + delta_y * delta_y * factor
+        self.c_xy += c_xyb + delta_x * delta_y * factor
+        self.mean_x += delta_x * n_b / n
+        self.mean_y += delta_y * n_b / n
+        self.n = n
+    
+    def correlation(self) -> float:
+        if self.m2_x <= 0 or self.m2_y <= 0:
+            return float('nan')
+        r = self.c_xy / np.sqrt(self.m2_x * self.m2_y)
+        return float(max(-1.0, min(1.0, r)))
 
 
-def calculate_correlation(vega_spec: Dict, method: str = "pearson") -> Dict[str, Any]:
+def _pearson(xs: np.ndarray, ys: np.ndarray) -> float:
+    acc = _PearsonAccumulator()
+    for start in range(0, len(xs), _CORRELATION_CHUNK_SIZE):
+        acc.update(xs[start:start + _CORRELATION_CHUNK_SIZE], ys[start:start + _CORRELATION_CHUNK_SIZE])
+    return acc.correlation()
+
+
+def _average_ranks(values: np.ndarray) -> np.ndarray:
+    """向量化平均秩（并列值取平均秩，与 scipy.stats.rankdata 一致）"""
+    order = np.argsort(values, kind='mergesort')
+    ordered = values[order]
+    # 每个并列组的起止位置
+    boundaries = np.flatnonzero(np.concatenate(([True], ordered[1:] != ordered[:-1], [True])))
+    group_ranks = (boundaries[:-1] + boundaries[1:] + 1) / 2.0
+    ranks = np.empty(len(values), dtype=np.float64)
+    ranks[order] = np.repeat(group_ranks, np.diff(boundaries))
+    return ranks
+
+
+def _correlation_p_value(r: float, n: int) -> float:
+    """双侧 p 值（t 分布，df = n - 2）"""
+    if n < 3 or np.isnan(r):
+        return float('nan')
+    if abs(r) >= 1.0:
+        return 0.0
+    from scipy.stats import t as t_dist
+    t_stat = r * np.sqrt((n - 2) / (1.0 - r * r))
+    return float(2 * t_dist.sf(abs(t_stat), n - 2))
+
+
+def calculate_correlation(vega_spec: Dict, method: str = "pearson", use_full_data: bool = False) -> Dict[str, Any]:
     """计算相关系数
     
     如果之前使用了 select_region 或 brush_region 选中了区域，
     则只计算选中区域内的数据的相关系数。
+    
+    Args:
+        vega_spec: Vega-Lite规范
+        method: pearson | spearman
+        use_full_data: 为 True 时在全量数据（_metadata.full_data_path 的文件或会话登记的全量数据）
+                       而非视图中的采样点上精确计算；无法取得时在结果中标记 full_data_unavailable
     """
-    x_field = vega_spec.get('encoding', {}).get('x', {}).get('field')
-    y_field = vega_spec.get('encoding', {}).get('y', {}).get('field')
+    from .data_cache import get_dataset, numeric_column, region_mask
+    
+    point_spec = _point_view(vega_spec)
+    x_field = point_spec.get('encoding', {}).get('x', {}).get('field')
+    y_field = point_spec.get('encoding', {}).get('y', {}).get('field')
     
     if not x_field or not y_field:
         return {'success': False, 'error': 'Cannot find required fields'}
     
-    data = vega_spec.get('data', {}).get('values', [])
+    if method not in ("pearson", "spearman"):
+        return {'success': False, 'error': f'Unsupported method: {method}'}
+    
+    values, key, is_full = get_dataset(point_spec, use_full_data=use_full_data)
+    xs = numeric_column(values, x_field, key)
+    ys = numeric_column(values, y_field, key)
+    mask = np.isfinite(xs) & np.isfinite(ys)
     
     # 检查是否有选中区域（来自 select_region 或 brush_region）
     selected = vega_spec.get('_selected_region')
     region_info = ""
     if selected:
-        x_min, x_max = selected['x_range']
-        y_min, y_max = selected['y_range']
-        data = [row for row in data 
-                if row.get(x_field) is not None and row.get(y_field) is not None
-                and x_min <= row[x_field] <= x_max
-                and y_min <= row[y_field] <= y_max]
-        region_info = f" (in selected region: {len(data)} points)"
-    
-    x_values = [row[x_field] for row in data if row.get(x_field) is not None and row.get(y_field) is not None]
-    y_values = [row[y_field] for row in data if row.get(x_field) is not None and row.get(y_field) is not None]
-    
-    if len(x_values) < 2:
-        return {'success': False, 'error': f'Not enough data points{region_info}'}
+        mask &= region_mask(values, key, x_field, selected['x_range'], y_field, selected['y_range'])
+        region_info = f" (in selected region: {int(mask.sum())} points)"
     
-    x_array = np.array(x_values)
-    y_array = np.array(y_values)
+    x_array = xs[mask]
+    y_array = ys[mask]
+    n_points = len(x_array)
     
-    if method == "pearson":
-        correlation, p_value = pearsonr(x_array, y_array)
-    elif method == "spearman":
-        correlation, p_value = spearmanr(x_array, y_array)
-    else:
-        return {'success': False, 'error': f'Unsupported method: {method}'}
+    if n_points < 2:
+        return {'success': False, 'error': f'Not enough data points{region_info}'}
+    
+    if method == "spearman":
+        x_array = _average_ranks(x_array)
+        y_array = _average_ranks(y_array)
+    correlation = _pearson(x_array, y_array)
+    p_value = _correlation_p_value(correlation, n_points)
     
     strength = "strong" if abs(correlation) >= 0.7 else "moderate" if abs(correlation) >= 0.4 else "weak"
     direction = "positive" if correlation > 0 else "negative"
+    scope_info = f" over full dataset ({n_points} points)" if is_full else ""
     
-    return {
+    return _note_full_data({
         'success': True,
         'operation': 'calculate_correlation',
         'method': method,
@@ -130,10 +362,11 @@ def calculate_correlation(vega_spec: Dict, method: str = "pearson") -> Dict[str,
         'p_value': float(p_value),
         'strength': strength,
         'direction': direction,
-        'data_points': len(x_values),
+        'data_points': n_points,
         'selected_region': selected is not None,
-        'message': f'{method} correlation: {correlation:.3f} ({strength} {direction}){region_info}'
-    }
+        'full_data': is_full,
+        'message': f'{method} correlation: {correlation:.3f} ({strength} {direction}){region_info}{scope_info}'
+    }, point_spec, use_full_data, is_full)
 
 
 def zoom_dense_area(vega_spec: Dict, x_range: Tuple[float, float], y_range: Tuple[float, float]) -> Dict[str, Any]:
@@ -166,15 +399,15 @@ def zoom_dense_area(vega_spec: Dict, x_range: Tuple[float, float], y_range: Tupl
     original_count = len(data)
     
     # Filter data: only keep points within the specified range
-    filtered_data = [
-        point for point in data
+    kept = [
+        i for i, point in enumerate(data)
         if (point.get(x_field) is not None and 
             point.get(y_field) is not None and
             x_range[0] <= point[x_field] <= x_range[1] and
             y_range[0] <= point[y_field] <= y_range[1])
     ]
     
-    filtered_count = len(filtered_data)
+    filtered_count = len(kept)
     
     if filtered_count == 0:
         return {
@@ -184,8 +417,9 @@ def zoom_dense_area(vega_spec: Dict, x_range: Tuple[float, float], y_range: Tupl
             'filtered_count': 0
         }
     
-    # Update data in spec
-    new_spec['data']['values'] = filtered_data
+    # Update data in spec (row-aligned columns such as cluster labels are sliced along)
+    from .row_columns import take_rows
+    take_rows(new_spec, kept)
     
     # Adjust axis scales to the specified range
     if 'encoding' not in new_spec:
@@ -416,22 +650,153 @@ def change_encoding(vega_spec: Dict, channel: str, field: str) -> Dict[str, Any]
     }
 
 
-def show_regression(vega_spec: Dict, method: str = "linear") -> Dict[str, Any]:
+# 回归：输出曲线的采样点数；分箱 LOESS 的箱数与带宽（与 Vega-Lite loess 默认 bandwidth 一致）
+REGRESSION_LINE_POINTS = 100
+LOESS_BINS = 50
+LOESS_BANDWIDTH = 0.3
+_REGRESSION_TAG = 'show_regression'
+
+
+def _r_squared(ys: np.ndarray, fitted: np.ndarray) -> Optional[float]:
+    ss_tot = float(((ys - ys.mean()) ** 2).sum())
+    if ss_tot <= 0:
+        return None
+    return float(1.0 - ((ys - fitted) ** 2).sum() / ss_tot)
+
+
+def _binned_loess(xs: np.ndarray, ys: np.ndarray, grid: np.ndarray) -> np.ndarray:
+    """
+    分箱 LOESS 近似：先按 x 等宽分箱求 (均值x, 均值y, 点数)，
+    再在箱质心上做三次权重（tricube）的局部加权线性回归
+    """
+    counts, edges = np.histogram(xs, bins=LOESS_BINS)
+    idx = np.clip(np.searchsorted(edges, xs, side='right') - 1, 0, LOESS_BINS - 1)
+    sum_x = np.bincount(idx, weights=xs, minlength=LOESS_BINS)
+    sum_y = np.bincount(idx, weights=ys, minlength=LOESS_BINS)
+    nonempty = counts > 0
+    bx = sum_x[nonempty] / counts[nonempty]
+    by = sum_y[nonempty] / counts[nonempty]
+    bw = counts[nonempty].astype(np.float64)
+    
+    span = max(3, int(np.ceil(LOESS_BANDWIDTH * len(bx))))
+    # 每个网格点到各箱质心的距离 (len(grid), n_bins)
+    dist = np.abs(grid[:, None] - bx[None, :])
+    radius = np.partition(dist, min(span, len(bx)) - 1, axis=1)[:, min(span, len(bx)) - 1]
+    radius = np.where(radius > 0, radius, 1.0)
+    u = np.clip(dist / radius[:, None], 0, 1)
+    w = (1 - u ** 3) ** 3 * bw[None, :]
+    
+    sw = w.sum(axis=1)
+    sw = np.where(sw > 0, sw, 1.0)
+    mx = (w * bx).sum(axis=1) / sw
+    my = (w * by).sum(axis=1) / sw
+    dx = bx[None, :] - mx[:, None]
+    sxx = (w * dx * dx).sum(axis=1)
+    sxy = (w * dx * (by[None, :] - my[:, None])).sum(axis=1)
+    slope = np.where(sxx > 0, sxy / np.where(sxx > 0, sxx, 1.0), 0.0)
+    return my + slope * (grid - mx)
+
+
+def _fit_regression(xs: np.ndarray, ys: np.ndarray, method: str) -> Dict[str, Any]:
+    """
+    NumPy 回归拟合
+    
+    Returns:
+        {'line_x', 'line_y', 'coefficients', 'equation', 'r_squared', 'n'}
+    """
+    if method in ('log', 'exp'):
+        valid = xs > 0 if method == 'log' else ys > 0
+        xs, ys = xs[valid], ys[valid]
+    if len(xs) < 2:
+        raise ValueError(f'Not enough valid points for {method} regression')
+    
+    grid = np.linspace(float(xs.min()), float(xs.max()), REGRESSION_LINE_POINTS)
+    coefficients = None
+    equation = None
+    if method in ('linear', 'quad', 'poly'):
+        order = {'linear': 1, 'quad': 2, 'poly': 3}[method]
+        order = min(order, len(np.unique(xs)) - 1) or 1
+        coefs = np.polyfit(xs, ys, order)
+        fitted = np.polyval(coefs, xs)
+        line_y = np.polyval(coefs, grid)
+        # 系数按幂次升序：c0 + c1*x + c2*x^2 ...
+        coefficients = [float(c) for c in coefs[::-1]]
+        equation = 'y = ' + ' + '.join(
+            f'{c:.4g}' if p == 0 else f'{c:.4g}*x' if p == 1 else f'{c:.4g}*x^{p}'
+            for p, c in enumerate(coefficients)
+        )
+    elif method == 'log':
+        b, a = np.polyfit(np.log(xs), ys, 1)
+        fitted = a + b * np.log(xs)
+        line_y = a + b * np.log(grid)
+        coefficients = [float(a), float(b)]
+        equation = f'y = {a:.4g} + {b:.4g}*ln(x)'
+    elif method == 'exp':
+        b, log_a = np.polyfit(xs, np.log(ys), 1)
+        a = np.exp(log_a)
+        fitted = a * np.exp(b * xs)
+        line_y = a * np.exp(b * grid)
+        coefficients = [float(a), float(b)]
+        equation = f'y = {a:.4g}*exp({b:.4g}*x)'
+    else:  # loess
+        line_y = _binned_loess(xs, ys, grid)
+        fitted = np.interp(xs, grid, line_y)
+    
+    return {
+        'line_x': grid,
+        'line_y': line_y,
+        'coefficients': coefficients,
+        'equation': equation,
+        'r_squared': _r_squared(ys, fitted),
+        'n': int(len(xs))
+    }
+
+
+def show_regression(vega_spec: Dict, method: str = "linear", use_full_data: bool = False) -> Dict[str, Any]:
     """
     叠加回归线
     
+    回归在服务端用 NumPy 拟合一次（按数据键缓存），以预计算的折线图层叠加，
+    并返回系数与 R²。若有选中区域（_selected_region），只在区域内拟合。
+    
     Args:
         vega_spec: Vega-Lite规范
-        method: 回归方法 ("linear", "log", "exp", "poly", "quad")
+        method: 回归方法 ("linear", "log", "exp", "poly", "quad", "loess")
+        use_full_data: 是否在全量数据（full_data_path 的文件或会话登记的全量数据）上拟合
     """
+    from .data_cache import get_dataset, numeric_column, region_mask, get_or_compute
+    
+    if method not in ("linear", "log", "exp", "poly", "quad", "loess"):
+        method = "linear"
+    
     new_spec = copy.deepcopy(vega_spec)
     
-    x_field = new_spec.get('encoding', {}).get('x', {}).get('field')
-    y_field = new_spec.get('encoding', {}).get('y', {}).get('field')
+    layers = new_spec.get('layer')
+    encoding = layers[0].get('encoding', {}) if layers else new_spec.get('encoding', {})
+    x_field = encoding.get('x', {}).get('field')
+    y_field = encoding.get('y', {}).get('field')
     
     if not x_field or not y_field:
         return {'success': False, 'error': 'Cannot find x or y fields'}
     
+    point_spec = _point_view(new_spec)
+    values, key, is_full = get_dataset(point_spec, use_full_data=use_full_data)
+    selected = new_spec.get('_selected_region')
+    region = (tuple(selected['x_range']), tuple(selected['y_range'])) if selected else None
+    
+    def build():
+        xs = numeric_column(values, x_field, key)
+        ys = numeric_column(values, y_field, key)
+        mask = np.isfinite(xs) & np.isfinite(ys)
+        if region:
+            mask &= region_mask(values, key, x_field, region[0], y_field, region[1])
+        return _fit_regression(xs[mask], ys[mask], method)
+    
+    try:
+        fit = get_or_compute('regression', (key, x_field, y_field, method, region), build)
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}
+    
     # 如果原规范没有 layer，转换为 layer 结构
     if 'layer' not in new_spec:
         original_spec = copy.deepcopy(new_spec)
@@ -445,45 +810,310 @@ def show_regression(vega_spec: Dict, method: str = "linear") -> Dict[str, Any]:
         if 'encoding' in new_spec:
             del new_spec['encoding']
     
-    # 添加回归线图层
-    regression_transform = {
-        'regression': y_field,
-        'on': x_field
-    }
-    
-    # 根据方法设置回归参数
-    if method == "poly":
-        regression_transform['method'] = 'poly'
-        regression_transform['order'] = 3
-    elif method == "quad":
-        regression_transform['method'] = 'poly'
-        regression_transform['order'] = 2
-    elif method in ["log", "exp"]:
-        regression_transform['method'] = method
-    else:
-        regression_transform['method'] = 'linear'
-    
+    # 替换之前叠加的回归线图层
+    new_spec['layer'] = [l for l in new_spec['layer'] if l.get('_avs_tag') != _REGRESSION_TAG]
+    line_values = [
+        {x_field: float(x), y_field: float(y)}
+        for x, y in zip(fit['line_x'].tolist(), fit['line_y'].tolist())
+        if np.isfinite(y)
+    ]
     new_spec['layer'].append({
+        'data': {'values': line_values},
         'mark': {
             'type': 'line',
             'color': 'red',
             'strokeWidth': 2
         },
-        'transform': [regression_transform],
         'encoding': {
             'x': {'field': x_field, 'type': 'quantitative'},
             'y': {'field': y_field, 'type': 'quantitative'}
-        }
+        },
+        '_avs_tag': _REGRESSION_TAG
     })
     
-    return {
+    r2 = fit['r_squared']
+    r2_info = f', R²={r2:.3f}' if r2 is not None else ''
+    equation_info = f': {fit["equation"]}' if fit['equation'] else ''
+    return _note_full_data({
         'success': True,
         'operation': 'show_regression',
         'vega_spec': new_spec,
-        'message': f'Added {method} regression line'
+        'method': method,
+        'coefficients': fit['coefficients'],
+        'equation': fit['equation'],
+        'r_squared': r2,
+        'data_points': fit['n'],
+        'selected_region': selected is not None,
+        'full_data': is_full,
+        'message': f'Added {method} regression line{equation_info}{r2_info} ({fit["n"]} points)'
+    }, point_spec, use_full_data, is_full)
+
+
+# 密度聚合：视图默认尺寸（与 Vega-Lite 默认连续轴尺寸一致）、单元格像素大小、点/聚合切换阈值
+DENSITY_DEFAULT_VIEW_SIZE = 200
+DENSITY_CELL_SIZE_PX = 10
+DENSITY_POINT_THRESHOLD = 5000
+DENSITY_MAX_BINS = 200
+
+
+def _view_size(vega_spec: Dict, key: str) -> int:
+    size = vega_spec.get(key)
+    return int(size) if isinstance(size, (int, float)) and size > 0 else DENSITY_DEFAULT_VIEW_SIZE
+
+
+def _axis_domain(encoding: Dict, channel: str, column: np.ndarray) -> Optional[Tuple[float, float]]:
+    """当前视图的轴范围：优先 scale.domain，否则取数据的有限值范围"""
+    domain = (encoding.get(channel, {}).get('scale') or {}).get('domain')
+    if isinstance(domain, (list, tuple)) and len(domain) == 2:
+        try:
+            return float(domain[0]), float(domain[1])
+        except (TypeError, ValueError):
+            pass
+    finite = column[np.isfinite(column)]
+    if len(finite) == 0:
+        return None
+    lo, hi = float(finite.min()), float(finite.max())
+    if lo == hi:
+        lo, hi = lo - 0.5, hi + 0.5
+    return lo, hi
+
+
+def _density_grid(values: List[Dict], key: str, x_field: str, y_field: str,
+                  x_domain: Tuple[float, float], y_domain: Tuple[float, float],
+                  x_bins: int, y_bins: int) -> Dict[str, Any]:
+    """
+    二维直方图（按 数据键 + 字段 + 范围 + 分辨率 缓存）
+    
+    Returns:
+        {'counts': (x_bins, y_bins) 计数矩阵, 'x_edges', 'y_edges', 'total': 范围内点数}
+    """
+    from .data_cache import numeric_column, get_or_compute
+    
+    def build():
+        xs = numeric_column(values, x_field, key)
+        ys = numeric_column(values, y_field, key)
+        mask = (np.isfinite(xs) & np.isfinite(ys)
+                & (xs >= x_domain[0]) & (xs <= x_domain[1])
+                & (ys >= y_domain[0]) & (ys <= y_domain[1]))
+        counts, x_edges, y_edges = np.histogram2d(
+            xs[mask], ys[mask], bins=[x_bins, y_bins], range=[list(x_domain), list(y_domain)]
+        )
+        counts = counts.astype(np.int64)
+        for arr in (counts, x_edges, y_edges):
+            arr.setflags(write=False)
+        return {'counts': counts, 'x_edges': x_edges, 'y_edges': y_edges, 'total': int(mask.sum())}
+    
+    return get_or_compute('density_grid', (key, x_field, y_field, tuple(x_domain), tuple(y_domain), x_bins, y_bins), build)
+
+
+def _density_bins(vega_spec: Dict, cell_size: int) -> Tuple[int, int]:
+    cell = max(1, int(cell_size or DENSITY_CELL_SIZE_PX))
+    x_bins = max(1, min(DENSITY_MAX_BINS, _view_size(vega_spec, 'width') // cell))
+    y_bins = max(1, min(DENSITY_MAX_BINS, _view_size(vega_spec, 'height') // cell))
+    return x_bins, y_bins
+
+
+def aggregate_density(vega_spec: Dict, mode: str = "auto", cell_size: int = DENSITY_CELL_SIZE_PX,
+                      density_threshold: int = DENSITY_POINT_THRESHOLD,
+                      use_full_data: bool = True) -> Dict[str, Any]:
+    """
+    散点图密度聚合（服务端二维直方图）
+    
+    在当前视图的轴范围和分辨率（width/height ÷ cell_size）上对数据（默认使用全量数据：
+    _metadata.full_data_path 的文件或会话登记的全量数据）做二维直方图，输出只含非空单元格的 rect 图层，
+    渲染开销与数据行数无关。原始点视图的 mark / encoding 保存在 spec._avs_density 中，
+    数据行以列式紧凑形式保存在其中（见 row_columns.pack_rows），不依赖进程内缓存，可随时切回。
+    
+    Args:
+        vega_spec: Vega-Lite规范
+        mode: auto（范围内点数超过 density_threshold 时聚合，否则显示原始点）| bins | points
+        cell_size: 单元格像素大小
+        density_threshold: auto 模式下的点数阈值
+        use_full_data: 是否在全量数据上聚合
+    """
+    from .data_cache import get_dataset, numeric_column
+    from .row_columns import pack_rows
+    
+    if mode not in ("auto", "bins", "points"):
+        return {'success': False, 'error': f'Unsupported mode: {mode}'}
+    
+    # 当前若已是聚合视图，先还原出原始点视图
+    point_spec = _point_view(vega_spec)
+    point_spec = copy.deepcopy(point_spec)
+    
+    encoding = point_spec.get('encoding', {})
+    x_field = encoding.get('x', {}).get('field')
+    y_field = encoding.get('y', {}).get('field')
+    if not x_field or not y_field:
+        return {'success': False, 'error': 'Cannot find required fields'}
+    
+    values, key, is_full = get_dataset(point_spec, use_full_data=use_full_data)
+    xs = numeric_column(values, x_field, key)
+    ys = numeric_column(values, y_field, key)
+    x_domain = _axis_domain(encoding, 'x', xs)
+    y_domain = _axis_domain(encoding, 'y', ys)
+    if x_domain is None or y_domain is None:
+        return {'success': False, 'error': 'No numeric data to aggregate'}
+    
+    x_bins, y_bins = _density_bins(point_spec, cell_size)
+    grid = _density_grid(values, key, x_field, y_field, x_domain, y_domain, x_bins, y_bins)
+    total = grid['total']
+    
+    if mode == "points" or (mode == "auto" and total <= density_threshold):
+        return _note_full_data({
+            'success': True,
+            'operation': 'aggregate_density',
+            'vega_spec': point_spec,
+            'mode': 'points',
+            'points_in_view': total,
+            'message': f'Showing raw points ({total} points in view, threshold {density_threshold})'
+        }, point_spec, use_full_data, is_full)
+    
+    counts = grid['counts']
+    x_edges = grid['x_edges']
+    y_edges = grid['y_edges']
+    ix, iy = np.nonzero(counts)
+    x_end_field = f'{x_field}_end'
+    y_end_field = f'{y_field}_end'
+    cells = [
+        {
+            x_field: float(x_edges[i]), x_end_field: float(x_edges[i + 1]),
+            y_field: float(y_edges[j]), y_end_field: float(y_edges[j + 1]),
+            'point_count': int(counts[i, j])
+        }
+        for i, j in zip(ix.tolist(), iy.tolist())
+    ]
+    
+    point_data = point_spec.get('data')
+    new_spec = copy.deepcopy({k: v for k, v in point_spec.items() if k != 'data'})
+    new_spec['_avs_density'] = {
+        'mark': point_spec.get('mark'),
+        'encoding': point_spec.get('encoding'),
+        'data': {k: v for k, v in point_data.items() if k != 'values'} if isinstance(point_data, dict) else point_data
+    }
+    if isinstance(point_data, dict) and isinstance(point_data.get('values'), list):
+        new_spec['_avs_density']['rows'] = pack_rows(point_data['values'])
+    new_spec['data'] = {'values': cells}
+    new_spec['mark'] = {'type': 'rect'}
+    x_enc = encoding.get('x', {})
+    y_enc = encoding.get('y', {})
+    new_spec['encoding'] = {
+        'x': {'field': x_field, 'type': 'quantitative', 'bin': 'binned',
+              'scale': {'domain': list(x_domain)}, 'title': x_enc.get('title', x_field)},
+        'x2': {'field': x_end_field},
+        'y': {'field': y_field, 'type': 'quantitative', 'bin': 'binned',
+              'scale': {'domain': list(y_domain)}, 'title': y_enc.get('title', y_field)},
+        'y2': {'field': y_end_field},
+        'color': {'field': 'point_count', 'type': 'quantitative',
+                  'scale': {'scheme': 'viridis'}, 'legend': {'title': 'Points'}},
+        'tooltip': [
+            {'field': x_field, 'type': 'quantitative'},
+            {'field': y_field, 'type': 'quantitative'},
+            {'field': 'point_count', 'type': 'quantitative', 'title': 'Points'}
+        ]
     }
+    
+    return _note_full_data({
+        'success': True,
+        'operation': 'aggregate_density',
+        'vega_spec': new_spec,
+        'mode': 'bins',
+        'points_in_view': total,
+        'grid': {'x_bins': x_bins, 'y_bins': y_bins, 'non_empty_cells': len(cells),
+                 'max_count': int(counts.max()) if counts.size else 0},
+        'full_data': is_full,
+        'message': (f'Aggregated {total} points into {len(cells)} cells '
+                    f'({x_bins}x{y_bins} grid{", full dataset" if is_full else ""})')
+    }, point_spec, use_full_data, is_full)
 
 
+def find_dense_regions(vega_spec: Dict, top_k: int = 3, grid_size: int = 20, window: int = 2,
+                       use_full_data: bool = True) -> Dict[str, Any]:
+    """
+    自动发现密集区域
+    
+    在当前视图范围上（默认使用全量数据）取 grid_size x grid_size 的二维直方图（缓存），
+    用 window x window 的滑动窗口求和，贪心选出互不重叠的 top_k 个最密集矩形，
+    返回可直接用于 zoom_dense_area / select_region / brush_region 的 x_range、y_range。
+    
+    Args:
+        vega_spec: Vega-Lite规范
+        top_k: 返回的区域个数
+        grid_size: 每个轴的网格数
+        window: 每个区域在每个轴上覆盖的网格数
+        use_full_data: 是否在全量数据上统计
+    """
+    from .data_cache import get_dataset, numeric_column
+    
+    point_spec = _point_view(vega_spec)
+    encoding = point_spec.get('encoding', {})
+    x_field = encoding.get('x', {}).get('field')
+    y_field = encoding.get('y', {}).get('field')
+    if not x_field or not y_field:
+        return {'success': False, 'error': 'Cannot find required fields'}
+    
+    grid_size = max(2, int(grid_size))
+    window = max(1, min(int(window), grid_size))
+    
+    values, key, is_full = get_dataset(point_spec, use_full_data=use_full_data)
+    xs = numeric_column(values, x_field, key)
+    ys = numeric_column(values, y_field, key)
+    x_domain = _axis_domain(encoding, 'x', xs)
+    y_domain = _axis_domain(encoding, 'y', ys)
+    if x_domain is None or y_domain is None:
+        return {'success': False, 'error': 'No numeric data to analyze'}
+    
+    grid = _density_grid(values, key, x_field, y_field, x_domain, y_domain, grid_size, grid_size)
+    counts = grid['counts']
+    total = grid['total']
+    if total == 0:
+        return {'success': False, 'error': 'No data points in current view'}
+    
+    # 滑动窗口求和（二维前缀和）
+    prefix = np.zeros((grid_size + 1, grid_size + 1), dtype=np.int64)
+    prefix[1:, 1:] = counts.cumsum(axis=0).cumsum(axis=1)
+    sums = (prefix[window:, window:] - prefix[:-window, window:]
+            - prefix[window:, :-window] + prefix[:-window, :-window])
+    
+    x_edges = grid['x_edges']
+    y_edges = grid['y_edges']
+    available = np.ones_like(sums, dtype=bool)
+    regions = []
+    for _ in range(max(0, int(top_k))):
+        candidates = np.where(available, sums, -1)
+        i, j = np.unravel_index(int(np.argmax(candidates)), candidates.shape)
+        count = int(candidates[i, j])
+        if count <= 0:
+            break
+        x_range = [float(x_edges[i]), float(x_edges[i + window])]
+        y_range = [float(y_edges[j]), float(y_edges[j + window])]
+        area = (x_range[1] - x_range[0]) * (y_range[1] - y_range[0])
+        regions.append({
+            'rank': len(regions) + 1,
+            'x_range': x_range,
+            'y_range': y_range,
+            'count': count,
+            'share': round(count / total, 4),
+            'density': count / area if area > 0 else None
+        })
+        # 排除与已选区域重叠的窗口
+        available[max(0, i - window + 1):i + window, max(0, j - window + 1):j + window] = False
+    
+    summary = '; '.join(
+        f"#{r['rank']} x[{r['x_range'][0]:.3g}, {r['x_range'][1]:.3g}] "
+        f"y[{r['y_range'][0]:.3g}, {r['y_range'][1]:.3g}]: {r['count']} pts ({r['share']:.1%})"
+        for r in regions
+    )
+    return _note_full_data({
+        'success': True,
+        'operation': 'find_dense_regions',
+        'regions': regions,
+        'points_in_view': total,
+        'grid': {'size': grid_size, 'window': window},
+        'full_data': is_full,
+        'message': f'Found {len(regions)} dense regions over {total} points: {summary}'
+    }, point_spec, use_full_data, is_full)
+
 
 def _infer_field_type(data: List[Dict], field: str) -> str:
     """推断字段的 Vega-Lite 类型"""
@@ -513,4 +1143,6 @@ __all__ = [
     'brush_region',
     'change_encoding',
     'show_regression',
+    'aggregate_density',
+    'find_dense_regions',
 ]
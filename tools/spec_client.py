@@ -0,0 +1,115 @@
+"""
+Spec 客户端（有状态 MCP 模式的调用端，供各 benchmark 脚本共用）
+
+一次对话只 register_spec 一次，之后每次工具调用走 call_tool_by_spec_id，
+只传 spec_id 与工具参数；服务端返回 spec_id + spec_delta，由本地 spec 应用 delta 重建新视图，
+delta 无法应用时再用 get_spec 拉取完整 spec。服务端不支持注册时退回每次发送完整 vega_spec。
+"""
+
+from typing import Dict, Any, Optional
+import json
+
+
+# 客户端驱动的协议工具（不暴露给模型）
+SPEC_PROTOCOL_TOOLS = ('register_spec', 'get_spec', 'release_spec', 'call_tool_by_spec_id')
+
+
+def parse_mcp_result(mcp_result) -> Dict[str, Any]:
+    """解析 MCP 工具结果中的 JSON 文本内容"""
+    tool_result: Dict[str, Any] = {}
+    for content_item in getattr(mcp_result, 'content', None) or []:
+        if content_item.type == 'text':
+            try:
+                tool_result = json.loads(content_item.text)
+            except json.JSONDecodeError:
+                tool_result = {'success': False, 'message': content_item.text}
+    return tool_result
+
+
+class SpecClient:
+    """单个对话的 spec 句柄：持有当前 spec 与其 spec_id，按 spec_id 调用工具"""
+
+    def __init__(self, mcp_session, vega_spec: Dict[str, Any]):
+        self.session = mcp_session
+        self.spec = vega_spec
+        self.spec_id: Optional[str] = None
+
+    async def register(self) -> Optional[str]:
+        """把当前 spec 注册到服务端；失败时 spec_id 为 None（之后退回发送完整 spec）"""
+        try:
+            result = parse_mcp_result(
+                await self.session.call_tool(name='register_spec', arguments={'vega_spec': self.spec})
+            )
+        except Exception:
+            result = {}
+        self.spec_id = result.get('spec_id') if result.get('success') else None
+        return self.spec_id
+
+    async def call_tool(self, tool_name: str, tool_args: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        调用图表工具
+
+        视图变化时结果中带有重建后的完整 'vega_spec'（与直接调用工具的结果格式一致），
+        并同步更新 self.spec / self.spec_id
+        """
+        tool_args = {k: v for k, v in (tool_args or {}).items() if k != 'vega_spec'}
+        if self.spec_id is None:
+            result = parse_mcp_result(
+                await self.session.call_tool(name=tool_name, arguments={**tool_args, 'vega_spec': self.spec})
+            )
+            if result.get('success') and 'vega_spec' in result:
+                self.spec = result['vega_spec']
+            return result
+
+        result = await self._call_by_id(tool_name, tool_args)
+        if not result.get('success') and str(result.get('error', '')).startswith('Unknown spec_id'):
+            # 服务端已丢弃该 spec（重启或被淘汰）：重新注册后重试一次
+            if await self.register() is None:
+                return await self.call_tool(tool_name, tool_args)
+            result = await self._call_by_id(tool_name, tool_args)
+
+        new_id = result.get('spec_id')
+        if result.get('success') and new_id:
+            if new_id != self.spec_id:
+                self.spec = await self._resolve_spec(result)
+                result['vega_spec'] = self.spec
+            self.spec_id = new_id
+        return result
+
+    async def release(self) -> None:
+        """释放服务端保存的当前 spec"""
+        if self.spec_id is None:
+            return
+        try:
+            await self.session.call_tool(name='release_spec', arguments={'spec_id': self.spec_id})
+        except Exception:
+            pass
+        self.spec_id = None
+
+    async def _call_by_id(self, tool_name: str, tool_args: Dict[str, Any]) -> Dict[str, Any]:
+        return parse_mcp_result(await self.session.call_tool(
+            name='call_tool_by_spec_id',
+            arguments={'tool_name': tool_name, 'spec_id': self.spec_id, 'arguments': tool_args}
+        ))
+
+    async def _resolve_spec(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """把 spec_delta 应用到本地 spec；无法应用时用 get_spec 拉取完整 spec"""
+        from .spec_store import apply_spec_delta
+
+        delta = result.get('spec_delta')
+        if delta is not None:
+            try:
+                return apply_spec_delta(self.spec, delta)
+            except (KeyError, IndexError, TypeError):
+                pass
+        spec_result = parse_mcp_result(
+            await self.session.call_tool(name='get_spec', arguments={'spec_id': result['spec_id']})
+        )
+        return spec_result.get('vega_spec', self.spec)
+
+
+__all__ = [
+    'SPEC_PROTOCOL_TOOLS',
+    'parse_mcp_result',
+    'SpecClient',
+]
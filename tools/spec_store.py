@@ -0,0 +1,131 @@
+"""
+Spec 存储（有状态 MCP 模式）
+
+Spec 只注册一次，之后以 spec_id 引用；工具执行后保存新版本并返回新的 spec_id
+与一个小的增量（delta），客户端仅在需要渲染时再拉取完整 spec。
+"""
+
+from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+import copy
+import threading
+import uuid
+
+from config.settings import Settings
+
+
+def _escape_pointer(key: str) -> str:
+    """JSON Pointer 转义（RFC 6901）"""
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape_pointer(token: str) -> str:
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def compute_spec_delta(old: Any, new: Any, path: str = '') -> List[Dict[str, Any]]:
+    """
+    计算两个 spec 之间的增量（JSON-Patch 风格的 add/remove/replace 操作列表）。
+
+    只对 dict 递归比较；列表或标量发生变化时整体 replace，
+    因此 data.values 未变化时不会出现在 delta 中。
+    """
+    if old is new:
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops: List[Dict[str, Any]] = []
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': f'{path}/{_escape_pointer(key)}'})
+        for key, value in new.items():
+            sub_path = f'{path}/{_escape_pointer(key)}'
+            if key not in old:
+                ops.append({'op': 'add', 'path': sub_path, 'value': value})
+            else:
+                ops.extend(compute_spec_delta(old[key], value, sub_path))
+        return ops
+    if old == new:
+        return []
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+def apply_spec_delta(spec: Dict[str, Any], delta: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """将 compute_spec_delta 生成的增量应用到 spec 副本上"""
+    result = copy.deepcopy(spec)
+    for op in delta:
+        tokens = [_unescape_pointer(t) for t in op['path'].split('/')[1:]]
+        if not tokens:
+            result = copy.deepcopy(op.get('value'))
+            continue
+        parent = result
+        for token in tokens[:-1]:
+            parent = parent[token]
+        if op['op'] == 'remove':
+            parent.pop(tokens[-1], None)
+        else:
+            parent[tokens[-1]] = copy.deepcopy(op.get('value'))
+    return result
+
+
+class SpecStore:
+    """带容量上限的 spec 存储（LRU 淘汰）"""
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or Settings.SPEC_STORE_MAX_ENTRIES
+        self._specs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._parents: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, vega_spec: Dict[str, Any], parent_id: Optional[str] = None) -> str:
+        """保存一个 spec，返回新的 spec_id"""
+        spec_id = f"spec_{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            self._specs[spec_id] = vega_spec
+            self._parents[spec_id] = parent_id
+            while len(self._specs) > self.max_entries:
+                evicted, _ = self._specs.popitem(last=False)
+                self._parents.pop(evicted, None)
+        return spec_id
+
+    def get(self, spec_id: str) -> Optional[Dict[str, Any]]:
+        """按 spec_id 获取 spec（返回存储中的对象，调用方不应原地修改）"""
+        with self._lock:
+            spec = self._specs.get(spec_id)
+            if spec is not None:
+                self._specs.move_to_end(spec_id)
+            return spec
+
+    def get_parent(self, spec_id: str) -> Optional[str]:
+        return self._parents.get(spec_id)
+
+    def release(self, spec_id: str) -> bool:
+        """删除一个 spec"""
+        with self._lock:
+            self._parents.pop(spec_id, None)
+            return self._specs.pop(spec_id, None) is not None
+
+    def __contains__(self, spec_id: str) -> bool:
+        return spec_id in self._specs
+
+    def __len__(self) -> int:
+        return len(self._specs)
+
+
+# 全局 spec 存储（单例）
+_spec_store = None
+
+
+def get_spec_store() -> SpecStore:
+    """获取 spec 存储单例"""
+    global _spec_store
+    if _spec_store is None:
+        _spec_store = SpecStore()
+    return _spec_store
+
+
+__all__ = [
+    'SpecStore',
+    'get_spec_store',
+    'compute_spec_delta',
+    'apply_spec_delta',
+]
@@ -0,0 +1,149 @@
+"""
+时间汇总立方体（折线图下钻 / 重采样的预聚合缓存）
+
+每个数据集（按 数据键 + 时间字段 + 数值字段 + 分组字段）只构建一次：
+时间列转为 datetime64，按 year / quarter / month / week / day 截断后，
+对每个 (时间段, 序列) 计算 sum / mean / min / max / count / median。
+下钻、重采样直接换入这些小的预聚合 data.values，渲染器无需再聚合原始行。
+"""
+
+from typing import Dict, Any, List, Optional
+import threading
+
+import numpy as np
+
+
+GRANULARITIES = ('year', 'quarter', 'month', 'week', 'day')
+AGGREGATES = ('sum', 'mean', 'min', 'max', 'count', 'median')
+
+# Vega-Lite timeUnit -> 粒度
+TIMEUNIT_GRANULARITY = {
+    'year': 'year',
+    'yearquarter': 'quarter',
+    'yearmonth': 'month',
+    'yearweek': 'week',
+    'yearmonthdate': 'day',
+}
+
+
+def _period_start(ms: np.ndarray, granularity: str) -> np.ndarray:
+    """将 Unix 毫秒截断到时间段起点（datetime64[D]）"""
+    days = (ms // 86400000).astype(np.int64)
+    if granularity == 'day':
+        return days.astype('datetime64[D]')
+    if granularity == 'week':
+        # 与 Vega 一致，一周从周日开始（1970-01-01 为周四）
+        return (days - (days + 4) % 7).astype('datetime64[D]')
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    if granularity == 'quarter':
+        months = months - months % 3
+    elif granularity == 'year':
+        months = months - months % 12
+    return months.astype('datetime64[M]').astype('datetime64[D]')
+
+
+class TimeRollupCube:
+    """单个数据集的时间汇总立方体（各粒度按需构建后缓存）"""
+
+    def __init__(self, times_ms: np.ndarray, values: np.ndarray, codes: np.ndarray, labels: List[Any]):
+        valid = np.isfinite(times_ms) & np.isfinite(values)
+        self._times = times_ms[valid].astype(np.int64)
+        self._values = values[valid]
+        self._codes = codes[valid]
+        self.labels = labels
+        self._levels: Dict[str, Dict[str, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def level(self, granularity: str) -> Dict[str, np.ndarray]:
+        """某一粒度的汇总：{'period', 'code', 'sum', 'mean', 'min', 'max', 'count', 'median'}（按时间段、序列排序）"""
+        with self._lock:
+            cached = self._levels.get(granularity)
+            if cached is None:
+                cached = self._levels[granularity] = self._build(granularity)
+            return cached
+
+    def _build(self, granularity: str) -> Dict[str, np.ndarray]:
+        periods = _period_start(self._times, granularity)
+        period_ids = periods.astype(np.int64)
+        order = np.lexsort((self._values, self._codes, period_ids))
+        p_sorted = period_ids[order]
+        c_sorted = self._codes[order]
+        v_sorted = self._values[order]
+        if len(order) == 0:
+            empty = np.array([], dtype=np.float64)
+            return {'period': np.array([], dtype='datetime64[D]'), 'code': np.array([], dtype=np.int64),
+                    **{agg: empty for agg in AGGREGATES}}
+
+        starts = np.flatnonzero(np.concatenate((
+            [True], (p_sorted[1:] != p_sorted[:-1]) | (c_sorted[1:] != c_sorted[:-1])
+        )))
+        counts = np.diff(np.concatenate((starts, [len(order)])))
+        sums = np.add.reduceat(v_sorted, starts)
+        # 组内已按数值升序：首个为最小值，末个为最大值
+        ends = starts + counts - 1
+        mid_lo = starts + (counts - 1) // 2
+        mid_hi = starts + counts // 2
+        return {
+            'period': p_sorted[starts].astype('datetime64[D]'),
+            'code': c_sorted[starts],
+            'sum': sums,
+            'mean': sums / counts,
+            'min': v_sorted[starts],
+            'max': v_sorted[ends],
+            'count': counts.astype(np.float64),
+            'median': (v_sorted[mid_lo] + v_sorted[mid_hi]) / 2,
+        }
+
+    def rows(self, granularity: str, agg: str, time_as: str, value_as: str, group_field: Optional[str],
+             start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        生成预聚合的 data.values
+
+        Args:
+            granularity: year | quarter | month | week | day
+            agg: sum | mean | min | max | count | median
+            time_as: 时间段起点的输出字段名（ISO 日期字符串）
+            value_as: 聚合值的输出字段名
+            group_field: 分组字段名（None 表示单序列）
+            start, end: 可选的时间段起点范围 [start, end)（ISO 日期）
+        """
+        level = self.level(granularity)
+        mask = np.ones(len(level['period']), dtype=bool)
+        if start is not None:
+            mask &= level['period'] >= np.datetime64(start, 'D')
+        if end is not None:
+            mask &= level['period'] < np.datetime64(end, 'D')
+        periods = np.datetime_as_string(level['period'][mask], unit='D').tolist()
+        codes = level['code'][mask].tolist()
+        vals = level[agg][mask].tolist()
+        if agg == 'count':
+            vals = [int(v) for v in vals]
+        if group_field:
+            return [{time_as: p, group_field: self.labels[c], value_as: v} for p, c, v in zip(periods, codes, vals)]
+        return [{time_as: p, value_as: v} for p, v in zip(periods, vals)]
+
+
+def get_time_cube(values: List[Dict[str, Any]], key: str, time_field: str, value_field: str,
+                  group_field: Optional[str] = None) -> Optional[TimeRollupCube]:
+    """获取（或构建）数据集的时间汇总立方体；时间或数值字段无有效值时返回 None"""
+    from .data_cache import time_column, numeric_column, category_codes, get_or_compute
+
+    def build():
+        times = time_column(values, time_field, key)
+        nums = numeric_column(values, value_field, key)
+        if not np.any(np.isfinite(times) & np.isfinite(nums)):
+            return False
+        codes, labels = category_codes(values, group_field, key)
+        return TimeRollupCube(times, nums, codes, labels)
+
+    cube = get_or_compute('time_cube', (key, time_field, value_field, group_field), build)
+    return cube or None
+
+
+__all__ = [
+    'GRANULARITIES',
+    'AGGREGATES',
+    'TIMEUNIT_GRANULARITY',
+    'TimeRollupCube',
+    'get_time_cube',
+]
@@ -2,9 +2,37 @@
 工具执行器（简化版）
 """
 
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import copy
+import threading
+import time
 import traceback
+from config.settings import Settings
 from .tool_registry import tool_registry
+from .result_cache import get_tool_result_cache, make_cache_key
+from .execution_policy import run_with_policy, ToolTimeoutError
+from .tool_metrics import ToolMetrics
+
+
+class _SharedRows(list):
+    """流水线内共享的数据行列表：deepcopy 时返回自身，避免每一步都复制整份数据"""
+    
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _map_data_values(spec: Dict[str, Any], wrap) -> None:
+    """对 spec 中的 data.values（Vega-Lite）或各数据源的 values（Vega）原地应用 wrap"""
+    if not isinstance(spec, dict):
+        return
+    data = spec.get('data')
+    sources = data if isinstance(data, list) else [data]
+    for source in sources:
+        if isinstance(source, dict) and isinstance(source.get('values'), list):
+            source['values'] = wrap(source['values'])
 
 
 class ToolExecutor:
@@ -12,9 +40,14 @@ class ToolExecutor:
     
     def __init__(self):
         self.registry = tool_registry
-        self.execution_history: List[Dict[str, Any]] = []
+        # 固定大小的环形缓冲区，超出后自动丢弃最旧记录
+        self.execution_history: deque = deque(maxlen=Settings.TOOL_HISTORY_SIZE)
+        self._history_lock = threading.Lock()
+        self.result_cache = get_tool_result_cache()
+        self.metrics = ToolMetrics()
     
-    def execute(self, tool_name: str, params: Dict[str, Any], validate: bool = True) -> Dict[str, Any]:
+    def execute(self, tool_name: str, params: Dict[str, Any], validate: bool = True,
+                use_cache: bool = True) -> Dict[str, Any]:
         """
         执行工具
         
@@ -22,10 +55,12 @@ class ToolExecutor:
             tool_name: 工具名称
             params: 参数字典（必须包含 vega_spec）
             validate: 是否验证参数
+            use_cache: 是否使用结果缓存（仅对 cacheable 工具生效）
             
         Returns:
             执行结果（包含 vega_spec 如果工具修改了它）
         """
+        started = time.perf_counter()
         tool_info = self.registry.get_tool(tool_name)
         
         if not tool_info:
@@ -48,16 +83,48 @@ class ToolExecutor:
         # 填充默认参数
         params = self._fill_default_params(tool_info, params)
         
+        # 可缓存的纯分析工具：按 (工具名, 参数, spec 哈希) 查缓存
+        cache_key = None
+        if use_cache and tool_info.get('cacheable') and Settings.TOOL_CACHE_ENABLED:
+            try:
+                cache_key = make_cache_key(tool_name, params)
+            except (TypeError, ValueError):
+                cache_key = None
+            if cache_key:
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    self._record_execution(tool_name, params, cached, success=True, started=started, cached=True)
+                    return cached
+        
         # 执行工具
         try:
             tool_function = tool_info['function']
-            result = tool_function(**params)
+            result = run_with_policy(
+                tool_function,
+                params,
+                policy=tool_info.get('execution', Settings.TOOL_DEFAULT_EXECUTION_POLICY),
+                timeout=tool_info.get('timeout')
+            )
+            
+            if cache_key and isinstance(result, dict) and result.get('success'):
+                self.result_cache.set(cache_key, result)
             
             # 记录执行历史
-            self._record_execution(tool_name, params, result, success=True)
+            self._record_execution(tool_name, params, result, success=True, started=started)
             
             return result
             
+        except ToolTimeoutError as e:
+            error_result = {
+                'success': False,
+                'error': f'Tool "{tool_name}" {e}',
+                'timeout': True
+            }
+            
+            self._record_execution(tool_name, params, error_result, success=False, started=started)
+            
+            return error_result
+            
         except Exception as e:
             error_result = {
                 'success': False,
@@ -65,7 +132,7 @@ class ToolExecutor:
                 'traceback': traceback.format_exc()
             }
             
-            self._record_execution(tool_name, params, error_result, success=False)
+            self._record_execution(tool_name, params, error_result, success=False, started=started)
             
             return error_result
     
@@ -99,10 +166,14 @@ class ToolExecutor:
         return filled_params
     
     def _record_execution(self, tool_name: str, params: Dict[str, Any], 
-                         result: Dict[str, Any], success: bool):
-        """记录执行历史"""
+                         result: Dict[str, Any], success: bool,
+                         started: Optional[float] = None, cached: bool = False):
+        """记录执行历史，并更新该工具的聚合指标"""
         from datetime import datetime
         
+        duration_ms = (time.perf_counter() - started) * 1000 if started is not None else 0.0
+        self.metrics.record(tool_name, duration_ms, params, result, success=success, cached=cached)
+        
         # 不记录 vega_spec 以节省内存
         params_for_log = {k: v for k, v in params.items() if k != 'vega_spec'}
         result_for_log = {k: v for k, v in result.items() if k != 'vega_spec'}
@@ -112,44 +183,175 @@ class ToolExecutor:
             'tool_name': tool_name,
             'params': params_for_log,
             'result': result_for_log,
-            'success': success
+            'success': success,
+            'duration_ms': round(duration_ms, 3),
+            'cached': cached
         }
         
-        self.execution_history.append(record)
-        
-        # 限制历史记录数量
-        if len(self.execution_history) > 100:
-            self.execution_history = self.execution_history[-100:]
+        with self._history_lock:
+            self.execution_history.append(record)
     
-    def execute_batch(self, tool_calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """批量执行工具"""
-        results = []
+    def execute_batch(self, tool_calls: List[Dict[str, Any]], parallel: bool = True,
+                      max_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        批量执行工具
+        
+        只读工具（感知类 / read_only 分析类）提交到线程池并发执行，
+        修改 spec 的工具在当前线程按提交顺序依次执行（与线程池中的只读调用并行）。
+        结果按提交顺序返回，每个结果附带 execution_time_ms。
         
-        for tool_call in tool_calls:
+        Args:
+            tool_calls: [{'tool': 工具名, 'params': 参数字典}, ...]
+            parallel: 是否并发执行只读工具
+            max_workers: 线程池大小（默认 Settings.TOOL_BATCH_MAX_WORKERS）
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(tool_calls)
+        read_only_calls = []
+        ordered_calls = []
+        
+        for index, tool_call in enumerate(tool_calls):
             tool_name = tool_call.get('tool')
-            params = tool_call.get('params', {})
+            if not tool_name:
+                results[index] = {'success': False, 'error': 'Tool name not specified', 'execution_time_ms': 0.0}
+                continue
+            if parallel and self.registry.is_read_only(tool_name):
+                read_only_calls.append((index, tool_call))
+            else:
+                ordered_calls.append((index, tool_call))
+        
+        if len(read_only_calls) <= 1:
+            # 没有可并发的调用，按原顺序串行执行
+            ordered_calls = sorted(read_only_calls + ordered_calls, key=lambda item: item[0])
+            read_only_calls = []
+        
+        if read_only_calls:
+            workers = max(1, min(max_workers or Settings.TOOL_BATCH_MAX_WORKERS, len(read_only_calls)))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tool-batch') as pool:
+                futures = [
+                    (index, pool.submit(self._execute_timed, tool_call))
+                    for index, tool_call in read_only_calls
+                ]
+                for index, tool_call in ordered_calls:
+                    results[index] = self._execute_timed(tool_call)
+                for index, future in futures:
+                    results[index] = future.result()
+        else:
+            for index, tool_call in ordered_calls:
+                results[index] = self._execute_timed(tool_call)
+        
+        return results
+    
+    def execute_pipeline(self, vega_spec: Dict[str, Any], steps: List[Dict[str, Any]],
+                         render: bool = True, stop_on_error: bool = True) -> Dict[str, Any]:
+        """
+        流水线执行：按顺序对同一份工作副本应用多个修改 spec 的工具，只渲染最终结果
+        
+        输入 spec 只深拷贝一次；流水线内数据行在各步骤之间共享（工具内部的 deepcopy
+        不再复制整份数据），每一步的输出 spec 作为下一步的输入。
+        
+        Args:
+            vega_spec: 初始 spec（不会被修改）
+            steps: [{'tool': 工具名, 'params': 参数字典（无需 vega_spec）}, ...]
+            render: 是否渲染最终 spec
+            stop_on_error: 某一步失败时是否停止（否则跳过该步继续）
             
+        Returns:
+            {'success', 'operation', 'vega_spec', 'steps': 每步结果（不含 vega_spec）, 'message', ...}
+        """
+        working_spec = copy.deepcopy(vega_spec)
+        _map_data_values(working_spec, _SharedRows)
+        step_results = []
+        all_succeeded = True
+        
+        for index, step in enumerate(steps):
+            tool_name = step.get('tool')
             if not tool_name:
-                results.append({'success': False, 'error': 'Tool name not specified'})
+                step_results.append({'step': index, 'tool': None, 'success': False,
+                                     'error': 'Tool name not specified', 'execution_time_ms': 0.0})
+                all_succeeded = False
+                if stop_on_error:
+                    break
                 continue
             
-            result = self.execute(tool_name, params)
-            results.append(result)
+            params = dict(step.get('params', {}))
+            params['vega_spec'] = working_spec
+            
+            start = time.perf_counter()
+            # 共享的数据行会被后续步骤修改，不能写入结果缓存
+            result = self.execute(tool_name, params, use_cache=False)
+            step_record = {k: v for k, v in result.items() if k != 'vega_spec'}
+            step_record.update({
+                'step': index,
+                'tool': tool_name,
+                'execution_time_ms': round((time.perf_counter() - start) * 1000, 3)
+            })
+            step_results.append(step_record)
+            
+            if result.get('success'):
+                if isinstance(result.get('vega_spec'), dict):
+                    working_spec = result['vega_spec']
+                    _map_data_values(working_spec, _SharedRows)
+            else:
+                all_succeeded = False
+                if stop_on_error:
+                    break
         
-        return results
+        _map_data_values(working_spec, list)
+        
+        messages = [
+            f"{r['tool']}: {r.get('message') or r.get('error', '')}" for r in step_results
+        ]
+        output = {
+            'success': all_succeeded,
+            'operation': 'pipeline',
+            'vega_spec': working_spec,
+            'steps': step_results,
+            'message': '; '.join(messages)
+        }
+        
+        if render:
+            from .common import render_chart
+            render_result = render_chart(working_spec)
+            output['render'] = render_result
+            if render_result.get('success'):
+                output['image_base64'] = render_result.get('image_base64')
+        
+        return output
+    
+    def _execute_timed(self, tool_call: Dict[str, Any]) -> Dict[str, Any]:
+        """执行单个批量调用并记录耗时（返回结果的浅拷贝，避免修改工具返回的对象）"""
+        start = time.perf_counter()
+        result = self.execute(tool_call.get('tool'), tool_call.get('params', {}))
+        result = dict(result)
+        result['execution_time_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        return result
     
     def get_execution_history(self, limit: int = 10, tool_name: str = None) -> List[Dict[str, Any]]:
         """获取执行历史"""
-        history = self.execution_history
+        with self._history_lock:
+            history = list(self.execution_history)
         
         if tool_name:
             history = [r for r in history if r['tool_name'] == tool_name]
         
         return history[-limit:]
     
+    def get_metrics(self, tool_name: str = None) -> Dict[str, Any]:
+        """获取按工具聚合的执行指标（调用/错误次数、延迟分位数、spec 字节数、数据行数）"""
+        return self.metrics.get(tool_name)
+    
+    def export_metrics(self, path: Optional[Path] = None) -> str:
+        """将执行指标导出为 JSON（可选写入文件）"""
+        return self.metrics.export_json(path)
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取结果缓存的命中/未命中统计"""
+        return self.result_cache.stats()
+    
     def clear_history(self):
         """清空执行历史"""
-        self.execution_history = []
+        with self._history_lock:
+            self.execution_history.clear()
 
 
 _tool_executor = None
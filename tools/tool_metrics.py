@@ -0,0 +1,164 @@
+"""
+工具执行指标
+
+按工具聚合调用次数、错误/超时次数、缓存命中、延迟直方图（p50/p95/p99）、
+spec 输入/输出字节数（需开启 TOOL_METRICS_MEASURE_PAYLOAD）以及涉及的数据行数，可在 Python 中查询或导出为 JSON。
+"""
+
+from typing import Dict, Any, Optional
+from collections import deque
+from pathlib import Path
+import json
+import threading
+
+from config.settings import Settings
+
+
+# 延迟直方图桶上界（毫秒），最后一个桶为 +inf
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+def spec_num_bytes(vega_spec: Any) -> int:
+    """spec 序列化为 JSON 后的字节数"""
+    if vega_spec is None:
+        return 0
+    try:
+        return len(json.dumps(vega_spec, default=str, ensure_ascii=False).encode('utf-8'))
+    except (TypeError, ValueError):
+        return 0
+
+
+def spec_num_rows(vega_spec: Any) -> int:
+    """spec 内联数据的行数（Vega-Lite data.values，或 Vega data 数组中所有 values）"""
+    if not isinstance(vega_spec, dict):
+        return 0
+    data = vega_spec.get('data')
+    if isinstance(data, dict):
+        values = data.get('values')
+        return len(values) if isinstance(values, list) else 0
+    if isinstance(data, list):
+        return sum(len(d.get('values') or []) for d in data if isinstance(d, dict))
+    return 0
+
+
+def _percentile(sorted_values, q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return round(sorted_values[index], 3)
+
+
+class _ToolStats:
+    """单个工具的聚合指标"""
+
+    def __init__(self, sample_size: int):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cache_hits = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.recent_ms = deque(maxlen=sample_size)
+        self.spec_bytes_in = 0
+        self.spec_bytes_out = 0
+        self.rows_touched = 0
+
+    def add(self, duration_ms: float, success: bool, timeout: bool, cached: bool,
+            bytes_in: int, bytes_out: int, rows: int):
+        self.calls += 1
+        if not success:
+            self.errors += 1
+        if timeout:
+            self.timeouts += 1
+        if cached:
+            self.cache_hits += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        bucket = len(LATENCY_BUCKETS_MS)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if duration_ms <= bound:
+                bucket = i
+                break
+        self.bucket_counts[bucket] += 1
+        self.recent_ms.append(duration_ms)
+        self.spec_bytes_in += bytes_in
+        self.spec_bytes_out += bytes_out
+        self.rows_touched += rows
+
+    def to_dict(self) -> Dict[str, Any]:
+        recent = sorted(self.recent_ms)
+        labels = [f'<={b}ms' for b in LATENCY_BUCKETS_MS] + [f'>{LATENCY_BUCKETS_MS[-1]}ms']
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'cache_hits': self.cache_hits,
+            'latency_ms': {
+                'mean': round(self.total_ms / self.calls, 3) if self.calls else None,
+                'max': round(self.max_ms, 3),
+                'p50': _percentile(recent, 0.50),
+                'p95': _percentile(recent, 0.95),
+                'p99': _percentile(recent, 0.99),
+                'total': round(self.total_ms, 3),
+            },
+            'latency_histogram': dict(zip(labels, self.bucket_counts)),
+            'spec_bytes_in': self.spec_bytes_in,
+            'spec_bytes_out': self.spec_bytes_out,
+            'rows_touched': self.rows_touched,
+        }
+
+
+class ToolMetrics:
+    """所有工具的执行指标（线程安全）"""
+
+    def __init__(self, sample_size: Optional[int] = None, measure_payload: Optional[bool] = None):
+        self.sample_size = sample_size or Settings.TOOL_METRICS_SAMPLE_SIZE
+        self.measure_payload = Settings.TOOL_METRICS_MEASURE_PAYLOAD if measure_payload is None else measure_payload
+        self._stats: Dict[str, _ToolStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, tool_name: str, duration_ms: float, params: Dict[str, Any], result: Dict[str, Any],
+               success: bool, cached: bool = False):
+        """记录一次工具调用"""
+        spec_in = params.get('vega_spec')
+        spec_out = result.get('vega_spec') if isinstance(result, dict) else None
+        bytes_in = spec_num_bytes(spec_in) if self.measure_payload else 0
+        bytes_out = spec_num_bytes(spec_out) if self.measure_payload else 0
+        rows = spec_num_rows(spec_in)
+        timeout = bool(result.get('timeout')) if isinstance(result, dict) else False
+
+        with self._lock:
+            stats = self._stats.get(tool_name)
+            if stats is None:
+                stats = self._stats[tool_name] = _ToolStats(self.sample_size)
+            stats.add(duration_ms, success, timeout, cached, bytes_in, bytes_out, rows)
+
+    def get(self, tool_name: Optional[str] = None) -> Dict[str, Any]:
+        """查询指标：指定工具返回该工具的指标，否则返回 {工具名: 指标}"""
+        with self._lock:
+            if tool_name is not None:
+                stats = self._stats.get(tool_name)
+                return stats.to_dict() if stats else {}
+            return {name: stats.to_dict() for name, stats in self._stats.items()}
+
+    def export_json(self, path: Optional[Path] = None) -> str:
+        """导出为 JSON 字符串（可选写入文件）"""
+        text = json.dumps(self.get(), ensure_ascii=False, indent=2)
+        if path is not None:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(text, encoding='utf-8')
+        return text
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+__all__ = [
+    'ToolMetrics',
+    'LATENCY_BUCKETS_MS',
+    'spec_num_bytes',
+    'spec_num_rows',
+]
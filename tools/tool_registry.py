@@ -2,16 +2,64 @@
 工具注册器（简化版 - 使用 vega_spec 而非 view_id）
 """
 
-from typing import Dict, List, Callable, Any
+from typing import Dict, List, Callable, Any, Optional
+import importlib
 from config.chart_types import ChartType
 
-from . import common
-from . import bar_chart_tools
-from . import line_chart_tools
-from . import scatter_plot_tools
-from . import parallel_coordinates_tools
-from . import heatmap_tools
-from . import sankey_tools
+
+class _LazyToolFunction:
+    """
+    工具函数描述符：注册时只记录 (模块名, 函数名)，首次调用时才导入工具模块
+    （及其 numpy/pandas/sklearn/scipy 等重依赖）。可被 pickle，供进程池执行策略使用。
+    """
+    
+    __slots__ = ('module_name', 'func_name', '_func')
+    
+    def __init__(self, module_name: str, func_name: str):
+        self.module_name = module_name
+        self.func_name = func_name
+        self._func: Optional[Callable] = None
+    
+    def resolve(self) -> Callable:
+        """导入并返回真实的工具函数"""
+        if self._func is None:
+            module = importlib.import_module(f'{__package__}.{self.module_name}')
+            self._func = getattr(module, self.func_name)
+        return self._func
+    
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+    
+    def __reduce__(self):
+        return (_LazyToolFunction, (self.module_name, self.func_name))
+    
+    @property
+    def __name__(self) -> str:
+        return self.func_name
+    
+    def __repr__(self) -> str:
+        return f'<lazy tool {self.module_name}.{self.func_name}>'
+
+
+class _LazyToolModule:
+    """工具模块占位：属性访问返回 _LazyToolFunction，不触发导入"""
+    
+    def __init__(self, module_name: str):
+        self._module_name = module_name
+    
+    def __getattr__(self, func_name: str) -> _LazyToolFunction:
+        if func_name.startswith('__'):
+            raise AttributeError(func_name)
+        return _LazyToolFunction(self._module_name, func_name)
+
+
+common = _LazyToolModule('common')
+bar_chart_tools = _LazyToolModule('bar_chart_tools')
+line_chart_tools = _LazyToolModule('line_chart_tools')
+scatter_plot_tools = _LazyToolModule('scatter_plot_tools')
+parallel_coordinates_tools = _LazyToolModule('parallel_coordinates_tools')
+heatmap_tools = _LazyToolModule('heatmap_tools')
+sankey_tools = _LazyToolModule('sankey_tools')
 
 
 class ToolRegistry:
@@ -29,6 +77,7 @@ class ToolRegistry:
         common_tools = {
             'get_view_spec': {
                 'function': common.get_view_spec,
+                'execution': 'inline',
                 'category': 'perception',
                 'description': '返回当前视图的结构化状态（encoding, domain, transforms, selections等）',
                 'params': {
@@ -47,6 +96,7 @@ class ToolRegistry:
             'get_data_summary': {
                 'function': common.get_data_summary,
                 'category': 'perception',
+                'cacheable': True,
                 'description': '获取数据统计摘要',
                 'params': {
                     'vega_spec': {'type': 'dict', 'required': True},
@@ -64,14 +114,16 @@ class ToolRegistry:
             },
             'reset_view': {
                 'function': common.reset_view,
+                'execution': 'inline',
                 'category': 'action',
-                'description': '重置视图到原始状态（从 vega_spec._original_spec 元数据读取）',
+                'description': '重置视图到原始状态（取 vega_spec._original_spec 或 _original_view 中保存的原视图）',
                 'params': {
                     'vega_spec': {'type': 'dict', 'required': True}
                 }
             },
             'undo_view': {
                 'function': common.undo_view,
+                'execution': 'inline',
                 'category': 'action',
                 'description': '撤销上一步视图，返回上一版本（从 vega_spec._spec_history 元数据读取）',
                 'params': {
@@ -225,10 +277,14 @@ class ToolRegistry:
             'detect_anomalies': {
                 'function': line_chart_tools.detect_anomalies,
                 'category': 'analysis',
-                'description': '检测异常点',
+                'cacheable': True,
+                'description': '检测异常点（按 color/detail 分序列；支持 zscore / rolling / mad）',
                 'params': {
                     'vega_spec': {'type': 'dict', 'required': True},
-                    'threshold': {'type': 'float', 'required': False, 'default': 2.0}
+                    'threshold': {'type': 'float', 'required': False, 'description': '阈值（默认 zscore/rolling 为 2.0，mad 为 3.5）'},
+                    'method': {'type': 'str', 'required': False, 'default': 'zscore', 'description': 'zscore | rolling | mad'},
+                    'window': {'type': 'int', 'required': False, 'default': 7, 'description': 'rolling 方法的窗口大小（点数）'},
+                    'line_field': {'type': 'str', 'required': False, 'description': '分组字段（可选，默认取 color/detail 编码字段）'}
                 }
             },
             'bold_lines': {
@@ -254,10 +310,13 @@ class ToolRegistry:
             'show_moving_average': {
                 'function': line_chart_tools.show_moving_average,
                 'category': 'analysis',
-                'description': '叠加移动平均线',
+                'cacheable': True,
+                'description': '叠加移动平均线（服务端按序列计算 mean / median / ewma，返回平滑序列）',
                 'params': {
                     'vega_spec': {'type': 'dict', 'required': True},
-                    'window_size': {'type': 'int', 'required': False, 'default': 3, 'description': '移动平均窗口大小'}
+                    'window_size': {'type': 'int', 'required': False, 'default': 3, 'description': '移动平均窗口大小'},
+                    'method': {'type': 'str', 'required': False, 'default': 'mean', 'description': 'mean | median | ewma'},
+                    'line_field': {'type': 'str', 'required': False, 'description': '分组字段（可选，默认取 color/detail 编码字段）'}
                 }
             },
             'focus_lines': {
@@ -272,6 +331,17 @@ class ToolRegistry:
                     'dim_opacity': {'type': 'float', 'required': False, 'default': 0.08, 'description': '非聚焦折线透明度（mode=dim）'}
                 }
             },
+            'focus_top_series': {
+                'function': line_chart_tools.focus_top_series,
+                'category': 'action',
+                'description': '只保留排名前 K 的折线，其余折叠为 Others 带（reset_view 还原）',
+                'params': {
+                    'vega_spec': {'type': 'dict', 'required': True},
+                    'top_k': {'type': 'int', 'required': False, 'default': 10, 'description': '保留的序列数'},
+                    'score': {'type': 'str', 'required': False, 'default': 'variance', 'description': 'variance | total | mean | latest | max'},
+                    'line_field': {'type': 'str', 'required': False, 'description': '分组字段（可选，默认取 color/detail 编码字段）'}
+                }
+            },
             'drilldown_line_time': {
                 'function': line_chart_tools.drilldown_line_time,
                 'category': 'action',
@@ -326,20 +396,39 @@ class ToolRegistry:
             'identify_clusters': {
                 'function': scatter_plot_tools.identify_clusters,
                 'category': 'analysis',
+                'cacheable': True,
                 'description': '识别聚类',
                 'params': {
                     'vega_spec': {'type': 'dict', 'required': True},
                     'n_clusters': {'type': 'int', 'required': False, 'default': 3},
-                    'method': {'type': 'str', 'required': False, 'default': 'kmeans'}
+                    'method': {'type': 'str', 'required': False, 'default': 'kmeans'},
+                    'k_range': {'type': 'list', 'required': False, 'description': '可选：一次扫描多个 k（如 [2,3,4,5,6]），返回惯性/轮廓系数并选用最佳 k'}
                 }
             },
             'calculate_correlation': {
                 'function': scatter_plot_tools.calculate_correlation,
                 'category': 'analysis',
+                'read_only': True,
+                'cacheable': True,
                 'description': '计算相关性',
                 'params': {
                     'vega_spec': {'type': 'dict', 'required': True},
-                    'method': {'type': 'str', 'required': False, 'default': 'pearson'}
+                    'method': {'type': 'str', 'required': False, 'default': 'pearson'},
+                    'use_full_data': {'type': 'bool', 'required': False, 'default': False, 'description': '在全量数据（full_data_path 或会话的全量数据）上精确计算（而非视图采样点）'}
+                }
+            },
+            'find_dense_regions': {
+                'function': scatter_plot_tools.find_dense_regions,
+                'category': 'analysis',
+                'read_only': True,
+                'cacheable': True,
+                'description': '自动发现密集区域：返回 top-k 个最密集矩形的 x_range/y_range 与点数（可直接用于 zoom_dense_area/select_region）',
+                'params': {
+                    'vega_spec': {'type': 'dict', 'required': True},
+                    'top_k': {'type': 'int', 'required': False, 'default': 3},
+                    'grid_size': {'type': 'int', 'required': False, 'default': 20, 'description': '每个轴的网格数'},
+                    'window': {'type': 'int', 'required': False, 'default': 2, 'description': '每个区域在每个轴上覆盖的网格数'},
+                    'use_full_data': {'type': 'bool', 'required': False, 'default': True}
                 }
             },
             'zoom_dense_area': {
@@ -385,10 +474,23 @@ class ToolRegistry:
             'show_regression': {
                 'function': scatter_plot_tools.show_regression,
                 'category': 'analysis',
-                'description': '叠加回归线',
+                'description': '叠加回归线（服务端拟合，返回系数与 R²）',
                 'params': {
                     'vega_spec': {'type': 'dict', 'required': True},
-                    'method': {'type': 'str', 'required': False, 'default': 'linear', 'description': '回归方法 (linear, log, exp, poly, quad)'}
+                    'method': {'type': 'str', 'required': False, 'default': 'linear', 'description': '回归方法 (linear, log, exp, poly, quad, loess)'},
+                    'use_full_data': {'type': 'bool', 'required': False, 'default': False, 'description': '在全量数据（full_data_path 或会话的全量数据）上拟合'}
+                }
+            },
+            'aggregate_density': {
+                'function': scatter_plot_tools.aggregate_density,
+                'category': 'action',
+                'description': '密度聚合：在当前视图范围与分辨率上对全量数据做二维直方图，输出 rect 图层（点数低于阈值时切回原始点）',
+                'params': {
+                    'vega_spec': {'type': 'dict', 'required': True},
+                    'mode': {'type': 'str', 'required': False, 'default': 'auto', 'description': 'auto | bins | points'},
+                    'cell_size': {'type': 'int', 'required': False, 'default': 10, 'description': '单元格像素大小'},
+                    'density_threshold': {'type': 'int', 'required': False, 'default': 5000, 'description': 'auto 模式下切换为聚合的点数阈值'},
+                    'use_full_data': {'type': 'bool', 'required': False, 'default': True}
                 }
             },
             'change_encoding': {
@@ -461,12 +563,14 @@ class ToolRegistry:
             'cluster_rows_cols': {
                 'function': heatmap_tools.cluster_rows_cols,
                 'category': 'action',
-                'description': '对行列进行聚类排序',
+                'description': '对行列做层次聚类（最优叶序）并按叶序重排，可返回树切分的簇',
                 'params': {
                     'vega_spec': {'type': 'dict', 'required': True},
                     'cluster_rows': {'type': 'bool', 'required': False, 'default': True},
                     'cluster_cols': {'type': 'bool', 'required': False, 'default': True},
-                    'method': {'type': 'str', 'required': False, 'default': 'sum'}
+                    'method': {'type': 'str', 'required': False, 'default': 'average', 'description': 'average | complete | single | ward（旧值 sum | mean | max 按聚合值排序）'},
+                    'metric': {'type': 'str', 'required': False, 'default': 'euclidean', 'description': 'euclidean | correlation | cosine'},
+                    'n_clusters': {'type': 'int', 'required': False, 'description': '树切分的簇数（可选）'}
                 }
             },
             'select_submatrix': {
@@ -482,6 +586,7 @@ class ToolRegistry:
             'find_extremes': {
                 'function': heatmap_tools.find_extremes,
                 'category': 'analysis',
+                'cacheable': True,
                 'description': '标记极值点位置',
                 'params': {
                     'vega_spec': {'type': 'dict', 'required': True},
@@ -554,6 +659,16 @@ class ToolRegistry:
         
         # 平行坐标图工具
         parallel_coords_tools_dict = {
+            'filter_dimension': {
+                'function': parallel_coordinates_tools.filter_dimension,
+                'category': 'action',
+                'description': '按维度的数值范围筛选数据',
+                'params': {
+                    'vega_spec': {'type': 'dict', 'required': True},
+                    'dimension': {'type': 'str', 'required': True, 'description': '维度名'},
+                    'range': {'type': 'list', 'required': True, 'description': '保留的数值范围 [min, max]'}
+                }
+            },
             'reorder_dimensions': {
                 'function': parallel_coordinates_tools.reorder_dimensions,
                 'category': 'action',
@@ -626,6 +741,8 @@ class ToolRegistry:
             'calculate_conversion_rate': {
                 'function': sankey_tools.calculate_conversion_rate,
                 'category': 'analysis',
+                'read_only': True,
+                'cacheable': True,
                 'description': '计算转化率：分析每个节点的入流、出流和转化率',
                 'params': {
                     'vega_spec': {'type': 'dict', 'required': True},
@@ -682,6 +799,8 @@ class ToolRegistry:
             'find_bottleneck': {
                 'function': sankey_tools.find_bottleneck,
                 'category': 'analysis',
+                'read_only': True,
+                'cacheable': True,
                 'description': '识别流失最严重的节点（瓶颈）',
                 'params': {
                     'vega_spec': {'type': 'dict', 'required': True},
@@ -742,6 +861,13 @@ class ToolRegistry:
     def list_all_tools(self) -> List[str]:
         """列出所有工具"""
         return list(self._tools.keys())
+    
+    def is_read_only(self, tool_name: str) -> bool:
+        """工具是否只读（感知类工具，或标记了 read_only 的分析类工具，不返回新的 vega_spec）"""
+        tool_info = self._tools.get(tool_name)
+        if not tool_info:
+            return False
+        return tool_info.get('category') == 'perception' or bool(tool_info.get('read_only', False))
 
 
 tool_registry = ToolRegistry()
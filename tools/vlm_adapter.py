@@ -9,27 +9,123 @@
 4. 改进参数描述
 """
 
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
+import copy
+import re
 from .tool_registry import tool_registry
 from config.chart_types import ChartType
 
 
+# 精简模式下工具描述 / 参数描述的最大长度（字符）
+COMPACT_DESCRIPTION_MAX_CHARS = 60
+COMPACT_PARAM_DESCRIPTION_MAX_CHARS = 40
+
+# 描述在这些分隔符处截断（取第一句 / 第一个子句）
+_DESCRIPTION_BREAK = re.compile(r'[。；;\n（(]|\. |⚠')
+
+
+def _shorten_description(text: str, max_chars: int) -> str:
+    """截取描述的第一句，并限制最大长度"""
+    if not text:
+        return ''
+    head = _DESCRIPTION_BREAK.split(text, maxsplit=1)[0].strip().rstrip('：:，,')
+    if not head:
+        head = text.strip()
+    if len(head) > max_chars:
+        head = head[:max_chars - 1].rstrip() + '…'
+    return head
+
+
+def _fix_mcp_schema(schema: Any) -> Any:
+    """补全 MCP inputSchema 中不完整的定义（递归），以通过 OpenAI / Qwen / Gemini 的校验"""
+    if not isinstance(schema, dict):
+        return schema
+    schema.pop('$ref', None)
+    schema.pop('nullable', None)
+    
+    schema_type = schema.get('type')
+    if schema_type == 'object':
+        props = schema.get('properties', {})
+        for prop_name, prop_def in props.items():
+            props[prop_name] = _fix_mcp_property(prop_def, prop_name)
+        schema['properties'] = props
+        schema.setdefault('additionalProperties', True)
+    
+    if schema_type == 'array':
+        if 'items' not in schema:
+            schema['items'] = {"type": "string"}
+        else:
+            schema['items'] = _fix_mcp_schema(schema['items'])
+    return schema
+
+
+def _fix_mcp_property(prop_def: Any, prop_name: str) -> Any:
+    """按参数名推断缺失的 array items 类型"""
+    if not isinstance(prop_def, dict):
+        return prop_def
+    if prop_def.get('type') == 'array' and 'items' not in prop_def:
+        name_lower = prop_name.lower()
+        if any(k in name_lower for k in ['range', 'position', 'coord', 'point', 'area', 'bbox']):
+            prop_def['items'] = {"type": "number"}
+        else:
+            prop_def['items'] = {"type": "string"}
+    return _fix_mcp_schema(prop_def)
+
+
+def _resolve_chart_type(chart_type: Any) -> Optional[ChartType]:
+    """字符串 / 枚举 -> ChartType；无法识别时为 None（不按图表类型过滤）"""
+    if chart_type is None or isinstance(chart_type, ChartType):
+        return chart_type
+    resolved = ChartType.from_string(str(chart_type))
+    return None if resolved == ChartType.UNKNOWN else resolved
+
+
 class VLMToolAdapter:
     """VLM工具适配器，支持多种格式"""
     
     def __init__(self):
         self.registry = tool_registry
+        # 按 (格式, 图表类型, 是否精简) 缓存生成的 schema，注册表不变时只生成一次
+        self._schema_cache: Dict[Tuple[Any, Optional[ChartType], bool], Any] = {}
+    
+    def clear_schema_cache(self):
+        """清空 schema 缓存（注册表变化后调用）"""
+        self._schema_cache.clear()
+    
+    def _cached(self, fmt: Any, chart_type: Optional[ChartType], compact: bool, builder):
+        """返回缓存的 schema 副本，未命中时调用 builder 生成"""
+        key = (fmt, chart_type, compact)
+        if key not in self._schema_cache:
+            self._schema_cache[key] = builder()
+        return copy.deepcopy(self._schema_cache[key])
     
-    def to_openai_format(self, chart_type: Optional[ChartType] = None) -> List[Dict[str, Any]]:
+    def _compact_schema(self, params_schema: Dict[str, Any]) -> Dict[str, Any]:
+        """精简参数 schema：缩短参数描述，去掉自动生成的占位描述和 title"""
+        params_schema.pop('title', None)
+        for prop_name, prop_def in params_schema.get('properties', {}).items():
+            prop_def.pop('title', None)
+            desc = prop_def.get('description', '')
+            if not desc or desc == f"{prop_name} 参数":
+                prop_def.pop('description', None)
+            else:
+                prop_def['description'] = _shorten_description(desc, COMPACT_PARAM_DESCRIPTION_MAX_CHARS)
+        return params_schema
+    
+    def to_openai_format(self, chart_type: Optional[ChartType] = None, compact: bool = False) -> List[Dict[str, Any]]:
         """
         转换为OpenAI function calling格式
         
         Args:
             chart_type: 图表类型，如果指定则只返回该类型的工具
+            compact: 是否生成精简版（缩短描述，减少提示词 token）
             
         Returns:
             OpenAI格式的工具列表
         """
+        return self._cached('openai', chart_type, compact,
+                            lambda: self._build_openai_format(chart_type, compact))
+    
+    def _build_openai_format(self, chart_type: Optional[ChartType], compact: bool) -> List[Dict[str, Any]]:
         tools = []
         
         # 获取工具列表
@@ -57,11 +153,16 @@ class VLMToolAdapter:
             # 🔧 修复：确保所有 array 和 object 类型的 schema 都完整
             self._fix_schema_types(params_schema)
             
+            description = tool_info['description']
+            if compact:
+                self._compact_schema(params_schema)
+                description = _shorten_description(description, COMPACT_DESCRIPTION_MAX_CHARS)
+            
             openai_tool = {
                 "type": "function",
                 "function": {
                     "name": tool_name,
-                    "description": tool_info['description'],
+                    "description": description,
                     "parameters": params_schema
                 }
             }
@@ -69,6 +170,79 @@ class VLMToolAdapter:
         
         return tools
     
+    def mcp_tools_for_run(self, mcp_tools, chart_type: Any = None) -> List[Dict[str, Any]]:
+        """
+        基准运行发给模型的工具列表（OpenAI 格式）
+        
+        默认为全部工具的完整描述，与历史运行可比；Settings.VLM_COMPACT_TOOLS 开启时
+        只保留 chart_type 的工具并使用精简描述
+        """
+        from config.settings import Settings
+        if Settings.VLM_COMPACT_TOOLS:
+            return self.mcp_tools_to_openai_format(mcp_tools, chart_type, compact=True)
+        return self.mcp_tools_to_openai_format(mcp_tools)
+    
+    def mcp_tools_to_openai_format(self, mcp_tools, chart_type: Any = None,
+                                   compact: bool = False) -> List[Dict[str, Any]]:
+        """
+        将 MCP 服务端的工具定义（list_tools 的结果）转换为 OpenAI function calling 格式
+        
+        - 跳过由客户端驱动的 spec_id 协议工具，并移除 vega_spec 参数
+        - 指定 chart_type 时只保留注册表中该图表类型的工具
+        - compact 为 True 时生成精简版，减少每轮请求的提示词 token
+        - 按 (图表类型, 是否精简, 工具名列表) 缓存，同一服务端的工具只转换一次
+        
+        Args:
+            mcp_tools: MCP 工具定义列表（含 name / description / inputSchema）
+            chart_type: 图表类型（ChartType 或字符串，如 "scatter_plot"）
+            compact: 是否生成精简版
+            
+        Returns:
+            OpenAI格式的工具列表
+        """
+        chart_type = _resolve_chart_type(chart_type)
+        names = tuple(tool.name for tool in mcp_tools)
+        return self._cached(('mcp_openai', names), chart_type, compact,
+                            lambda: self._build_mcp_openai_format(mcp_tools, chart_type, compact))
+    
+    def _build_mcp_openai_format(self, mcp_tools, chart_type: Optional[ChartType],
+                                 compact: bool) -> List[Dict[str, Any]]:
+        from .spec_client import SPEC_PROTOCOL_TOOLS
+        
+        allowed = set(self.registry.list_tools_for_chart(chart_type)) if chart_type else None
+        
+        tools = []
+        for tool in mcp_tools:
+            if tool.name in SPEC_PROTOCOL_TOOLS:
+                continue
+            if allowed is not None and tool.name not in allowed:
+                continue
+            
+            params_schema = _fix_mcp_schema(copy.deepcopy(tool.inputSchema) if tool.inputSchema else {
+                "type": "object",
+                "properties": {},
+                "required": []
+            })
+            params_schema.get('properties', {}).pop('vega_spec', None)
+            if 'vega_spec' in params_schema.get('required', []):
+                params_schema['required'].remove('vega_spec')
+            
+            description = tool.description or ""
+            if compact:
+                self._compact_schema(params_schema)
+                description = _shorten_description(description, COMPACT_DESCRIPTION_MAX_CHARS)
+            
+            tools.append({
+                "type": "function",
+                "function": {
+                    "name": tool.name,
+                    "description": description,
+                    "parameters": params_schema
+                }
+            })
+        
+        return tools
+    
     def _fix_schema_types(self, schema: Dict[str, Any]) -> None:
         """
         修复 JSON Schema 中的类型定义问题
@@ -102,16 +276,21 @@ class VLMToolAdapter:
                 if 'properties' not in prop_def and 'additionalProperties' not in prop_def:
                     prop_def['additionalProperties'] = True
     
-    def to_anthropic_format(self, chart_type: Optional[ChartType] = None) -> List[Dict[str, Any]]:
+    def to_anthropic_format(self, chart_type: Optional[ChartType] = None, compact: bool = False) -> List[Dict[str, Any]]:
         """
         转换为Anthropic (Claude) tool use格式
         
         Args:
             chart_type: 图表类型
+            compact: 是否生成精简版（缩短描述，减少提示词 token）
             
         Returns:
             Anthropic格式的工具列表
         """
+        return self._cached('anthropic', chart_type, compact,
+                            lambda: self._build_anthropic_format(chart_type, compact))
+    
+    def _build_anthropic_format(self, chart_type: Optional[ChartType], compact: bool) -> List[Dict[str, Any]]:
         tools = []
         
         # 获取工具列表
@@ -137,9 +316,14 @@ class VLMToolAdapter:
             # 修复 schema 类型
             self._fix_schema_types(params_schema)
             
+            description = tool_info['description']
+            if compact:
+                self._compact_schema(params_schema)
+                description = _shorten_description(description, COMPACT_DESCRIPTION_MAX_CHARS)
+            
             anthropic_tool = {
                 "name": tool_name,
-                "description": tool_info['description'],
+                "description": description,
                 "input_schema": params_schema
             }
             tools.append(anthropic_tool)
@@ -156,6 +340,10 @@ class VLMToolAdapter:
         Returns:
             通用格式的工具列表
         """
+        return self._cached('generic', chart_type, False,
+                            lambda: self._build_generic_format(chart_type))
+    
+    def _build_generic_format(self, chart_type: Optional[ChartType]) -> List[Dict[str, Any]]:
         tools = []
         
         # 获取工具列表
@@ -208,6 +396,10 @@ class VLMToolAdapter:
         Returns:
             格式化的工具描述字符串
         """
+        return self._cached('prompt', chart_type, False,
+                            lambda: self._build_prompt_string(chart_type))
+    
+    def _build_prompt_string(self, chart_type: Optional[ChartType]) -> str:
         tools = self.to_generic_format(chart_type)
         
         prompt_parts = ["# Available Tools\n"]